@@ -1,14 +1,44 @@
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+from cachetools import TLRUCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.database import get_db
-from db.users import get_by_username
+from config import PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS
+from db.database import get_async_db
+from db.table_models import UserDB
 from auth.jwt_handler import decode_access_token
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user, as far as request handlers need it. Detached from any DB session."""
+
+    id: uuid.UUID
+    username: str
+
+
+# Verified tokens map to their principal for a short TTL, never past the token's
+# own exp, so polling clients skip both the JWT decode and the users lookup.
+# Each worker process has its own cache: after a deletion or password change,
+# other workers may serve the old principal for up to PRINCIPAL_CACHE_TTL_SECONDS.
+_principal_cache = TLRUCache(
+    maxsize=PRINCIPAL_CACHE_SIZE,
+    ttu=lambda token, entry, now: min(now + PRINCIPAL_CACHE_TTL_SECONDS, entry[1]),
+    timer=time.time,
+)
+_principal_cache_lock = threading.Lock()
+_principal_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+async def _resolve(token: str, db: AsyncSession) -> tuple:
     payload = decode_access_token(token)
     if not payload:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
@@ -17,8 +47,55 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     if not username:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
 
-    user = get_by_username(db, username)
-    if user is None:
+    # Tokens issued before "uid" was added still resolve by username.
+    try:
+        user_id = uuid.UUID(payload["uid"]) if "uid" in payload else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
+    if user_id:
+        user = await db.get(UserDB, user_id)
+    else:
+        user = (await db.execute(select(UserDB).where(UserDB.username == username))).scalar_one_or_none()
+    if user is None or user.username != username:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
 
-    return user
+    return Principal(id=user.id, username=user.username), payload["exp"]
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> Principal:
+    """
+    Async, so every route resolves its caller on the event loop; the session only
+    checks out a pooled connection on a cache miss.
+    """
+    with _principal_cache_lock:
+        entry = _principal_cache.get(token)
+        if entry is not None:
+            _principal_cache_stats["hits"] += 1
+            return entry[0]
+        _principal_cache_stats["misses"] += 1
+
+    entry = await _resolve(token, db)
+    with _principal_cache_lock:
+        _principal_cache[token] = entry
+    return entry[0]
+
+
+def invalidate_principal(user_id: uuid.UUID) -> None:
+    """Drops every cached token of ``user_id`` in this process."""
+    with _principal_cache_lock:
+        tokens = [token for token, (principal, _) in _principal_cache.items() if principal.id == user_id]
+        for token in tokens:
+            del _principal_cache[token]
+        _principal_cache_stats["invalidations"] += len(tokens)
+
+
+def get_principal_cache_stats() -> dict:
+    with _principal_cache_lock:
+        lookups = _principal_cache_stats["hits"] + _principal_cache_stats["misses"]
+        return {
+            **_principal_cache_stats,
+            "size": len(_principal_cache),
+            "maxsize": _principal_cache.maxsize,
+            "ttl_seconds": PRINCIPAL_CACHE_TTL_SECONDS,
+            "hit_rate": round(_principal_cache_stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
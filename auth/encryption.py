@@ -1,12 +1,64 @@
 import base64
+import threading
+
+from cachetools import TTLCache
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
 
-def get_user_fernet_key(username: str) -> bytes:
+from config import FERNET_KEY_CACHE_SIZE, FERNET_KEY_CACHE_TTL_SECONDS
+
+PBKDF2_ITERATIONS = 390000
+
+# Derived keys are kept in-process so PBKDF2 runs once per user per TTL window
+# instead of on every upload, download and extraction.
+_key_cache = TTLCache(maxsize=FERNET_KEY_CACHE_SIZE, ttl=FERNET_KEY_CACHE_TTL_SECONDS)
+_key_cache_lock = threading.Lock()
+_key_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def derive_user_fernet_key(username: str) -> bytes:
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
         length=32,
         salt=b"",
-        iterations=390000,
+        iterations=PBKDF2_ITERATIONS,
     )
     return base64.urlsafe_b64encode(kdf.derive(username.encode()))
+
+
+def get_user_fernet_key(username: str) -> bytes:
+    with _key_cache_lock:
+        key = _key_cache.get(username)
+        if key is not None:
+            _key_cache_stats["hits"] += 1
+            return key
+        _key_cache_stats["misses"] += 1
+
+    # Derive outside the lock so one slow PBKDF2 run doesn't serialize every user.
+    key = derive_user_fernet_key(username)
+    with _key_cache_lock:
+        _key_cache[username] = key
+    return key
+
+
+def invalidate_user_fernet_key(username: str) -> None:
+    with _key_cache_lock:
+        if _key_cache.pop(username, None) is not None:
+            _key_cache_stats["invalidations"] += 1
+
+
+def clear_fernet_key_cache() -> None:
+    with _key_cache_lock:
+        _key_cache.clear()
+
+
+def get_key_cache_stats() -> dict:
+    with _key_cache_lock:
+        lookups = _key_cache_stats["hits"] + _key_cache_stats["misses"]
+        return {
+            **_key_cache_stats,
+            "size": len(_key_cache),
+            "maxsize": _key_cache.maxsize,
+            "ttl_seconds": _key_cache.ttl,
+            "hit_rate": round(_key_cache_stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
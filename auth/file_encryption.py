@@ -0,0 +1,221 @@
+"""Chunked authenticated encryption for stored invoice blobs.
+
+Container layout (version 1):
+
+    header  = MAGIC (7) | version (1) | chunk_size (u32 BE) | nonce_prefix (7)
+    record  = ciphertext_length (u32 BE) | AES-256-GCM(chunk) incl. 16 byte tag
+
+Every chunk except the last holds exactly ``chunk_size`` plaintext bytes. The
+nonce of chunk ``i`` is ``nonce_prefix | i (u32 BE) | last_flag`` and the header
+is bound as associated data, so reordering, truncation and appending are all
+detected. Files written before this format are single Fernet tokens and are
+still readable through the same functions.
+"""
+import base64
+import os
+import struct
+from typing import BinaryIO, Callable, Iterator, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from config import FILE_ENCRYPTION_CHUNK_SIZE
+
+MAGIC = b"SQAIENC"
+VERSION = 1
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+HEADER_STRUCT = struct.Struct(">7sBI7s")
+HEADER_SIZE = HEADER_STRUCT.size
+LENGTH_STRUCT = struct.Struct(">I")
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class DecryptionError(ValueError):
+    pass
+
+
+def derive_stream_key(fernet_key: bytes) -> bytes:
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"sqai-file-stream-v1",
+    )
+    return hkdf.derive(base64.urlsafe_b64decode(fernet_key))
+
+
+def _nonce(prefix: bytes, index: int, last: bool) -> bytes:
+    return prefix + struct.pack(">IB", index, 1 if last else 0)
+
+
+def is_stream_container(head: bytes) -> bool:
+    return head[:len(MAGIC)] == MAGIC
+
+
+def encrypt_stream(
+    src: BinaryIO,
+    dst: BinaryIO,
+    fernet_key: bytes,
+    chunk_size: int = FILE_ENCRYPTION_CHUNK_SIZE,
+    on_chunk: Optional[Callable[[bytes], None]] = None,
+) -> int:
+    """
+    Encrypts ``src`` into ``dst`` one chunk at a time.
+
+    Only the current chunk and a one-chunk lookahead (needed to flag the last
+    record) are held in memory, regardless of the file size.
+
+    Returns:
+        The number of plaintext bytes written.
+    """
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"chunk_size must be between 1 and {MAX_CHUNK_SIZE}")
+
+    aead = AESGCM(derive_stream_key(fernet_key))
+    header = HEADER_STRUCT.pack(MAGIC, VERSION, chunk_size, os.urandom(NONCE_PREFIX_SIZE))
+    prefix = header[-NONCE_PREFIX_SIZE:]
+    dst.write(header)
+
+    total = 0
+    index = 0
+    current = src.read(chunk_size)
+    while True:
+        following = src.read(chunk_size) if len(current) == chunk_size else b""
+        last = not following
+        if on_chunk is not None and current:
+            on_chunk(current)
+        sealed = aead.encrypt(_nonce(prefix, index, last), current, header)
+        dst.write(LENGTH_STRUCT.pack(len(sealed)))
+        dst.write(sealed)
+        total += len(current)
+        if last:
+            return total
+        current = following
+        index += 1
+
+
+def _read_header(src: BinaryIO) -> tuple[bytes, int, bytes]:
+    header = src.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE:
+        raise DecryptionError("Truncated file header.")
+    magic, version, chunk_size, prefix = HEADER_STRUCT.unpack(header)
+    if magic != MAGIC or version != VERSION or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise DecryptionError("Unsupported encrypted file format.")
+    return header, chunk_size, prefix
+
+
+def iter_decrypt_stream(src: BinaryIO, fernet_key: bytes) -> Iterator[bytes]:
+    """Yields plaintext chunks from a version 1 container, verifying each one."""
+    header, chunk_size, prefix = _read_header(src)
+    aead = AESGCM(derive_stream_key(fernet_key))
+
+    index = 0
+    while True:
+        raw_length = src.read(LENGTH_STRUCT.size)
+        if len(raw_length) != LENGTH_STRUCT.size:
+            raise DecryptionError("Encrypted file is truncated.")
+        (length,) = LENGTH_STRUCT.unpack(raw_length)
+        if not TAG_SIZE <= length <= chunk_size + TAG_SIZE:
+            raise DecryptionError("Corrupted chunk length.")
+        sealed = src.read(length)
+        if len(sealed) != length:
+            raise DecryptionError("Encrypted file is truncated.")
+
+        # A full-size chunk may or may not be the last one; a short one must be.
+        last = length < chunk_size + TAG_SIZE
+        try:
+            plaintext = aead.decrypt(_nonce(prefix, index, last), sealed, header)
+        except InvalidTag:
+            if last:
+                raise DecryptionError("Invalid decryption key or corrupted file.")
+            try:
+                plaintext = aead.decrypt(_nonce(prefix, index, True), sealed, header)
+            except InvalidTag:
+                raise DecryptionError("Invalid decryption key or corrupted file.")
+            last = True
+
+        yield plaintext
+        if last:
+            if src.read(1):
+                raise DecryptionError("Unexpected data after final chunk.")
+            return
+        index += 1
+
+
+def iter_decrypt_file(src: BinaryIO, fernet_key: bytes) -> Iterator[bytes]:
+    """Yields plaintext chunks from either a chunked container or a legacy Fernet token."""
+    head = src.read(len(MAGIC))
+    src.seek(0)
+    if is_stream_container(head):
+        yield from iter_decrypt_stream(src, fernet_key)
+        return
+
+    try:
+        yield Fernet(fernet_key).decrypt(src.read())
+    except InvalidToken:
+        raise DecryptionError("Invalid decryption key or corrupted file.")
+
+
+def decrypt_file_bytes(src: BinaryIO, fernet_key: bytes) -> bytes:
+    return b"".join(iter_decrypt_file(src, fernet_key))
+
+
+class PlaintextView:
+    """
+    Random-access, chunk-by-chunk reader over an encrypted blob.
+
+    For the chunked container the plaintext size and the position of every
+    record follow from the file size alone, so a byte range only decrypts the
+    records it overlaps. Legacy Fernet blobs have to be decrypted up front.
+    """
+
+    def __init__(self, src: BinaryIO, fernet_key: bytes):
+        self._src = src
+        self._legacy_data: Optional[bytes] = None
+
+        head = src.read(len(MAGIC))
+        src.seek(0)
+        if not is_stream_container(head):
+            self._legacy_data = b"".join(iter_decrypt_file(src, fernet_key))
+            self.size = len(self._legacy_data)
+            return
+
+        self._header, self._chunk_size, self._prefix = _read_header(src)
+        self._aead = AESGCM(derive_stream_key(fernet_key))
+        self._record_size = LENGTH_STRUCT.size + self._chunk_size + TAG_SIZE
+
+        body = src.seek(0, os.SEEK_END) - HEADER_SIZE
+        self._chunk_count = max(1, -(-body // self._record_size))
+        last_record = body - (self._chunk_count - 1) * self._record_size
+        if last_record < LENGTH_STRUCT.size + TAG_SIZE:
+            raise DecryptionError("Encrypted file is truncated.")
+        self.size = (self._chunk_count - 1) * self._chunk_size + last_record - LENGTH_STRUCT.size - TAG_SIZE
+
+    def _decrypt_chunk(self, index: int) -> bytes:
+        self._src.seek(HEADER_SIZE + index * self._record_size)
+        (length,) = LENGTH_STRUCT.unpack(self._src.read(LENGTH_STRUCT.size))
+        sealed = self._src.read(length)
+        last = index == self._chunk_count - 1
+        try:
+            return self._aead.decrypt(_nonce(self._prefix, index, last), sealed, self._header)
+        except InvalidTag:
+            raise DecryptionError("Invalid decryption key or corrupted file.")
+
+    def iter_range(self, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+        """Yields the plaintext bytes in ``[start, stop)``."""
+        stop = self.size if stop is None else min(stop, self.size)
+        if start >= stop:
+            return
+
+        if self._legacy_data is not None:
+            yield self._legacy_data[start:stop]
+            return
+
+        for index in range(start // self._chunk_size, (stop - 1) // self._chunk_size + 1):
+            chunk_start = index * self._chunk_size
+            chunk = self._decrypt_chunk(index)
+            yield chunk[max(start - chunk_start, 0):stop - chunk_start]
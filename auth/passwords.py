@@ -0,0 +1,104 @@
+"""bcrypt on a dedicated, size-limited executor.
+
+bcrypt is deliberately slow and releases the GIL, so it runs on
+PASSWORD_HASH_WORKERS threads of its own rather than on the request
+threadpool. At most PASSWORD_HASH_MAX_PENDING jobs may be running or queued.
+Past that, PasswordHasherBusy is raised immediately, and the caller sheds the
+request. A credential-stuffing burst then costs a few cores and fast 503s,
+instead of every request thread of the API.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+from config import BCRYPT_ROUNDS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_WORKERS
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+_stats_lock = threading.Lock()
+_stats = {"hashes": 0, "verifications": 0, "rehashes": 0, "rejected": 0}
+_pending = 0
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _count(name: str, amount: int = 1):
+    global _pending
+    with _stats_lock:
+        if name == "pending":
+            _pending += amount
+        else:
+            _stats[name] += amount
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        _count("rejected")
+        raise PasswordHasherBusy("Too many password checks in progress.")
+    _count("pending")
+    try:
+        return _executor.submit(fn, *args).result()
+    finally:
+        _count("pending", -1)
+        _slots.release()
+
+
+def _hash(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+# Checked when the user doesn't exist, so unknown usernames take as long as wrong passwords.
+_DUMMY_HASH = _hash("dummy-password-for-timing")
+
+
+def hash_password(password: str) -> str:
+    """Raises PasswordHasherBusy when the executor is saturated."""
+    _count("hashes")
+    return _run(_hash, password)
+
+
+def verify_password(password: str, hashed_password: str | None) -> bool:
+    """Raises PasswordHasherBusy when the executor is saturated. A missing hash still costs one bcrypt check."""
+    _count("verifications")
+    ok = _run(bcrypt.checkpw, password.encode('utf-8'), (hashed_password or _DUMMY_HASH).encode('utf-8'))
+    return ok and hashed_password is not None
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """True when the hash was made with a cost other than BCRYPT_ROUNDS ("$2b$<rounds>$...")."""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def upgraded_hash(password: str, hashed_password: str) -> Optional[str]:
+    """
+    A new hash at the current cost, for a password that was just verified against ``hashed_password``.
+
+    Returns None when no rehash is needed, or when the executor is saturated;
+    the upgrade is then retried on a later login rather than failing this one.
+    """
+    if not needs_rehash(hashed_password):
+        return None
+    try:
+        new_hash = hash_password(password)
+    except PasswordHasherBusy:
+        return None
+    _count("rehashes")
+    return new_hash
+
+
+def get_password_hashing_stats() -> dict:
+    with _stats_lock:
+        return {
+            **_stats,
+            "workers": PASSWORD_HASH_WORKERS,
+            "max_pending": PASSWORD_HASH_MAX_PENDING,
+            "pending": _pending,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+        }
@@ -0,0 +1,42 @@
+"""Per-request CPU cost of deriving the user's Fernet key, with and without the cache.
+
+Run from the repo root:
+    python -m benchmarks.bench_fernet_key_cache --requests 20
+"""
+import argparse
+import time
+
+from auth.encryption import (
+    clear_fernet_key_cache,
+    derive_user_fernet_key,
+    get_key_cache_stats,
+    get_user_fernet_key,
+)
+
+
+def _cpu_ms_per_call(fn, username: str, requests: int) -> float:
+    start = time.process_time()
+    for _ in range(requests):
+        fn(username)
+    return (time.process_time() - start) * 1000 / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--username", default="bench-user")
+    args = parser.parse_args()
+
+    uncached = _cpu_ms_per_call(derive_user_fernet_key, args.username, args.requests)
+
+    clear_fernet_key_cache()
+    cached = _cpu_ms_per_call(get_user_fernet_key, args.username, args.requests)
+
+    print(f"requests:           {args.requests}")
+    print(f"before (PBKDF2):    {uncached:.3f} ms CPU/request")
+    print(f"after  (cached):    {cached:.3f} ms CPU/request (first call pays the derivation)")
+    print(f"cache stats:        {get_key_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Decode + preprocess cost of the old temp-file pipeline vs the in-memory one.
+
+Run from the repo root (add --ocr to include Tesseract in both paths):
+    python -m benchmarks.bench_inmemory_pipeline --iterations 50
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from models.invoice_extraction_model import (
+    decode_image_bytes,
+    extract_text_from_array,
+    extract_text_from_image,
+    preprocess_image_array,
+    preprocess_image_for_ocr,
+)
+
+
+def _synthetic_invoice(width: int = 2480, height: int = 3508) -> bytes:
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    for row, line in enumerate(["INVOICE", "Invoice No: INV-1042", "Date: 2024-03-01", "Total: 1,180.00"]):
+        cv2.putText(img, line, (150, 300 + row * 160), cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 6)
+    ok, encoded = cv2.imencode(".png", img)
+    return encoded.tobytes()
+
+
+def _via_temp_files(image_bytes: bytes, workdir: str, ocr: bool):
+    decrypted_path = os.path.join(workdir, "decrypted.png")
+    processed_path = os.path.join(workdir, "processed.png")
+    with open(decrypted_path, "wb") as f:
+        f.write(image_bytes)
+    preprocess_image_for_ocr(decrypted_path, processed_path)
+    if ocr:
+        extract_text_from_image(processed_path)
+    else:
+        Image.open(processed_path).load()
+    os.remove(decrypted_path)
+    os.remove(processed_path)
+
+
+def _in_memory(image_bytes: bytes, workdir: str, ocr: bool):
+    processed = preprocess_image_array(decode_image_bytes(image_bytes))
+    if ocr:
+        extract_text_from_array(processed)
+
+
+def _ms_per_call(fn, image_bytes: bytes, workdir: str, ocr: bool, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(image_bytes, workdir, ocr)
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--ocr", action="store_true")
+    args = parser.parse_args()
+
+    image_bytes = _synthetic_invoice()
+    with tempfile.TemporaryDirectory() as workdir:
+        disk = _ms_per_call(_via_temp_files, image_bytes, workdir, args.ocr, args.iterations)
+        memory = _ms_per_call(_in_memory, image_bytes, workdir, args.ocr, args.iterations)
+
+    print(f"image size:          {len(image_bytes) / 1024:.0f} KiB (A4 @ 300 dpi)")
+    print(f"temp-file pipeline:  {disk:.1f} ms/invoice")
+    print(f"in-memory pipeline:  {memory:.1f} ms/invoice")
+    print(f"saved:               {disk - memory:.1f} ms/invoice ({(1 - memory / disk) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
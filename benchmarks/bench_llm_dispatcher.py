@@ -0,0 +1,64 @@
+"""Throughput of the async LLM dispatcher against the fake Gemini server.
+
+Compares one blocking call per invoice (the old path) with the dispatcher,
+with and without packing, under injected latency and 429s:
+
+    python -m benchmarks.bench_llm_dispatcher --invoices 40 --latency-ms 300 --rate-limit-ratio 0.1
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.fake_gemini_server import start_fake_gemini_server
+from models.llm_dispatcher import GeminiRestClient, LlmDispatcher
+
+
+def _invoices(count: int) -> list:
+    return [f"ACME Corp\nInvoice No: INV-{i:04d}\nDate: 2024-03-01\nTotal: {100 + i}.00" for i in range(count)]
+
+
+async def _sequential(base_url: str, texts: list) -> list:
+    dispatcher = LlmDispatcher(GeminiRestClient(base_url=base_url, api_key="fake"), max_concurrency=1, pack_max_items=1)
+    return [await dispatcher.extract(text) for text in texts]
+
+
+async def _dispatched(base_url: str, texts: list, pack_max_items: int) -> tuple:
+    dispatcher = LlmDispatcher(
+        GeminiRestClient(base_url=base_url, api_key="fake"),
+        requests_per_minute=6000,
+        pack_max_items=pack_max_items,
+    )
+    results = await dispatcher.extract_many(texts)
+    await dispatcher.client.aclose()
+    return results, dispatcher.stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--invoices", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.1)
+    parser.add_argument("--pack", type=int, default=5)
+    args = parser.parse_args()
+
+    server, server_stats = start_fake_gemini_server(latency_ms=args.latency_ms, rate_limit_ratio=args.rate_limit_ratio)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    texts = _invoices(args.invoices)
+
+    start = time.perf_counter()
+    asyncio.run(_sequential(base_url, texts))
+    print(f"sequential:            {time.perf_counter() - start:6.2f} s")
+
+    for pack in (1, args.pack):
+        start = time.perf_counter()
+        results, stats = asyncio.run(_dispatched(base_url, texts, pack))
+        elapsed = time.perf_counter() - start
+        correct = sum(r.get("invoice_number") == f"INV-{i:04d}" for i, r in enumerate(results))
+        print(f"dispatcher (pack={pack}):  {elapsed:6.2f} s  correct={correct}/{len(texts)}  {stats}")
+
+    print(f"server: {server_stats}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Throughput and latency of the local SmolLM extractor per dynamic batch size.
+
+Needs torch, transformers and the model at LOCAL_LLM_MODEL_PATH. For each
+--batch-sizes value, a fresh DynamicBatcher is fed --requests invoices from
+as many concurrent threads, and its per-batch-size stats are printed along
+with generated tokens per invoice and JSON parse failures. Set
+LOCAL_LLM_PREFIX_CACHE / LOCAL_LLM_CONSTRAINED_DECODING to false to compare:
+
+    python -m benchmarks.bench_local_llm_batching --requests 32 --batch-sizes 1,4,8
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_regex_rules import synthetic_invoice
+from models import extract_entities
+from models.extract_entities import DynamicBatcher, load_model, run_batch
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--batch-sizes", default="1,2,4,8")
+    parser.add_argument("--max-wait-ms", type=int, default=25)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    load_model()
+    print(f"model load: {time.perf_counter() - started:.1f}s")
+
+    rng = random.Random(args.seed)
+    # Short invoices keep the run bounded; the batching effect doesn't depend on length.
+    corpus = [synthetic_invoice(rng)[:600] for _ in range(args.requests)]
+
+    for max_batch_size in map(int, args.batch_sizes.split(",")):
+        batcher = DynamicBatcher(run_batch, max_batch_size=max_batch_size, max_wait_ms=args.max_wait_ms)
+        tokens_before = extract_entities._stats["generated_tokens"]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.requests) as pool:
+            outcomes = list(pool.map(lambda text: batcher.submit(text).exception(), corpus))
+        elapsed = time.perf_counter() - started
+        failures = sum(1 for outcome in outcomes if outcome is not None)
+        tokens = (extract_entities._stats["generated_tokens"] - tokens_before) / args.requests
+        print(f"\nmax_batch_size={max_batch_size}: {args.requests / elapsed:.2f} invoices/s overall, "
+              f"{tokens:.0f} generated tokens/invoice, {failures} invalid JSON")
+        for size, stats in batcher.get_stats().items():
+            print(f"  batch of {size:2d}: {stats['batches']:3d} batches  {stats['items_per_second']} items/s  "
+                  f"avg latency {stats['avg_latency_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""OCR input size and time: plain Otsu vs the adaptive page normalization.
+
+Synthesizes a skewed invoice photo with wide margins, optionally with a
+lighting gradient, at --dpi, then runs models/image_preprocessing.normalize
+with every step off (the old grayscale + Otsu path), with each step alone,
+and with all of them. Add --ocr to also time Tesseract on each output and
+score the text against the ground truth:
+
+    python -m benchmarks.bench_preprocessing --dpi 600 --skew 3 --uneven --ocr
+"""
+import argparse
+import difflib
+import time
+
+import cv2
+import numpy as np
+
+from models.image_preprocessing import normalize
+
+LINES = [
+    "ACME Industrial Supplies Pvt Ltd",
+    "GSTIN: 29ABCDE1234F1Z5",
+    "Invoice No: INV-2024-1042",
+    "Invoice Date: 01/03/2024   Due Date: 31/03/2024",
+    "Bill To: Globex Retail, 12 MG Road, Bengaluru",
+    "Description            Qty   Rate      Amount",
+    "Steel brackets 40mm     120   12.50    1,500.00",
+    "Hex bolts M8 (box)       30   45.00    1,350.00",
+    "Anchor plates            16   80.00    1,280.00",
+    "Subtotal                                4,130.00",
+    "CGST @ 9%                                 371.70",
+    "SGST @ 9%                                 371.70",
+    "Total Amount Due                      INR 4,873.40",
+]
+
+VARIANTS = {
+    "otsu only (old)": dict(rescale=False, deskew=False, crop=False, adaptive_threshold=False),
+    "rescale": dict(rescale=True, deskew=False, crop=False, adaptive_threshold=False),
+    "deskew": dict(rescale=False, deskew=True, crop=False, adaptive_threshold=False),
+    "crop": dict(rescale=False, deskew=False, crop=True, adaptive_threshold=False),
+    "adaptive threshold": dict(rescale=False, deskew=False, crop=False, adaptive_threshold=True),
+    "all steps": dict(rescale=True, deskew=True, crop=True, adaptive_threshold=True),
+}
+
+
+def synthetic_photo(dpi: int, skew: float, uneven: bool) -> np.ndarray:
+    """Grayscale, as decode_image_bytes returns it."""
+    scale = dpi / 300
+    width, height = int(2480 * scale), int(3508 * scale)
+    page = np.full((height, width), 235, dtype=np.uint8)
+    # Body text roughly 10 pt: HERSHEY_SIMPLEX at 1.0 is ~22 px cap height at 300 dpi.
+    for row, line in enumerate(LINES):
+        origin = (int(560 * scale), int((900 + row * 70) * scale))
+        cv2.putText(page, line, origin, cv2.FONT_HERSHEY_SIMPLEX, 1.0 * scale, 30, max(int(2 * scale), 1), cv2.LINE_AA)
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), skew, 1.0)
+    page = cv2.warpAffine(page, matrix, (width, height), flags=cv2.INTER_LINEAR, borderValue=235)
+    if uneven:
+        # A shadow falling off from the left edge, as under a desk lamp.
+        shade = np.linspace(0.45, 1.0, width, dtype=np.float32)[None, :]
+        page = (page.astype(np.float32) * shade).astype(np.uint8)
+    return page
+
+
+def _similarity(text: str) -> float:
+    return difflib.SequenceMatcher(None, " ".join(text.split()), " ".join(" ".join(LINES).split())).ratio()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dpi", type=int, default=600)
+    parser.add_argument("--skew", type=float, default=3.0, help="Degrees of rotation in the synthetic photo.")
+    parser.add_argument("--uneven", action="store_true", help="Add a lighting gradient.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ocr", action="store_true", help="Also run Tesseract on each output.")
+    args = parser.parse_args()
+
+    photo = synthetic_photo(args.dpi, args.skew, args.uneven)
+    print(f"input: {photo.shape[1]}x{photo.shape[0]} at {args.dpi} dpi, skew {args.skew} deg, uneven={args.uneven}")
+    if args.ocr:
+        import pytesseract
+        from config import TESSERACT_CMD
+
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+    for name, steps in VARIANTS.items():
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            out = normalize(photo, **steps)
+            timings.append((time.perf_counter() - start) * 1000)
+        line = f"{name:20s} preprocess {min(timings):7.1f} ms   output {out.shape[1]:5d}x{out.shape[0]:<5d} {out.size / 1e6:6.2f} MP"
+        if args.ocr:
+            start = time.perf_counter()
+            text = pytesseract.image_to_string(out)
+            line += f"   ocr {(time.perf_counter() - start) * 1000:7.0f} ms   text match {_similarity(text):.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Local stand-in for the Gemini generateContent REST endpoint.
+
+Answers with plausible extraction JSON (a JSON array for packed prompts),
+after an injected latency, and returns 429 with Retry-After for a chosen
+fraction of requests. Point GEMINI_API_BASE_URL at it:
+
+    python -m benchmarks.fake_gemini_server --port 8089 --latency-ms 800 --rate-limit-ratio 0.1
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_INVOICE_HEADER = re.compile(r"### INVOICE (\d+) ###")
+_INVOICE_NUMBER = re.compile(r"Invoice No\s*[:#]?\s*([A-Za-z0-9\-/]+)", re.IGNORECASE)
+
+
+def _fields(text: str) -> dict:
+    match = _INVOICE_NUMBER.search(text)
+    return {"invoice_number": match.group(1) if match else None, "total_amount": None, "line_items": []}
+
+
+def _answer(prompt: str) -> str:
+    sections = _INVOICE_HEADER.split(prompt)
+    if len(sections) == 1:
+        return json.dumps(_fields(prompt))
+    # split() yields [preamble, index, body, index, body, ...]
+    return json.dumps([{"index": int(index), **_fields(body)} for index, body in zip(sections[1::2], sections[2::2])])
+
+
+def make_handler(latency_ms: float, jitter_ms: float, rate_limit_ratio: float, stats: dict):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            time.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+            stats["requests"] += 1
+
+            if random.random() < rate_limit_ratio:
+                stats["rate_limited"] += 1
+                self.send_response(429)
+                self.send_header("Retry-After", "1")
+                self.end_headers()
+                return
+
+            prompt = body["contents"][0]["parts"][0]["text"]
+            payload = json.dumps({"candidates": [{"content": {"parts": [{"text": _answer(prompt)}]}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_fake_gemini_server(port: int = 0, latency_ms: float = 500, jitter_ms: float = 100, rate_limit_ratio: float = 0.0):
+    """Starts the server on a background thread. Returns (server, stats); server.server_port has the bound port."""
+    stats = {"requests": 0, "rate_limited": 0}
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency_ms, jitter_ms, rate_limit_ratio, stats))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, _ = start_fake_gemini_server(args.port, args.latency_ms, args.jitter_ms, args.rate_limit_ratio)
+    print(f"Fake Gemini listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pydantic import BaseModel
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import (
+    EXTRACTION_BATCH_MAX_FILES,
+    EXTRACTION_BATCH_WORKERS,
+    EXTRACTION_RECOVERY_INTERVAL_SECONDS,
+    EXTRACTION_STALE_AFTER_SECONDS,
+)
+from db import progress
+from db.database import SessionLocal
+from db.extracted import run_extraction
+from db.table_models import ExtractedFileDB, ExtractionBatchDB, ExtractionStatus, FileDB, UserDB
+
+# Bounded pool shared by every batch in this process, so a huge batch queues
+# instead of spawning one thread per invoice. The queue itself is in memory;
+# what a dead process had claimed is picked up again by requeue_stale().
+_executor = ThreadPoolExecutor(max_workers=EXTRACTION_BATCH_WORKERS, thread_name_prefix="extract-batch")
+_recovery_lock = threading.Lock()
+_recovery_thread = None
+
+
+class BatchCreateRequest(BaseModel):
+    file_ids: Optional[List[uuid.UUID]] = None
+    all_pending: bool = False
+    force: bool = False
+    bypass_llm_cache: bool = False
+
+
+class BatchCreatedResponse(BaseModel):
+    batch_id: uuid.UUID
+    total: int
+
+
+class BatchItemStatus(BaseModel):
+    file_id: uuid.UUID
+    status: str
+    error_message: Optional[str]
+    updated_at: Optional[datetime]
+
+
+class BatchStatusResponse(BaseModel):
+    batch_id: uuid.UUID
+    total: int
+    counts: dict
+    finished: bool
+    items: List[BatchItemStatus]
+
+
+def _claim(db: Session, file_id: uuid.UUID, force: bool) -> bool:
+    """Atomically moves an item to processing so concurrent runs don't pick it up twice."""
+    claimable = [ExtractionStatus.pending, ExtractionStatus.error]
+    if force:
+        claimable.append(ExtractionStatus.done)
+    claimed = (
+        db.query(ExtractedFileDB)
+        .filter(ExtractedFileDB.file_id == file_id, ExtractedFileDB.status.in_(claimable))
+        .update({ExtractedFileDB.status: ExtractionStatus.processing}, synchronize_session=False)
+    )
+    db.commit()
+    return claimed > 0
+
+
+def _run_item(user_id: uuid.UUID, file_id: uuid.UUID, force: bool, bypass_llm_cache: bool):
+    db = SessionLocal()
+    try:
+        user = db.get(UserDB, user_id)
+        if user is None or not _claim(db, file_id, force):
+            return
+        run_extraction(db, user, file_id, reuse_duplicates=not force, bypass_llm_cache=bypass_llm_cache)
+    except Exception as e:
+        print(f"Batch extraction failed for {file_id}: {e}")
+    finally:
+        db.close()
+
+
+def create(db: Session, user, request: BatchCreateRequest) -> BatchCreatedResponse | None:
+    query = (
+        db.query(FileDB.id)
+        .join(ExtractedFileDB, ExtractedFileDB.file_id == FileDB.id)
+        .filter(FileDB.user_id == user.id)
+    )
+    if request.all_pending:
+        query = query.filter(ExtractedFileDB.status == ExtractionStatus.pending)
+    elif request.file_ids:
+        query = query.filter(FileDB.id.in_(request.file_ids))
+    else:
+        return None
+
+    file_ids = [row.id for row in query.order_by(FileDB.created_at).limit(EXTRACTION_BATCH_MAX_FILES)]
+    if not file_ids:
+        return None
+
+    batch = ExtractionBatchDB(user_id=user.id, file_ids=[str(file_id) for file_id in file_ids])
+    db.add(batch)
+    db.commit()
+
+    for file_id in file_ids:
+        _executor.submit(_run_item, user.id, file_id, request.force, request.bypass_llm_cache)
+
+    return BatchCreatedResponse(batch_id=batch.id, total=len(file_ids))
+
+
+def requeue_stale(stale_after_seconds: int = EXTRACTION_STALE_AFTER_SECONDS) -> int:
+    """
+    Puts extractions stuck in "processing" for ``stale_after_seconds`` back to
+    pending and queues them on this process's executor. Returns how many.
+
+    A running extraction bumps updated_at every EXTRACTION_HEARTBEAT_SECONDS
+    (see db/extracted.py), so a row is only untouched that long when the
+    process running it died, taking its in-memory queue along. The UPDATE hands each row to exactly one
+    process, even when every worker runs this at once. Requeued items run
+    without the force / bypass_llm_cache flags of their original batch.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after_seconds)
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            update(ExtractedFileDB)
+            .where(
+                ExtractedFileDB.file_id == FileDB.id,
+                ExtractedFileDB.status == ExtractionStatus.processing,
+                ExtractedFileDB.updated_at < cutoff,
+            )
+            .values(status=ExtractionStatus.pending)
+            .returning(ExtractedFileDB.file_id, FileDB.user_id)
+        ).all()
+        for row in rows:
+            progress.publish(db, row.user_id, row.file_id, ExtractionStatus.pending, stage="requeued")
+        db.commit()
+    finally:
+        db.close()
+
+    for row in rows:
+        _executor.submit(_run_item, row.user_id, row.file_id, False, False)
+    if rows:
+        print(f"Requeued {len(rows)} stale extractions")
+    return len(rows)
+
+
+def _recover():
+    while True:
+        try:
+            requeue_stale()
+        except Exception as e:
+            print(f"Stale extraction recovery failed: {e}")
+        time.sleep(EXTRACTION_RECOVERY_INTERVAL_SECONDS)
+
+
+def start_recovery():
+    """
+    Starts this process's recovery thread: requeue_stale() now, then every
+    EXTRACTION_RECOVERY_INTERVAL_SECONDS, since a single crashed worker leaves
+    its items behind while the others keep running.
+    """
+    global _recovery_thread
+    with _recovery_lock:
+        if _recovery_thread is None:
+            _recovery_thread = threading.Thread(target=_recover, name="extract-recovery", daemon=True)
+            _recovery_thread.start()
+
+
+async def get_status(db: AsyncSession, user, batch_id: uuid.UUID) -> BatchStatusResponse | None:
+    batch = (await db.execute(
+        select(ExtractionBatchDB)
+        .where(ExtractionBatchDB.id == batch_id, ExtractionBatchDB.user_id == user.id)
+    )).scalar_one_or_none()
+    if not batch:
+        return None
+
+    rows = (await db.execute(
+        select(
+            ExtractedFileDB.file_id,
+            ExtractedFileDB.status,
+            ExtractedFileDB.error_message,
+            ExtractedFileDB.updated_at,
+        )
+        .where(ExtractedFileDB.file_id.in_([uuid.UUID(file_id) for file_id in batch.file_ids]))
+    )).all()
+
+    counts = {s.value: 0 for s in ExtractionStatus}
+    items = []
+    for row in rows:
+        counts[row.status.value] += 1
+        items.append(BatchItemStatus(
+            file_id=row.file_id,
+            status=row.status.value,
+            error_message=row.error_message,
+            updated_at=row.updated_at,
+        ))
+
+    return BatchStatusResponse(
+        batch_id=batch.id,
+        total=len(batch.file_ids),
+        counts=counts,
+        finished=counts["pending"] == 0 and counts["processing"] == 0,
+        items=items,
+    )
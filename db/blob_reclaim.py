@@ -0,0 +1,103 @@
+"""Background removal of encrypted blobs whose files rows were deleted.
+
+Deletes never touch blob storage (see storage/) themselves. They move each removed file's path
+into the blob_reclaim table in the same transaction as the DELETE (see
+db/files.py), so a request only pays for the SQL, and a crash can't leave a
+row pointing at a missing blob or an unlinked blob nobody will clean up.
+
+A daemon thread per worker process drains the queue in batches, claimed with
+FOR UPDATE SKIP LOCKED so several workers never unlink the same blob. The
+queue lives in the database, so blobs queued before a restart are reclaimed
+after it. A blob that can't be removed stays queued, with its attempts
+counted, and is retried on a later pass.
+"""
+import threading
+
+from sqlalchemy import delete, select, update
+
+from config import BLOB_RECLAIM_BATCH_SIZE, BLOB_RECLAIM_INTERVAL_SECONDS
+from db.database import SessionLocal
+from db.table_models import BlobReclaimDB
+from storage import get_storage
+
+_wakeup = threading.Event()
+_start_lock = threading.Lock()
+_thread = None
+_stats_lock = threading.Lock()
+_stats = {"reclaimed": 0, "failed": 0, "passes": 0}
+
+
+def _count(name: str, amount: int = 1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def reclaim_batch(limit: int = BLOB_RECLAIM_BATCH_SIZE) -> int:
+    """Unlinks up to ``limit`` queued blobs. Returns how many queue entries were cleared."""
+    db = SessionLocal()
+    try:
+        claimed = db.execute(
+            select(BlobReclaimDB.id, BlobReclaimDB.path)
+            # Entries that keep failing sink behind new ones instead of blocking the queue.
+            .order_by(BlobReclaimDB.attempts, BlobReclaimDB.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).all()
+        storage = get_storage()
+        done, failed = [], []
+        for entry in claimed:
+            try:
+                storage.delete(entry.path)
+            except Exception as e:
+                print(f"Could not reclaim blob {entry.path}: {e}")
+                failed.append(entry.id)
+                continue
+            done.append(entry.id)
+
+        if done:
+            db.execute(delete(BlobReclaimDB).where(BlobReclaimDB.id.in_(done)))
+        if failed:
+            db.execute(
+                update(BlobReclaimDB)
+                .where(BlobReclaimDB.id.in_(failed))
+                .values(attempts=BlobReclaimDB.attempts + 1)
+            )
+        db.commit()
+        _count("reclaimed", len(done))
+        _count("failed", len(failed))
+        return len(done)
+    finally:
+        db.close()
+
+
+def _run():
+    while True:
+        _wakeup.wait(BLOB_RECLAIM_INTERVAL_SECONDS)
+        _wakeup.clear()
+        _count("passes")
+        try:
+            # Keep going while full batches come back; a short one means the queue is drained.
+            while reclaim_batch() == BLOB_RECLAIM_BATCH_SIZE:
+                pass
+        except Exception as e:
+            print(f"Blob reclaimer pass failed: {e}")
+
+
+def start():
+    """
+    Starts this process's reclaimer thread if needed and wakes it for an immediate pass.
+
+    Called at startup, to drain whatever was queued before a restart, and
+    after every delete commits, so its blobs go without waiting for the interval.
+    """
+    global _thread
+    with _start_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="blob-reclaimer", daemon=True)
+            _thread.start()
+    _wakeup.set()
+
+
+def get_reclaim_stats() -> dict:
+    with _stats_lock:
+        return {**_stats, "running": _thread is not None}
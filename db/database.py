@@ -1,10 +1,128 @@
-from sqlalchemy import create_engine
+"""Database engines and sessions.
+
+Two engines share DATABASE_URL and the same pool settings:
+
+- ``engine`` / ``SessionLocal`` (psycopg2) for sync routes, background
+  extraction threads and Alembic.
+- ``async_engine`` / ``AsyncSessionLocal`` (asyncpg) for ``async def`` routes,
+  which wait on the database without holding a threadpool thread.
+
+Each gunicorn worker holds up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections
+per engine; size both against the server's max_connections.
+
+DATABASE_URL is a libpq URL, and its query parameters (``?sslmode=require``
+on most managed Postgres) mean nothing to asyncpg, which would reject them.
+async_connect_options() translates the ones asyncpg has an equivalent for
+and drops the rest.
+"""
+import ssl
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from config import DATABASE_URL
+from config import (
+    ASYNC_DATABASE_URL,
+    DATABASE_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE_SECONDS,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT_SECONDS,
+    DB_STATEMENT_TIMEOUT_MS,
+)
+
+_POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+
+# Query parameters asyncpg.connect (or SQLAlchemy's asyncpg dialect) takes as they are.
+_ASYNCPG_QUERY_ARGS = {
+    "command_timeout",
+    "host",
+    "direct_tls",
+    "gsslib",
+    "krbsrvname",
+    "max_cacheable_statement_size",
+    "max_cached_statement_lifetime",
+    "passfile",
+    "prepared_statement_cache_size",
+    "statement_cache_size",
+    "target_session_attrs",
+}
+
+
+def _ssl_option(mode: str, rootcert=None, cert=None, key=None):
+    """asyncpg's ``ssl`` argument for a libpq sslmode and certificate files."""
+    if not (rootcert or cert):
+        # asyncpg takes libpq's mode names for the default certificate locations.
+        return mode
+    if mode == "disable":
+        return False
+    context = ssl.create_default_context(cafile=rootcert)
+    # As in libpq, "require" with a root certificate verifies the chain but not the host name.
+    context.check_hostname = mode == "verify-full"
+    if mode in ("allow", "prefer") or (mode == "require" and not rootcert):
+        context.verify_mode = ssl.CERT_NONE
+    if cert:
+        context.load_cert_chain(cert, key)
+    return context
+
+
+def async_connect_options(url: str) -> tuple:
+    """
+    ``(url, connect_args)`` for asyncpg from a libpq-style URL.
+
+    sslmode, sslrootcert, sslcert and sslkey become ``ssl``, connect_timeout
+    becomes ``timeout`` and application_name a server setting. Parameters
+    asyncpg has no use for (keepalives, gssencmode, ...) are dropped.
+    """
+    url = make_url(url)
+    query = dict(url.query)
+    connect_args = {}
+
+    sslmode = query.pop("sslmode", None)
+    rootcert, cert, key = query.pop("sslrootcert", None), query.pop("sslcert", None), query.pop("sslkey", None)
+    if sslmode or rootcert or cert:
+        connect_args["ssl"] = _ssl_option(sslmode or "prefer", rootcert, cert, key)
+    if "connect_timeout" in query:
+        connect_args["timeout"] = float(query.pop("connect_timeout"))
+    if "application_name" in query:
+        connect_args["server_settings"] = {"application_name": query.pop("application_name")}
+
+    dropped = sorted(name for name in query if name not in _ASYNCPG_QUERY_ARGS)
+    if dropped:
+        print(f"Ignoring database URL parameters asyncpg doesn't support: {', '.join(dropped)}")
+    url = url.set(
+        drivername="postgresql+asyncpg",
+        query={name: value for name, value in query.items() if name in _ASYNCPG_QUERY_ARGS},
+    )
+    return url, connect_args
+
 
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"},
+    **_POOL_OPTIONS,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+_async_engine_url, ASYNC_CONNECT_ARGS = async_connect_options(ASYNC_DATABASE_URL or DATABASE_URL)
+ASYNC_CONNECT_ARGS["server_settings"] = {
+    **ASYNC_CONNECT_ARGS.get("server_settings", {}),
+    "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS),
+}
+async_engine = create_async_engine(_async_engine_url, connect_args=ASYNC_CONNECT_ARGS, **_POOL_OPTIONS)
+# Objects stay readable after commit; async code can't lazy-load expired attributes.
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -13,3 +131,47 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+_pool_stats_lock = threading.Lock()
+_pool_peaks = {}
+
+
+def _track_peak(name: str, sync_engine):
+    _pool_peaks[name] = 0
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checked_out = sync_engine.pool.checkedout()
+        with _pool_stats_lock:
+            _pool_peaks[name] = max(_pool_peaks[name], checked_out)
+
+
+_track_peak("sync", engine)
+_track_peak("async", async_engine.sync_engine)
+
+
+def _pool_stats(name: str, pool) -> dict:
+    capacity = pool.size() + DB_MAX_OVERFLOW
+    checked_out = pool.checkedout()
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "peak_checked_out": _pool_peaks[name],
+        # 1.0 means the next checkout waits up to DB_POOL_TIMEOUT_SECONDS for a connection.
+        "saturation": round(checked_out / capacity, 4) if capacity else 0.0,
+    }
+
+
+def get_pool_stats() -> dict:
+    return {
+        "sync": _pool_stats("sync", engine.pool),
+        "async": _pool_stats("async", async_engine.sync_engine.pool),
+    }
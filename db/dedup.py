@@ -0,0 +1,79 @@
+import hashlib
+import hmac
+import threading
+
+from sqlalchemy.orm import Session
+
+from config import CONTENT_HASH_KEY, JWT_KEY
+from db.table_models import ExtractedFileDB, ExtractionStatus, FileDB
+
+_stats_lock = threading.Lock()
+_stats = {"uploads": 0, "upload_hits": 0, "extraction_reuses": 0}
+MIN_KEY_LENGTH = 16
+
+
+def check_key():
+    """
+    Refuses to run without a dedicated CONTENT_HASH_KEY.
+
+    Sharing JWT_KEY would tie the two together: rotating the token secret would
+    silently reset deduplication, and a leaked token secret would expose the hashes.
+    """
+    if len(CONTENT_HASH_KEY) < MIN_KEY_LENGTH:
+        raise RuntimeError(f"CONTENT_HASH_KEY must be set to a secret of at least {MIN_KEY_LENGTH} characters.")
+    if CONTENT_HASH_KEY == JWT_KEY:
+        raise RuntimeError("CONTENT_HASH_KEY must differ from JWT_KEY.")
+
+
+def new_content_hasher():
+    """
+    Keyed hash of the plaintext, so stored hashes can't be matched against known documents offline.
+
+    Hashes are only comparable under the same CONTENT_HASH_KEY; changing the key resets deduplication.
+    """
+    check_key()
+    return hmac.new(CONTENT_HASH_KEY.encode(), digestmod=hashlib.sha256)
+
+
+def find_done_duplicate(db: Session, user_id, content_hash: str, exclude_file_id=None) -> ExtractedFileDB | None:
+    """Latest finished extraction of a byte-identical file owned by the same user."""
+    query = (
+        db.query(ExtractedFileDB)
+        .join(FileDB, ExtractedFileDB.file_id == FileDB.id)
+        .filter(
+            FileDB.user_id == user_id,
+            FileDB.content_hash == content_hash,
+            ExtractedFileDB.status == ExtractionStatus.done,
+        )
+    )
+    if exclude_file_id is not None:
+        query = query.filter(FileDB.id != exclude_file_id)
+    return query.order_by(ExtractedFileDB.updated_at.desc()).first()
+
+
+def copy_result(source: ExtractedFileDB, target: ExtractedFileDB):
+    target.extracted_text = source.extracted_text
+    target.json_data = source.json_data
+    target.error_message = source.error_message
+    target.status = ExtractionStatus.done
+
+
+def record_upload(hit: bool):
+    with _stats_lock:
+        _stats["uploads"] += 1
+        if hit:
+            _stats["upload_hits"] += 1
+
+
+def record_extraction_reuse():
+    with _stats_lock:
+        _stats["extraction_reuses"] += 1
+
+
+def get_dedup_stats() -> dict:
+    with _stats_lock:
+        uploads = _stats["uploads"]
+        return {
+            **_stats,
+            "hit_rate": round(_stats["upload_hits"] / uploads, 4) if uploads else 0.0,
+        }
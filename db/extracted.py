@@ -1,28 +1,30 @@
-import os
 import uuid
 import json
+import hashlib
+import threading
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Callable, Optional, Tuple
 
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from cryptography.fernet import Fernet, InvalidToken
 
-from db.database import Base
+from config import EXTRACTION_HEARTBEAT_SECONDS
+from db.database import Base, SessionLocal
 from db.table_models import ExtractedFileDB, FileDB, ExtractionStatus
 from models.invoice_extraction_model import (
-    preprocess_image_for_ocr, 
-    extract_text_from_image,
+    decode_image_bytes,
+    preprocess_image_array,
+    extract_text_from_array,
     extract_fields_with_llm,
     extract_fields_with_regex
 )
-from auth.encryption import get_user_fernet_key 
-
-TMP_DECRYPTED_DIR = "tmp/decrypted"
-TMP_PROCESSED_DIR = "tmp/processed"
-
-os.makedirs(TMP_DECRYPTED_DIR, exist_ok=True)
-os.makedirs(TMP_PROCESSED_DIR, exist_ok=True)
+from models.extract_text import ocr_pdf_pages
+from auth.encryption import get_user_fernet_key
+from db import dedup, llm_cache, progress
+from auth.file_encryption import decrypt_file_bytes
+from storage import get_storage
 
 
 class ExtractedFileResponse(BaseModel):
@@ -39,43 +41,113 @@ class ExtractedFileResponse(BaseModel):
         from_attributes = True
 
 
-def decrypt_file(encrypted_path: str, decrypted_path: str, fernet: Fernet):
-    with open(encrypted_path, "rb") as f:
-        encrypted_data = f.read()
-
-    try:
-        decrypted_data = fernet.decrypt(encrypted_data)
-    except InvalidToken:
-        raise ValueError("Invalid decryption key or corrupted file.")
-
-    with open(decrypted_path, "wb") as f:
-        f.write(decrypted_data)
-
-
-def extract_text_and_entities(encrypted_path: str, fernet: Fernet) -> Tuple[str, dict, Optional[str], str, str]:
-    filename = os.path.basename(encrypted_path)
-    decrypted_path = os.path.join(TMP_DECRYPTED_DIR, filename)
-    processed_path = os.path.join(TMP_PROCESSED_DIR, filename)
-
-    if not os.path.exists(encrypted_path):
-        raise FileNotFoundError("Encrypted file not found")
-
-    decrypt_file(encrypted_path, decrypted_path, fernet)
-    preprocess_image_for_ocr(decrypted_path, processed_path)
-
-    extracted_text = extract_text_from_image(processed_path)
-    if not extracted_text:
-        return "OCR error", {}, "", decrypted_path, processed_path
-
-    json_data = extract_fields_with_llm(extracted_text)
-    if "error" in json_data:
-        fallback_data = extract_fields_with_regex(extracted_text)
-        return extracted_text, fallback_data, json_data["error"], decrypted_path, processed_path
+def etag_for(extraction_id: uuid.UUID, updated_at: Optional[datetime]) -> str:
+    """
+    Strong ETag of an extraction result.
+
+    Every write to the row (status changes, results, dedup copies, batch
+    claims) bumps updated_at through its onupdate default, so the pair
+    identifies one version of the row.
+    """
+    version = f"{extraction_id}|{updated_at.isoformat() if updated_at else ''}"
+    return f'"{hashlib.sha256(version.encode()).hexdigest()[:32]}"'
+
+
+async def get_etag(db: AsyncSession, user, file_id: uuid.UUID) -> Optional[str]:
+    """Current ETag of the user's extraction for ``file_id``, reading neither the text nor the JSON."""
+    row = (await db.execute(
+        select(ExtractedFileDB.id, ExtractedFileDB.updated_at)
+        .join(FileDB, ExtractedFileDB.file_id == FileDB.id)
+        .where(FileDB.user_id == user.id, ExtractedFileDB.file_id == file_id)
+    )).first()
+    return etag_for(row.id, row.updated_at) if row else None
+
+
+async def get_result(db: AsyncSession, user, file_id: uuid.UUID) -> ExtractedFileDB | None:
+    return (await db.execute(
+        select(ExtractedFileDB)
+        .join(FileDB, ExtractedFileDB.file_id == FileDB.id)
+        .where(FileDB.user_id == user.id, ExtractedFileDB.file_id == file_id)
+    )).scalar_one_or_none()
+
+
+def ocr_document(data: bytes, filename: str) -> Tuple[str, Optional[str]]:
+    """Returns the OCR text of a decrypted upload and an optional note for error_message."""
+    if filename.lower().endswith(".pdf"):
+        result = ocr_pdf_pages(data)
+        note = None
+        if result.truncated:
+            note = f"PDF has {result.page_count} pages, only the first {len(result.pages)} were extracted."
+        return result.text.strip(), note
+
+    # Decrypted bytes -> array -> binarized array -> OCR, all in memory: no temp
+    # files to write, re-read or clean up, and nothing shared between requests.
+    image = decode_image_bytes(data)
+    if image is None:
+        raise ValueError("Could not decode image.")
+    return extract_text_from_array(preprocess_image_array(image)), None
+
+
+def extract_entities_from_text(
+    extracted_text: str,
+    db: Session | None = None,
+    bypass_llm_cache: bool = False,
+    user_id=None,
+) -> Tuple[dict, Optional[str]]:
+    if db is not None:
+        json_data = llm_cache.extract_fields_cached(db, extracted_text, bypass=bypass_llm_cache, user_id=user_id)
     else:
-        return extracted_text, json_data, None, decrypted_path, processed_path
+        json_data = extract_fields_with_llm(extracted_text, user_id)
+    if "error" in json_data:
+        return extract_fields_with_regex(extracted_text), json_data["error"]
+    return json_data, None
 
 
-def run_extraction(db: Session, user, file_id: uuid.UUID) -> ExtractedFileDB | None:
+def extract_text_and_entities(data: bytes, filename: str = "") -> Tuple[str, dict, Optional[str]]:
+    extracted_text, _ = ocr_document(data, filename)
+    if not extracted_text:
+        return "OCR error", {}, ""
+
+    json_data, llm_error = extract_entities_from_text(extracted_text)
+    return extracted_text, json_data, llm_error
+
+
+def _start_heartbeat(file_id: uuid.UUID, interval: float = EXTRACTION_HEARTBEAT_SECONDS) -> Callable[[], None]:
+    """
+    Bumps updated_at every ``interval`` seconds until the returned function is called.
+
+    Nothing else writes the row during OCR or the LLM call, which can outlast
+    EXTRACTION_STALE_AFTER_SECONDS on a large PDF. Without this, requeue_stale()
+    in db/batches.py would take a live extraction for an orphan and run it twice.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            db = SessionLocal()
+            try:
+                db.execute(
+                    update(ExtractedFileDB)
+                    .where(ExtractedFileDB.file_id == file_id, ExtractedFileDB.status == ExtractionStatus.processing)
+                    .values(updated_at=datetime.utcnow())
+                )
+                db.commit()
+            except Exception as e:
+                print(f"Extraction heartbeat for {file_id} failed: {e}")
+            finally:
+                db.close()
+
+    threading.Thread(target=beat, name="extract-heartbeat", daemon=True).start()
+    return stop.set
+
+
+def run_extraction(
+    db: Session,
+    user,
+    file_id: uuid.UUID,
+    reuse_duplicates: bool = True,
+    bypass_llm_cache: bool = False,
+) -> ExtractedFileDB | None:
     file = db.query(FileDB).filter(FileDB.id == file_id, FileDB.user_id == user.id).first()
     if not file:
         return None
@@ -84,45 +156,58 @@ def run_extraction(db: Session, user, file_id: uuid.UUID) -> ExtractedFileDB | N
     if not extraction:
         return None
 
+    # A byte-identical upload may have finished since this one was queued.
+    if reuse_duplicates and file.content_hash:
+        duplicate = dedup.find_done_duplicate(db, user.id, file.content_hash, exclude_file_id=file.id)
+        if duplicate:
+            dedup.copy_result(duplicate, extraction)
+            dedup.record_extraction_reuse()
+            progress.publish(db, user.id, file_id, extraction.status, stage="deduplicated")
+            db.commit()
+            db.refresh(extraction)
+            return extraction
+
     extraction.status = ExtractionStatus.processing
+    progress.publish(db, user.id, file_id, extraction.status, stage="ocr")
     db.commit()
 
-    decrypted_path = None
-    processed_path = None
-
+    stop_heartbeat = _start_heartbeat(file_id)
     try:
         fernet_key = get_user_fernet_key(user.username)
-        fernet = Fernet(fernet_key)
+        with get_storage().open_read(file.path) as blob:
+            data = decrypt_file_bytes(blob, fernet_key)
 
-        extracted_text, json_data, llm_error, decrypted_path, processed_path = extract_text_and_entities(file.path, fernet)
-        if extracted_text == "OCR error":
+        extracted_text, note = ocr_document(data, file.filename)
+        if not extracted_text:
             print("OCR extraction failed, setting extraction status to error.")
             extraction.status = ExtractionStatus.error
             extraction.error_message = "ocr_error"
+            progress.publish(db, user.id, file_id, extraction.status, error_message=extraction.error_message)
             db.commit()
             return extraction
 
+        # Nothing to write yet; the commit only sends the event.
+        progress.publish(db, user.id, file_id, ExtractionStatus.processing, stage="fields")
+        db.commit()
+
+        json_data, llm_error = extract_entities_from_text(extracted_text, db, bypass_llm_cache, user.id)
         extraction.extracted_text = extracted_text
         extraction.json_data = json_data
         extraction.status = ExtractionStatus.done
 
+        messages = [note] if note else []
         if llm_error:
-            extraction.error_message = f"LLM failed, regex fallback used: {llm_error}"
+            messages.append(f"LLM failed, regex fallback used: {llm_error}")
+        extraction.error_message = " ".join(messages) or None
 
     except Exception as e:
         print(f"Error during extraction: {e}")
         extraction.status = ExtractionStatus.error
         extraction.error_message = str(e)
-
     finally:
-        # Cleanup decrypted and processed files
-        for path in [decrypted_path, processed_path]:
-            if path and os.path.exists(path):
-                try:
-                    os.remove(path)
-                except Exception as cleanup_error:
-                    print(f"Warning: Failed to clean up temp file {path}: {cleanup_error}")
+        stop_heartbeat()
 
+    progress.publish(db, user.id, file_id, extraction.status, error_message=extraction.error_message)
     db.commit()
     db.refresh(extraction)
     return extraction
\ No newline at end of file
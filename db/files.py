@@ -1,16 +1,24 @@
-import os
 import uuid
 import base64
+import hashlib
+import binascii
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import delete as sql_delete, func, insert, literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from cryptography.fernet import Fernet
 
 from enum import Enum
 
-from config import LOCAL_STORAGE_DIR
+from config import BULK_UPLOAD_ENCRYPT_WORKERS, FILES_DELETE_BATCH_SIZE, FILES_PAGE_SIZE_DEFAULT
 from db.database import Base
 from db.extracted import ExtractedFileDB, ExtractionStatus
-from db.table_models import FileDB
+from db.table_models import BlobReclaimDB, FileDB
+from db import blob_reclaim, dedup
 from auth.encryption import get_user_fernet_key
+from auth.file_encryption import DecryptionError, PlaintextView, decrypt_file_bytes, encrypt_stream
+from storage import StorageUnavailable, get_storage
 
 from pydantic import BaseModel
 
@@ -18,6 +26,18 @@ class fileType(Enum):
     pdf = "pdf"
     png = "png"
     jpg = "jpg"
+    jpeg = "jpeg"
+
+CONTENT_TYPES = {
+    fileType.pdf: "application/pdf",
+    fileType.png: "image/png",
+    fileType.jpg: "image/jpeg",
+    fileType.jpeg: "image/jpeg",
+}
+
+def filetype_of(filename: str) -> str:
+    """Lowercased extension, as stored in files.filetype."""
+    return filename.split(".")[-1].lower()[:8]
 
 # Pydantic Models
 class FileResponse(BaseModel):
@@ -25,6 +45,8 @@ class FileResponse(BaseModel):
     filename: str
     filetype: fileType
     path: str
+    created_at: Optional[datetime] = None
+    status: Optional[ExtractionStatus] = None
 
     class Config:
         from_attributes = True
@@ -37,63 +59,251 @@ class DecryptedFileResponse(BaseModel):
     class Config:
         from_attributes = True
 
-def save(db: Session, user, uploaded_file) -> FileResponse:
-    file_data = uploaded_file.file.read()
-    fernet = Fernet(get_user_fernet_key(user.username))
+class BulkUploadItem(BaseModel):
+    filename: str
+    ok: bool
+    file: Optional[FileResponse] = None
+    error: Optional[str] = None
 
-    encrypted_data = fernet.encrypt(file_data)
+class BulkUploadResponse(BaseModel):
+    uploaded: int
+    failed: int
+    items: List[BulkUploadItem]
 
-    os.makedirs(LOCAL_STORAGE_DIR, exist_ok=True)
-    file_id = str(uuid.uuid4())
-    filename = f"{file_id}_{uploaded_file.filename}"
-    full_path = os.path.join(LOCAL_STORAGE_DIR, filename)
+# Accepted upload content types; "image/jpg" is what some scanners send.
+UPLOAD_CONTENT_TYPES = {*CONTENT_TYPES.values(), "image/jpg"}
 
-    with open(full_path, "wb") as f:
-        f.write(encrypted_data)
+# Shared by every bulk upload in this process. Encryption and the file writes
+# release the GIL, so a few threads keep several cores busy.
+_encrypt_executor = ThreadPoolExecutor(max_workers=BULK_UPLOAD_ENCRYPT_WORKERS, thread_name_prefix="encrypt-upload")
 
-    new_file = FileDB(
-        id=file_id,
-        user_id=user.id,
-        filename=uploaded_file.filename,
-        path=full_path,
-    )
+def _store(fernet_key: bytes, uploaded_file) -> dict:
+    """Encrypts one upload into blob storage. Returns its files row, not yet inserted."""
+    storage = get_storage()
+    file_id = uuid.uuid4()
+    key = storage.key_for(file_id)
+
+    # Encrypt straight from the spooled upload so memory stays flat per request,
+    # hashing the plaintext on the way through for deduplication.
+    hasher = dedup.new_content_hasher()
+    uploaded_file.file.seek(0)
+    with storage.open_write(key) as f:
+        encrypt_stream(uploaded_file.file, f, fernet_key, on_chunk=hasher.update)
+
+    return {
+        "id": file_id,
+        "filename": uploaded_file.filename,
+        "path": key,
+        "content_hash": hasher.hexdigest(),
+        "filetype": filetype_of(uploaded_file.filename),
+    }
+
+def save(db: Session, user, uploaded_file) -> FileResponse:
+    fernet_key = get_user_fernet_key(user.username)
+    new_file = FileDB(user_id=user.id, **_store(fernet_key, uploaded_file))
     db.add(new_file)
 
-    db.add(ExtractedFileDB(file_id=file_id, status=ExtractionStatus.pending))
+    extraction = ExtractedFileDB(file_id=new_file.id, status=ExtractionStatus.pending)
+    duplicate = dedup.find_done_duplicate(db, user.id, new_file.content_hash)
+    if duplicate:
+        dedup.copy_result(duplicate, extraction)
+    dedup.record_upload(hit=duplicate is not None)
+
+    db.add(extraction)
     db.commit()
     db.refresh(new_file)
 
     return FileResponse(
         id=new_file.id,
         filename=new_file.filename,
-        filetype=fileType(new_file.filename.split('.')[-1].lower()),
-        path=new_file.path
+        filetype=fileType(new_file.filetype),
+        path=new_file.path,
+        created_at=new_file.created_at,
+        status=extraction.status,
+    )
+
+def _upload_error(uploaded_file) -> Optional[str]:
+    if uploaded_file.content_type not in UPLOAD_CONTENT_TYPES:
+        return "Unsupported file type. Only PDF, PNG, and JPG are allowed."
+    if filetype_of(uploaded_file.filename or "") not in fileType._value2member_map_:
+        return "File name must end in .pdf, .png, .jpg or .jpeg."
+    return None
+
+def save_many(db: Session, user, uploaded_files) -> BulkUploadResponse:
+    """
+    Stores a batch of uploads with one key lookup, parallel encryption and one commit.
+
+    Files that fail validation or encryption are reported per item and don't
+    affect the rest. The files and extracted_files rows of the successful ones
+    go in with one multi-row INSERT per table; if that fails, their blobs are
+    removed again and the error propagates.
+    """
+    fernet_key = get_user_fernet_key(user.username)
+    items = [BulkUploadItem(filename=f.filename or "", ok=False, error=_upload_error(f)) for f in uploaded_files]
+    futures = {
+        i: _encrypt_executor.submit(_store, fernet_key, uploaded_file)
+        for i, (item, uploaded_file) in enumerate(zip(items, uploaded_files))
+        if item.error is None
+    }
+
+    rows = {}
+    for i, future in futures.items():
+        try:
+            rows[i] = future.result()
+        except Exception as e:
+            print(f"Bulk upload failed to store {items[i].filename}: {e}")
+            items[i].error = "Could not store file."
+    if not rows:
+        return BulkUploadResponse(uploaded=0, failed=len(items), items=items)
+
+    # One lookup for earlier finished extractions of any of these files.
+    done_by_hash = {}
+    duplicates = (
+        db.query(FileDB.content_hash, ExtractedFileDB)
+        .join(ExtractedFileDB, ExtractedFileDB.file_id == FileDB.id)
+        .filter(
+            FileDB.user_id == user.id,
+            FileDB.content_hash.in_([row["content_hash"] for row in rows.values()]),
+            ExtractedFileDB.status == ExtractionStatus.done,
+        )
+        .order_by(ExtractedFileDB.updated_at.desc())
     )
+    for content_hash, extraction in duplicates:
+        done_by_hash.setdefault(content_hash, extraction)
+
+    created_at = datetime.utcnow()
+    extractions = []
+    for row in rows.values():
+        row.update(user_id=user.id, created_at=created_at)
+        extraction = ExtractedFileDB(file_id=row["id"], status=ExtractionStatus.pending)
+        duplicate = done_by_hash.get(row["content_hash"])
+        if duplicate:
+            dedup.copy_result(duplicate, extraction)
+        dedup.record_upload(hit=duplicate is not None)
+        extractions.append({
+            "id": uuid.uuid4(),
+            "file_id": row["id"],
+            "status": extraction.status,
+            "extracted_text": extraction.extracted_text,
+            "json_data": extraction.json_data,
+            "error_message": extraction.error_message,
+            "created_at": created_at,
+            "updated_at": created_at,
+        })
+
+    try:
+        db.execute(insert(FileDB), [*rows.values()])
+        db.execute(insert(ExtractedFileDB), extractions)
+        db.commit()
+    except Exception:
+        db.rollback()
+        for row in rows.values():
+            get_storage().delete(row["path"])
+        raise
+
+    for (i, row), extraction in zip(rows.items(), extractions):
+        items[i].ok = True
+        items[i].file = FileResponse(
+            id=row["id"],
+            filename=row["filename"],
+            filetype=fileType(row["filetype"]),
+            path=row["path"],
+            created_at=created_at,
+            status=extraction["status"],
+        )
+    return BulkUploadResponse(uploaded=len(rows), failed=len(items) - len(rows), items=items)
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(created_at: datetime, file_id: uuid.UUID) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{file_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        created_at, file_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(file_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+
+async def list(
+    db: AsyncSession,
+    user,
+    limit: int = FILES_PAGE_SIZE_DEFAULT,
+    cursor: Optional[str] = None,
+    status: Optional[ExtractionStatus] = None,
+    filetype: Optional[fileType] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+) -> Tuple[list[FileResponse], Optional[str]]:
+    """
+    One page of the user's files, newest first, each with its extraction status.
 
-def list(db: Session, user) -> list[FileDB]:
-    files =  db.query(FileDB).filter(FileDB.user_id == user.id).all()
+    Keyset pagination on (created_at, id) over ix_files_user_id_created_at_id:
+    a page costs the same at any depth. Filters narrow the same ordered scan;
+    created_from is inclusive and created_to exclusive.
+
+    Returns:
+        (files, cursor of the next page or None on the last page)
+
+    Raises:
+        InvalidCursor: If ``cursor`` wasn't produced by this function.
+    """
+    query = (
+        select(FileDB.id, FileDB.filename, FileDB.path, FileDB.filetype, FileDB.created_at, ExtractedFileDB.status)
+        .outerjoin(ExtractedFileDB, ExtractedFileDB.file_id == FileDB.id)
+        .where(FileDB.user_id == user.id)
+    )
+    if cursor:
+        query = query.where(tuple_(FileDB.created_at, FileDB.id) < decode_cursor(cursor))
+    if status:
+        query = query.where(ExtractedFileDB.status == status)
+    if filetype:
+        query = query.where(FileDB.filetype == filetype.value)
+    if created_from:
+        query = query.where(FileDB.created_at >= created_from)
+    if created_to:
+        query = query.where(FileDB.created_at < created_to)
+
+    # One extra row tells whether another page exists.
+    query = query.order_by(FileDB.created_at.desc(), FileDB.id.desc()).limit(limit + 1)
+    rows = (await db.execute(query)).all()
+    next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
     return [
         FileResponse(
-            id=f.id,
-            filename=f.filename,
-            path=f.path,
-            filetype=fileType(f.filename.split(".")[-1].lower())
+            id=row.id,
+            filename=row.filename,
+            path=row.path,
+            filetype=fileType(row.filetype or filetype_of(row.filename)),
+            created_at=row.created_at,
+            status=row.status,
         )
-        for f in files
-    ]
+        for row in rows[:limit]
+    ], next_cursor
+
+def page_etag(files: List[FileResponse], next_cursor: Optional[str]) -> str:
+    """
+    Strong ETag of one listing page, computed from the rows without serializing them.
+
+    A file's id, name, type and created_at never change; its extraction
+    status changes, and so does its path when storage.migrate moves the blob.
+    """
+    digest = hashlib.sha256((next_cursor or "").encode())
+    for file in files:
+        digest.update(f"|{file.id}:{file.status.value if file.status else ''}:{file.path}".encode())
+    return f'"{digest.hexdigest()[:32]}"'
 
 def get(db: Session, user, file_id: uuid.UUID) -> DecryptedFileResponse:
     file = db.query(FileDB).filter(FileDB.id == file_id, FileDB.user_id == user.id).first()
     if not file:
         return None
 
-    fernet = Fernet(get_user_fernet_key(user.username))
-    with open(file.path, "rb") as f:
-        encrypted_data = f.read()
-
     try:
-        decrypted = fernet.decrypt(encrypted_data)
-    except Exception:
+        with get_storage().open_read(file.path) as blob:
+            decrypted = decrypt_file_bytes(blob, get_user_fernet_key(user.username))
+    except StorageUnavailable:
+        raise
+    except (DecryptionError, OSError):
         return None
 
     return DecryptedFileResponse(
@@ -102,25 +312,85 @@ def get(db: Session, user, file_id: uuid.UUID) -> DecryptedFileResponse:
         filetype=fileType(file.filename.split('.')[-1].lower())
     )
 
-def delete(db: Session, user, file_id: uuid.UUID) -> bool:
-    file = db.query(FileDB).filter(FileDB.id == file_id, FileDB.user_id == user.id).first()
-    if not file:
-        return False
+def content_type_for(filename: str) -> str:
+    try:
+        return CONTENT_TYPES[fileType(filename.split(".")[-1].lower())]
+    except ValueError:
+        return "application/octet-stream"
 
-    if os.path.exists(file.path):
-        os.remove(file.path)
+def get_owned(db: Session, user, file_id: uuid.UUID) -> FileDB | None:
+    return db.query(FileDB).filter(FileDB.id == file_id, FileDB.user_id == user.id).first()
 
-    db.delete(file)
-    db.commit()
-    return True
+def open_plaintext(user, file: FileDB):
+    """
+    Opens the stored blob for chunked decryption.
+
+    Returns:
+        (file object, PlaintextView). The caller owns the file object and must close it.
+    """
+    f = get_storage().open_read(file.path)
+    try:
+        return f, PlaintextView(f, get_user_fernet_key(user.username))
+    except Exception:
+        f.close()
+        raise
+
+def _delete_batch(db: Session, file_ids: list) -> int:
+    """Deletes the given files and their extractions, queueing their blobs for the reclaimer."""
+    db.execute(sql_delete(ExtractedFileDB).where(ExtractedFileDB.file_id.in_(file_ids)))
+    deleted = sql_delete(FileDB).where(FileDB.id.in_(file_ids)).returning(FileDB.path).cte("deleted_files")
+    queued = db.execute(
+        insert(BlobReclaimDB).from_select(
+            ["path", "created_at", "attempts"],
+            select(deleted.c.path, func.now(), literal(0)),
+        )
+    )
+    return queued.rowcount
+
+def delete_where(
+    db: Session,
+    user,
+    file_ids: Optional[List[uuid.UUID]] = None,
+    status: Optional[ExtractionStatus] = None,
+    filetype: Optional[fileType] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+) -> int:
+    """
+    Deletes the user's files matching every given filter (all of them when none is given).
+
+    Set-based: each round selects up to FILES_DELETE_BATCH_SIZE ids, deletes
+    their extractions and files with one statement each, moves the blob paths
+    into blob_reclaim with DELETE ... RETURNING, and commits. Locks are held
+    per round, not for the whole delete, and no blob is touched on the request
+    path. Returns the number of files deleted.
+    """
+    query = select(FileDB.id).where(FileDB.user_id == user.id)
+    if file_ids is not None:
+        query = query.where(FileDB.id.in_(file_ids))
+    if status:
+        query = query.join(ExtractedFileDB, ExtractedFileDB.file_id == FileDB.id).where(ExtractedFileDB.status == status)
+    if filetype:
+        query = query.where(FileDB.filetype == filetype.value)
+    if created_from:
+        query = query.where(FileDB.created_at >= created_from)
+    if created_to:
+        query = query.where(FileDB.created_at < created_to)
+
+    total = 0
+    while True:
+        batch = db.execute(query.limit(FILES_DELETE_BATCH_SIZE)).scalars().all()
+        if batch:
+            total += _delete_batch(db, batch)
+            db.commit()
+        if len(batch) < FILES_DELETE_BATCH_SIZE:
+            break
+    if total:
+        blob_reclaim.start()
+    return total
+
+def delete(db: Session, user, file_id: uuid.UUID) -> bool:
+    return delete_where(db, user, file_ids=[file_id]) > 0
 
 def delete_all(db: Session, user) -> int:
-    files = db.query(FileDB).filter(FileDB.user_id == user.id).all()
-    count = 0
-    for file in files:
-        if os.path.exists(file.path):
-            os.remove(file.path)
-        db.delete(file)
-        count += 1
-    db.commit()
-    return count
+    return delete_where(db, user)
@@ -0,0 +1,153 @@
+import hashlib
+import hmac
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from config import CONTENT_HASH_KEY, LLM_CACHE_ENABLED, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS
+from db.table_models import LlmCacheDB
+from models.invoice_extraction_model import LLM_PROMPT_VERSION, extract_fields_with_llm
+from models.llm_providers import get_llm_provider
+
+# Size-based eviction scans the table, so only run it every N inserts.
+PRUNE_EVERY_N_PUTS = 100
+
+_WHITESPACE = re.compile(r"\s+")
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "expired": 0, "evicted": 0, "errors": 0}
+
+
+def _count(name: str, amount: int = 1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def normalize_text(text: str) -> str:
+    """OCR output that only differs in whitespace or Unicode forms maps to the same entry."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(text: str, prompt_version: str = LLM_PROMPT_VERSION, model_name: str | None = None) -> str:
+    """
+    Keyed under CONTENT_HASH_KEY, like the upload hashes in db/dedup.py, so
+    a copy of the table can't be checked offline for a known invoice.
+    Changing the key orphans every entry; they age out by TTL and eviction.
+    """
+    model_name = model_name or get_llm_provider().model_name
+    payload = "\0".join([prompt_version, model_name, normalize_text(text)])
+    return hmac.new(CONTENT_HASH_KEY.encode(), payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def get(db: Session, text: str) -> dict | None:
+    key = cache_key(text)
+    entry = db.get(LlmCacheDB, key)
+    if entry is None:
+        _count("misses")
+        return None
+
+    now = datetime.utcnow()
+    if entry.created_at < now - timedelta(seconds=LLM_CACHE_TTL_SECONDS):
+        db.delete(entry)
+        db.commit()
+        _count("expired")
+        _count("misses")
+        return None
+
+    entry.last_used_at = now
+    entry.hit_count = LlmCacheDB.hit_count + 1
+    db.commit()
+    _count("hits")
+    return dict(entry.json_data)
+
+
+def put(db: Session, text: str, json_data: dict):
+    now = datetime.utcnow()
+    values = {
+        "cache_key": cache_key(text),
+        "prompt_version": LLM_PROMPT_VERSION,
+        "model_name": get_llm_provider().model_name,
+        "json_data": json_data,
+        "created_at": now,
+        "last_used_at": now,
+        "hit_count": 0,
+    }
+    statement = insert(LlmCacheDB).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[LlmCacheDB.cache_key],
+        set_={"json_data": statement.excluded.json_data, "created_at": now, "last_used_at": now},
+    )
+    db.execute(statement)
+    db.commit()
+
+    with _stats_lock:
+        _stats["stores"] += 1
+        should_prune = _stats["stores"] % PRUNE_EVERY_N_PUTS == 0
+    if should_prune:
+        prune(db)
+
+
+def prune(db: Session) -> int:
+    """Drops expired entries, then the least recently used ones above LLM_CACHE_MAX_ENTRIES."""
+    cutoff = datetime.utcnow() - timedelta(seconds=LLM_CACHE_TTL_SECONDS)
+    expired = db.execute(delete(LlmCacheDB).where(LlmCacheDB.created_at < cutoff)).rowcount
+
+    overflow = (
+        select(LlmCacheDB.cache_key)
+        .order_by(LlmCacheDB.last_used_at.desc())
+        .offset(LLM_CACHE_MAX_ENTRIES)
+        .scalar_subquery()
+    )
+    evicted = db.execute(
+        delete(LlmCacheDB).where(LlmCacheDB.cache_key.in_(overflow)).execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+
+    _count("expired", expired)
+    _count("evicted", evicted)
+    return expired + evicted
+
+
+def extract_fields_cached(db: Session, text: str, bypass: bool = False, user_id=None) -> dict:
+    """
+    extract_fields_with_llm with a persistent cache in front of it.
+
+    Only successful answers are stored. Cache failures are logged and never
+    fail the extraction itself.
+    """
+    if bypass or not LLM_CACHE_ENABLED:
+        _count("bypassed")
+        return extract_fields_with_llm(text, user_id)
+
+    try:
+        cached = get(db, text)
+        if cached is not None:
+            return cached
+    except Exception as e:
+        db.rollback()
+        _count("errors")
+        print(f"LLM cache lookup failed: {e}")
+
+    json_data = extract_fields_with_llm(text, user_id)
+    if "error" not in json_data:
+        try:
+            put(db, text, json_data)
+        except Exception as e:
+            db.rollback()
+            _count("errors")
+            print(f"LLM cache store failed: {e}")
+    return json_data
+
+
+def get_llm_cache_stats() -> dict:
+    with _stats_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_rate": round(_stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
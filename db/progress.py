@@ -0,0 +1,265 @@
+"""Extraction progress events, pushed to clients by GET /extract/events.
+
+Code that changes an extraction calls publish(db, ...) before committing.
+The event goes out only if that commit succeeds, so a stream never reports
+a state that a GET can't see. How it travels depends on PROGRESS_BUS:
+
+- "postgres": the events are sent with pg_notify inside the committing
+  transaction. Every worker process keeps one asyncpg connection LISTENing
+  on the channel and hands the notifications to its own open streams. An
+  extraction running in one gunicorn worker therefore reaches a stream
+  served by another.
+- "memory": the events go straight to this process's streams after the
+  commit. There is no database round trip, but it is only correct with a
+  single worker.
+
+Streams are asyncio queues on the server's event loop. Publishers run on
+request and batch threads, so delivery goes through call_soon_threadsafe.
+A stream that falls PROGRESS_QUEUE_SIZE events behind loses its backlog and
+gets a "resync" event instead.
+"""
+import asyncio
+import contextlib
+import json
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import PROGRESS_BUS, PROGRESS_KEEPALIVE_SECONDS, PROGRESS_QUEUE_SIZE
+from db.database import ASYNC_CONNECT_ARGS, AsyncSessionLocal, SessionLocal, async_engine
+from db.table_models import ExtractedFileDB, ExtractionStatus, FileDB
+
+CHANNEL = "extraction_progress"
+# pg_notify payloads are limited to 8000 bytes.
+MAX_ERROR_LENGTH = 500
+LISTENER_RETRY_SECONDS = 5
+
+_lock = threading.Lock()
+# user id -> {queue: event loop that owns it}
+_subscribers = {}
+_stats = {"published": 0, "delivered": 0, "dropped": 0, "listener_reconnects": 0}
+_listener = None
+_listener_ready = None
+
+
+def _event(file_id, status, stage: Optional[str] = None, error_message: Optional[str] = None, at=None) -> dict:
+    return {
+        "file_id": str(file_id),
+        "status": status.value if isinstance(status, ExtractionStatus) else status,
+        "stage": stage,
+        "error_message": error_message[:MAX_ERROR_LENGTH] if error_message else None,
+        "at": (at or datetime.utcnow()).isoformat(),
+    }
+
+
+def publish(
+    db: Session,
+    user_id,
+    file_id,
+    status: ExtractionStatus,
+    stage: Optional[str] = None,
+    error_message: Optional[str] = None,
+):
+    """Queues an event on ``db``. It is sent when the session next commits and dropped on rollback."""
+    db.info.setdefault("progress_events", []).append((str(user_id), _event(file_id, status, stage, error_message)))
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def _notify_in_transaction(session):
+    if PROGRESS_BUS != "postgres":
+        return
+    events = session.info.pop("progress_events", None)
+    if not events:
+        return
+    # One round trip for all of them. Postgres delivers them at COMMIT, or never on rollback.
+    session.execute(
+        text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+        {"channel": CHANNEL, "payloads": [json.dumps({"user_id": user_id, **data}) for user_id, data in events]},
+    )
+    with _lock:
+        _stats["published"] += len(events)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _deliver_after_commit(session):
+    events = session.info.pop("progress_events", None)
+    if not events:
+        return
+    with _lock:
+        _stats["published"] += len(events)
+    for user_id, data in events:
+        _deliver(user_id, "progress", data)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard(session):
+    session.info.pop("progress_events", None)
+
+
+def _offer(queue: asyncio.Queue, item: tuple):
+    dropped = 0
+    if queue.full():
+        # The client fell behind. Rather than silently lose a transition it may never
+        # see again, drop the backlog and tell it to re-read the current state.
+        while not queue.empty():
+            queue.get_nowait()
+            dropped += 1
+        queue.put_nowait(("resync", {}))
+    if not queue.full():
+        queue.put_nowait(item)
+    with _lock:
+        _stats["delivered"] += 1
+        _stats["dropped"] += dropped
+
+
+def _deliver(user_id: str, kind: str, data: dict):
+    with _lock:
+        targets = list(_subscribers.get(user_id, {}).items())
+    for queue, loop in targets:
+        # The loop is gone if its server shut down between the lookup and here.
+        with contextlib.suppress(RuntimeError):
+            loop.call_soon_threadsafe(_offer, queue, (kind, data))
+
+
+def _broadcast(kind: str, data: dict):
+    with _lock:
+        user_ids = list(_subscribers)
+    for user_id in user_ids:
+        _deliver(user_id, kind, data)
+
+
+def _on_notification(connection, pid, channel, payload):
+    try:
+        data = json.loads(payload)
+        user_id = data.pop("user_id")
+    except (ValueError, KeyError):
+        print(f"Ignoring malformed progress notification: {payload[:200]}")
+        return
+    _deliver(user_id, "progress", data)
+
+
+async def _listen(ready: asyncio.Event):
+    """Keeps one LISTEN connection open for this process, reconnecting after failures."""
+    import asyncpg
+
+    # The engine's own connect_args carry what its URL can't: ssl, timeouts (see db/database.py).
+    _, connect_args = async_engine.dialect.create_connect_args(async_engine.url)
+    connect_args = {**connect_args, **ASYNC_CONNECT_ARGS}
+    connected_before = False
+    while True:
+        try:
+            connection = await asyncpg.connect(**connect_args)
+        except Exception as e:
+            print(f"Progress listener could not connect: {e}")
+            await asyncio.sleep(LISTENER_RETRY_SECONDS)
+            continue
+
+        closed = asyncio.Event()
+        connection.add_termination_listener(lambda _: closed.set())
+        try:
+            await connection.add_listener(CHANNEL, _on_notification)
+            ready.set()
+            if connected_before:
+                # Notifications sent while disconnected are lost; streams must re-read the current state.
+                with _lock:
+                    _stats["listener_reconnects"] += 1
+                _broadcast("resync", {})
+            connected_before = True
+            while not closed.is_set():
+                try:
+                    await asyncio.wait_for(closed.wait(), PROGRESS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # A dead peer without a FIN only shows up when we talk to it.
+                    await connection.execute("SELECT 1", timeout=PROGRESS_KEEPALIVE_SECONDS)
+        except Exception as e:
+            print(f"Progress listener lost its connection: {e}")
+        finally:
+            ready.clear()
+            with contextlib.suppress(Exception):
+                await connection.close(timeout=1)
+        await asyncio.sleep(LISTENER_RETRY_SECONDS)
+
+
+async def _ensure_listener():
+    global _listener, _listener_ready
+    loop = asyncio.get_running_loop()
+    if _listener is None or _listener.done() or _listener.get_loop() is not loop:
+        _listener_ready = asyncio.Event()
+        _listener = loop.create_task(_listen(_listener_ready))
+    # Wait for LISTEN before the caller reads its snapshot, or changes in between would be lost.
+    with contextlib.suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(_listener_ready.wait(), LISTENER_RETRY_SECONDS)
+
+
+async def subscribe(user_id) -> asyncio.Queue:
+    queue = asyncio.Queue(maxsize=PROGRESS_QUEUE_SIZE)
+    with _lock:
+        _subscribers.setdefault(str(user_id), {})[queue] = asyncio.get_running_loop()
+    if PROGRESS_BUS == "postgres":
+        await _ensure_listener()
+    return queue
+
+
+def unsubscribe(user_id, queue: asyncio.Queue):
+    with _lock:
+        queues = _subscribers.get(str(user_id), {})
+        queues.pop(queue, None)
+        if not queues:
+            _subscribers.pop(str(user_id), None)
+
+
+async def snapshot(db: AsyncSession, user, file_ids: Optional[List] = None) -> List[dict]:
+    """Current state of the given files, or of all the user's pending and processing extractions."""
+    query = (
+        select(ExtractedFileDB.file_id, ExtractedFileDB.status, ExtractedFileDB.error_message, ExtractedFileDB.updated_at)
+        .join(FileDB, ExtractedFileDB.file_id == FileDB.id)
+        .where(FileDB.user_id == user.id)
+    )
+    if file_ids:
+        query = query.where(ExtractedFileDB.file_id.in_(file_ids))
+    else:
+        query = query.where(ExtractedFileDB.status.in_([ExtractionStatus.pending, ExtractionStatus.processing]))
+    rows = (await db.execute(query.order_by(ExtractedFileDB.updated_at))).all()
+    return [_event(row.file_id, row.status, error_message=row.error_message, at=row.updated_at) for row in rows]
+
+
+async def events(user, file_ids: Optional[List] = None):
+    """
+    Yields ``(kind, data)`` for one client: first the snapshot, then every change as it commits.
+
+    ``kind`` is "progress" or "resync" (events may have been lost; re-read
+    the state), or None after PROGRESS_KEEPALIVE_SECONDS without events.
+    """
+    wanted = {str(file_id) for file_id in file_ids} if file_ids else None
+    queue = await subscribe(user.id)
+    try:
+        # Subscribed first, so a change committed while the snapshot is read is still delivered.
+        async with AsyncSessionLocal() as db:
+            current = await snapshot(db, user, file_ids)
+        for data in current:
+            yield "progress", data
+
+        while True:
+            try:
+                kind, data = await asyncio.wait_for(queue.get(), PROGRESS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield None, None
+                continue
+            if wanted is None or kind != "progress" or data["file_id"] in wanted:
+                yield kind, data
+    finally:
+        unsubscribe(user.id, queue)
+
+
+def get_progress_stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            "bus": PROGRESS_BUS,
+            "streams": sum(len(queues) for queues in _subscribers.values()),
+            "listener_connected": bool(_listener_ready and _listener_ready.is_set()),
+        }
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, DateTime, ForeignKey, String, Text, Enum
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, Identity, Index, Integer, String, Text, Enum
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from datetime import timedelta
@@ -30,10 +30,20 @@ class FileDB(Base):
     filename = Column(String, nullable=False)
     path = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Keyed HMAC-SHA256 of the plaintext, used to spot re-uploads of the same invoice
+    content_hash = Column(String(64), nullable=True)
+    # Lowercased extension of filename, stored so listings can filter on it
+    filetype = Column(String(8), nullable=True)
 
     owner = relationship("UserDB", back_populates="invoices")
     extracted_file = relationship("ExtractedFileDB", back_populates="file", uselist=False, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_files_user_id_content_hash", "user_id", "content_hash"),
+        # Per-user listings, newest first, with id as the tie-breaker
+        Index("ix_files_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
 class ExtractedFileDB(Base):
     __tablename__ = "extracted_files"
 
@@ -46,4 +56,42 @@ class ExtractedFileDB(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     error_message = Column(Text, nullable=True)
 
-    file = relationship("FileDB", back_populates="extracted_file")
\ No newline at end of file
+    file = relationship("FileDB", back_populates="extracted_file")
+
+    __table_args__ = (
+        # One extraction row per file
+        Index("uq_extracted_files_file_id", "file_id", unique=True),
+        Index("ix_extracted_files_status", "status"),
+    )
+
+class ExtractionBatchDB(Base):
+    __tablename__ = "extraction_batches"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    file_ids = Column(JSONB, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class LlmCacheDB(Base):
+    __tablename__ = "llm_cache"
+
+    # sha256(prompt_version, model_name, normalized OCR text)
+    cache_key = Column(String(64), primary_key=True)
+    prompt_version = Column(String(32), nullable=False)
+    model_name = Column(String(128), nullable=False)
+    json_data = Column(JSONB, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_used_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    hit_count = Column(Integer, default=0, nullable=False)
+
+
+class BlobReclaimDB(Base):
+    """Encrypted blobs whose rows are gone, waiting for db/blob_reclaim.py to unlink them."""
+
+    __tablename__ = "blob_reclaim"
+
+    id = Column(BigInteger, Identity(), primary_key=True)
+    path = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
@@ -1,8 +1,9 @@
 import uuid
 from pydantic import BaseModel
-import bcrypt
+from auth import passwords
 from auth.jwt_handler import create_access_token
-from db.table_models import UserDB
+from db.files import delete_all
+from db.table_models import ExtractionBatchDB, UserDB
 
 class TokenResponse(BaseModel):
     access_token: str
@@ -16,6 +17,10 @@ class TokenResponse(BaseModel):
 #     class Config:
 #         from_attributes = True
 
+class PasswordChangeRequest(BaseModel):
+    current_password: str
+    new_password: str
+
 class UserResponse(BaseModel):
     id: uuid.UUID
     username: str
@@ -25,7 +30,7 @@ class UserResponse(BaseModel):
 
 
 def create(db, username: str, password: str) -> UserResponse:
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')  # FIXED
+    hashed_password = passwords.hash_password(password)
     new_user = UserDB(username=username, hashed_password=hashed_password)
     db.add(new_user)
     db.commit()
@@ -37,10 +42,36 @@ def create(db, username: str, password: str) -> UserResponse:
     )
 
 def verify(db, username: str, password: str):
+    """
+    One lookup and one bcrypt check, also for unknown users. Upgrades the stored hash when BCRYPT_ROUNDS changed.
+
+    Raises:
+        PasswordHasherBusy: When the password executor is saturated.
+    """
     user = db.query(UserDB).filter(UserDB.username == username).first()
-    if user and bcrypt.checkpw(password.encode('utf-8'), user.hashed_password.encode('utf-8')):
-        return user
-    return None
+    if not passwords.verify_password(password, user.hashed_password if user else None):
+        return None
+    new_hash = passwords.upgraded_hash(password, user.hashed_password)
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
+    return user
 
 def get_by_username(db, username: str):
-    return db.query(UserDB).filter(UserDB.username == username).first()
\ No newline at end of file
+    return db.query(UserDB).filter(UserDB.username == username).first()
+
+def change_password(db, user_id: uuid.UUID, current_password: str, new_password: str) -> bool:
+    user = db.get(UserDB, user_id)
+    if not user or not passwords.verify_password(current_password, user.hashed_password):
+        return False
+    user.hashed_password = passwords.hash_password(new_password)
+    db.commit()
+    return True
+
+def delete(db, user) -> int:
+    """Deletes the user with all their files, extractions and batches. Returns the number of files removed."""
+    count = delete_all(db, user)
+    db.query(ExtractionBatchDB).filter(ExtractionBatchDB.user_id == user.id).delete(synchronize_session=False)
+    db.query(UserDB).filter(UserDB.id == user.id).delete(synchronize_session=False)
+    db.commit()
+    return count
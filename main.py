@@ -1,16 +1,35 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from db.database import Base, engine
-from db import table_models
-from routers import users, files, extracted
+from fastapi.responses import JSONResponse
+from config import LOCAL_LLM_HOST_ADDRESS
+from db import batches, blob_reclaim, dedup
+from routers import users, files, extracted, metrics
+from storage import StorageUnavailable
 import uvicorn
 import os
 
-# Create database tables (once, globally — especially needed in deployment)
-table_models.Base.metadata.create_all(bind=engine)
+# The schema is managed by Alembic (see migrations/); the app itself never issues DDL.
+# "alembic upgrade head" runs before the new code serves: in the Azure workflow's deploy job
+# (.github/workflows/main_sqai-backend.yml), the Procfile release phase, the Dockerfile CMD
+# and the Render start command.
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Uploads can't be hashed without it; fail now rather than on the first upload.
+    dedup.check_key()
+    # Picks up blobs queued for unlinking before the last shutdown (see db/blob_reclaim.py).
+    blob_reclaim.start()
+    # Requeues extractions a previous process left half-done (see db/batches.py).
+    batches.start_recovery()
+    if LOCAL_LLM_HOST_ADDRESS:
+        # Fails startup on a missing authkey or a non-local address (see models/local_llm_host.py).
+        from models import local_llm_host
+        local_llm_host.get_client()
+    yield
 
 # Initialize FastAPI app
-app = FastAPI(title="Invoice Management API")
+app = FastAPI(title="Invoice Management API", lifespan=lifespan)
 
 # CORS settings for frontend
 app.add_middleware(
@@ -19,12 +38,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cross-origin scripts only see the headers listed here; GET /files/ pages through X-Next-Cursor.
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# Blob storage outages are retryable, not missing files (see storage/base.py).
+@app.exception_handler(StorageUnavailable)
+async def storage_unavailable(request: Request, exc: StorageUnavailable):
+    print(f"Blob storage unavailable: {exc}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "File storage is temporarily unavailable"},
+        headers={"Retry-After": "5"},
+    )
+
 # Register routers
 app.include_router(users.router)
 app.include_router(files.router)
 app.include_router(extracted.router)
+app.include_router(metrics.router)
 
 # Health check endpoint
 @app.get("/check", tags=["health"])
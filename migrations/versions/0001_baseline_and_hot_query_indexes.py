@@ -0,0 +1,125 @@
+"""Baseline schema and the indexes the hot queries need
+
+Databases created by the old create_all() at startup already have most of
+these tables, so every table and column is created only when missing. The
+indexes are then built CONCURRENTLY, outside the migration transaction, so
+files and extracted_files stay writable while they build.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+extraction_status = postgresql.ENUM("pending", "processing", "done", "error", name="extractionstatus", create_type=False)
+
+# name -> (table, columns, unique)
+INDEXES = {
+    "ix_files_user_id_content_hash": ("files", ["user_id", "content_hash"], False),
+    "ix_files_user_id_created_at_id": ("files", ["user_id", "created_at", "id"], False),
+    "uq_extracted_files_file_id": ("extracted_files", ["file_id"], True),
+    "ix_extracted_files_status": ("extracted_files", ["status"], False),
+    "ix_llm_cache_last_used_at": ("llm_cache", ["last_used_at"], False),
+}
+
+
+def _create_missing_tables():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    extraction_status.create(bind, checkfirst=True)
+
+    if not inspector.has_table("users"):
+        op.create_table(
+            "users",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("username", sa.String(255), nullable=False, unique=True),
+            sa.Column("hashed_password", sa.String(255), nullable=True),
+        )
+
+    if not inspector.has_table("files"):
+        op.create_table(
+            "files",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("user_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("filename", sa.String(), nullable=False),
+            sa.Column("path", sa.String(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.Column("content_hash", sa.String(64), nullable=True),
+        )
+    elif "content_hash" not in {column["name"] for column in inspector.get_columns("files")}:
+        op.add_column("files", sa.Column("content_hash", sa.String(64), nullable=True))
+
+    if not inspector.has_table("extracted_files"):
+        op.create_table(
+            "extracted_files",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("file_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("files.id"), nullable=False),
+            sa.Column("extracted_text", sa.Text(), nullable=True),
+            sa.Column("json_data", postgresql.JSONB(), nullable=True),
+            sa.Column("status", extraction_status, nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(), nullable=True),
+            sa.Column("error_message", sa.Text(), nullable=True),
+        )
+
+    if not inspector.has_table("extraction_batches"):
+        op.create_table(
+            "extraction_batches",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("user_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("file_ids", postgresql.JSONB(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+        )
+
+    if not inspector.has_table("llm_cache"):
+        op.create_table(
+            "llm_cache",
+            sa.Column("cache_key", sa.String(64), primary_key=True),
+            sa.Column("prompt_version", sa.String(32), nullable=False),
+            sa.Column("model_name", sa.String(128), nullable=False),
+            sa.Column("json_data", postgresql.JSONB(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("last_used_at", sa.DateTime(), nullable=False),
+            sa.Column("hit_count", sa.Integer(), nullable=False),
+        )
+
+
+def upgrade():
+    _create_missing_tables()
+
+    # The unique index can't be built while a file has several extraction rows;
+    # keep the most recently updated one.
+    op.execute(
+        """
+        DELETE FROM extracted_files a
+        USING extracted_files b
+        WHERE a.file_id = b.file_id
+          AND (COALESCE(a.updated_at, a.created_at, 'epoch'), a.id) < (COALESCE(b.updated_at, b.created_at, 'epoch'), b.id)
+        """
+    )
+
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        for name, (table, columns, unique) in INDEXES.items():
+            # A failed CONCURRENTLY build leaves an INVALID index behind that IF NOT EXISTS would keep.
+            invalid = bind.execute(
+                sa.text("SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name AND NOT i.indisvalid"),
+                {"name": name},
+            ).first()
+            if invalid:
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    # The tables predate migrations; only the indexes added for the hot queries are dropped.
+    with op.get_context().autocommit_block():
+        for name in ("ix_files_user_id_created_at_id", "uq_extracted_files_file_id", "ix_extracted_files_status"):
+            op.drop_index(name, table_name=INDEXES[name][0], postgresql_concurrently=True, if_exists=True)
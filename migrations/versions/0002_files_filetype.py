@@ -0,0 +1,39 @@
+"""Store the file extension on files so listings can filter on it
+
+The column is added nullable and backfilled in batches, each committed on
+its own, so no long transaction holds locks on files while old rows are
+filled in. db/files.py falls back to the filename for any row left NULL.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade():
+    op.add_column("files", sa.Column("filetype", sa.String(8), nullable=True))
+
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while True:
+            updated = bind.execute(sa.text(
+                """
+                UPDATE files SET filetype = left(lower(substring(filename from '[^.]*$')), 8)
+                WHERE id IN (SELECT id FROM files WHERE filetype IS NULL LIMIT :batch_size)
+                """
+            ), {"batch_size": BACKFILL_BATCH_SIZE}).rowcount
+            if updated < BACKFILL_BATCH_SIZE:
+                break
+
+
+def downgrade():
+    op.drop_column("files", "filetype")
@@ -1,24 +1,50 @@
-import json
-import csv
-import os
-from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
-from datetime import datetime
+"""Invoice field extraction with the local SmolLM2 model.
 
+Nothing is loaded at import. The tokenizer and model are loaded on the first
+extraction, with the safetensors weights memory-mapped rather than copied.
+On CPU, the Linear layers are then int8-quantized with torch dynamic
+quantization (LOCAL_LLM_QUANTIZE).
 
-model_path = "./models/local_smol_model/"
+Concurrent extract_entities() calls are grouped into dynamic batches by
+DynamicBatcher. A batch runs once LOCAL_LLM_MAX_BATCH_SIZE prompts are
+queued or LOCAL_LLM_MAX_WAIT_MS after its first prompt, whichever comes
+first. Each batch is one padded generate() call. The constant prompt prefix
+is encoded once and its key/value cache is reused by every batch. Decoding
+is held to the invoice JSON schema and stops when the object closes (see
+models/json_decoding.py).
 
-tokenizer = AutoTokenizer.from_pretrained(model_path, local_files_only=True)
-model = AutoModelForCausalLM.from_pretrained(model_path, local_files_only=True)
+When LOCAL_LLM_HOST_ADDRESS is set, the model is not loaded in this process
+at all. Calls go to the shared model-host process (models/local_llm_host.py),
+so gunicorn workers hold a connection instead of a copy of the weights.
 
-# Load Local SmolLM2 model
-pipe = pipeline("text-generation", model=model, tokenizer=tokenizer)
+torch and transformers are only needed where the model actually runs, so
+they are imported lazily.
+"""
+import copy
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
 
-# Load SmolLM2-360M model
-# pipe = pipeline("text-generation", model="HuggingFaceTB/SmolLM2-360M")
+from config import (
+    LOCAL_LLM_CONSTRAINED_DECODING,
+    LOCAL_LLM_HOST_ADDRESS,
+    LOCAL_LLM_MAX_BATCH_SIZE,
+    LOCAL_LLM_MAX_NEW_TOKENS,
+    LOCAL_LLM_MAX_WAIT_MS,
+    LOCAL_LLM_MODEL_PATH,
+    LOCAL_LLM_NUM_THREADS,
+    LOCAL_LLM_PREFIX_CACHE,
+    LOCAL_LLM_QUANTIZE,
+)
+from models import json_decoding
 
 
-def build_prompt(invoice_text: str) -> str:
-    return f"""
+# Everything that doesn't depend on the invoice comes first, so its key/value
+# cache can be computed once and shared by every call (see _prefix_cache).
+PROMPT_PREFIX = """
     You are an expert invoice data extractor. Extract the following fields from the invoice text:
     'invoice_number', 'invoice_date' (formatYYYY-MM-DD), 'due_date' (formatYYYY-MM-DD),
     'vendor_name', 'vendor_address', 'gstin', 'total_amount', 'tax_amount', 'currency', 'purchase_order_number',
@@ -26,13 +52,8 @@ def build_prompt(invoice_text: str) -> str:
     If a field is not found, use null. For amounts, extract only the numerical value without currency symbols or commas.
     For dates, use YYYY-MM-DD format.
 
-    Invoice Text:
-    ---
-    {invoice_text}
-    ---
-
     Provide the output strictly as only a JSON object. Example JSON structure:
-    {{
+    {
       "invoice_number": "INV-123",
       "invoice_date": "2024-01-15",
       "due_date": "2024-02-15",
@@ -44,32 +65,286 @@ def build_prompt(invoice_text: str) -> str:
       "currency": "INR",
       "purchase_order_number": "PO-987",
       "line_items": [
-        {{
+        {
           "description": "Product A",
           "quantity": 2,
           "unit_price": 250.00,
           "line_total": 500.00
-        }},
-        {{
+        },
+        {
           "description": "Service B",
           "quantity": 1,
           "unit_price": 500.50,
           "line_total": 500.50
-        }}
+        }
       ]
-    }}
+    }
+"""
+
+
+def build_prompt_suffix(invoice_text: str) -> str:
+    return f"""
+    Invoice Text:
+    ---
+    {invoice_text}
+    ---
+
+    JSON:
+"""
+
+
+def build_prompt(invoice_text: str) -> str:
+    return PROMPT_PREFIX + build_prompt_suffix(invoice_text)
+
+
+_model = None
+_tokenizer = None
+_load_lock = threading.Lock()
+
+
+def load_model() -> tuple:
+    """Returns (tokenizer, model), loading them on first use."""
+    global _model, _tokenizer
+    with _load_lock:
+        if _model is None:
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+
+            torch.set_num_threads(LOCAL_LLM_NUM_THREADS)
+            started = time.perf_counter()
+            tokenizer = AutoTokenizer.from_pretrained(LOCAL_LLM_MODEL_PATH, local_files_only=True)
+            # Batches are left-padded so every prompt ends where generation starts.
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            # safetensors weights are mmapped; low_cpu_mem_usage skips the random-init copy.
+            model = AutoModelForCausalLM.from_pretrained(
+                LOCAL_LLM_MODEL_PATH,
+                local_files_only=True,
+                torch_dtype=torch.float32,
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+            )
+            model.eval()
+            if LOCAL_LLM_QUANTIZE:
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            if LOCAL_LLM_CONSTRAINED_DECODING:
+                json_decoding.prepare_enforcer(tokenizer)
+            _tokenizer, _model = tokenizer, model
+            print(f"Local LLM loaded from {LOCAL_LLM_MODEL_PATH} in {time.perf_counter() - started:.1f}s "
+                  f"(int8={LOCAL_LLM_QUANTIZE}, threads={LOCAL_LLM_NUM_THREADS})")
+        return _tokenizer, _model
+
+
+_prefix = None
+_stats_lock = threading.Lock()
+_stats = {"prompts": 0, "prefix_tokens_reused": 0, "generated_tokens": 0, "constrained": 0, "parse_failures": 0}
+
+
+def _count(name: str, amount: int = 1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def _prefix_cache() -> tuple:
+    """(PROMPT_PREFIX token ids of shape (1, n), their key/value cache), computed on first use."""
+    global _prefix
+    import torch
+
+    with _load_lock:
+        if _prefix is None:
+            tokenizer, model = _tokenizer, _model
+            prefix_ids = tokenizer(PROMPT_PREFIX, return_tensors="pt").input_ids
+            with torch.inference_mode():
+                _prefix = prefix_ids, model(input_ids=prefix_ids, use_cache=True).past_key_values
+        return _prefix
+
+
+def generate_batch(invoice_texts: list) -> list:
     """
+    Greedy-decodes one prompt per invoice in a single generate() call and returns only the generated text of each.
 
+    With LOCAL_LLM_PREFIX_CACHE, each row is [PROMPT_PREFIX][padding][suffix]. The
+    prefix rows are covered by a copy of the shared key/value cache, so only the
+    invoice-specific suffix is encoded. Padding in the middle is masked out, and
+    position ids come from the attention mask, so the suffix positions stay
+    contiguous with the prefix.
+    """
+    import torch
 
-def extract_entities(invoice_text: str) -> dict:
-    prompt = build_prompt(invoice_text)
-    output = pipe(prompt, max_new_tokens=512, do_sample=False)[0]['generated_text']
+    tokenizer, model = load_model()
+    batch_size = len(invoice_texts)
+    kwargs = {}
+    if LOCAL_LLM_PREFIX_CACHE:
+        prefix_ids, prefix_cache = _prefix_cache()
+        suffixes = tokenizer([build_prompt_suffix(text) for text in invoice_texts], return_tensors="pt", padding=True, add_special_tokens=False)
+        input_ids = torch.cat([prefix_ids.expand(batch_size, -1), suffixes.input_ids], dim=1)
+        attention_mask = torch.cat([torch.ones(batch_size, prefix_ids.shape[1], dtype=suffixes.attention_mask.dtype), suffixes.attention_mask], dim=1)
+        with torch.inference_mode():
+            # generate() appends to the cache in place; the shared one must stay pristine.
+            cache = copy.deepcopy(prefix_cache)
+            cache.batch_repeat_interleave(batch_size)
+        kwargs["past_key_values"] = cache
+        _count("prefix_tokens_reused", prefix_ids.shape[1] * batch_size)
+    else:
+        inputs = tokenizer([build_prompt(text) for text in invoice_texts], return_tensors="pt", padding=True)
+        input_ids, attention_mask = inputs.input_ids, inputs.attention_mask
+
+    prompt_length = input_ids.shape[1]
+    if LOCAL_LLM_CONSTRAINED_DECODING:
+        kwargs["prefix_allowed_tokens_fn"] = json_decoding.prefix_allowed_tokens_fn(tokenizer)
+        _count("constrained", batch_size)
+    with torch.inference_mode():
+        output_ids = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=LOCAL_LLM_MAX_NEW_TOKENS,
+            do_sample=False,
+            pad_token_id=tokenizer.pad_token_id,
+            stopping_criteria=json_decoding.stopping_criteria(tokenizer, prompt_length, batch_size),
+            **kwargs,
+        )
+    generated = output_ids[:, prompt_length:]
+    _count("prompts", batch_size)
+    _count("generated_tokens", int((generated != tokenizer.pad_token_id).sum()))
+    return tokenizer.batch_decode(generated, skip_special_tokens=True)
 
-    # The model might echo the prompt; strip it
+
+def parse_output(output: str) -> dict:
     print("Model output:", output)
-    generated_json_str = output.replace(prompt, "").strip()
+    json_text = json_decoding.json_object_span(output)
     try:
-        json_obj = json.loads(generated_json_str)
-        return json_obj
+        return json.loads(json_text if json_text is not None else output.strip())
     except json.JSONDecodeError:
-        raise ValueError("Model output is not valid JSON.")
\ No newline at end of file
+        _count("parse_failures")
+        raise ValueError("Model output is not valid JSON.")
+
+
+def run_batch(invoice_texts: list) -> list:
+    """Extracts a batch of invoices. Each item is the parsed dict, or the ValueError for that invoice."""
+    results = []
+    for output in generate_batch(invoice_texts):
+        try:
+            results.append(parse_output(output))
+        except ValueError as e:
+            results.append(e)
+    return results
+
+
+class DynamicBatcher:
+    """
+    Groups items submitted from many threads into batches for ``run_batch``.
+
+    A single thread takes the first waiting item, then keeps collecting until
+    ``max_batch_size`` items are queued or ``max_wait_ms`` have passed.
+    ``run_batch`` returns one result per item. A result that is an exception
+    is raised to that item's caller.
+    """
+
+    def __init__(self, run_batch: Callable[[list], list], max_batch_size: int = LOCAL_LLM_MAX_BATCH_SIZE, max_wait_ms: int = LOCAL_LLM_MAX_WAIT_MS):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._by_size = {}
+        threading.Thread(target=self._loop, name="local-llm-batcher", daemon=True).start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                results = self.run_batch([item for item, _, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            finished = time.perf_counter()
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            self._record(len(batch), finished - started, [finished - queued_at for _, _, queued_at in batch])
+
+    def _record(self, size: int, run_seconds: float, latencies: list):
+        with self._stats_lock:
+            stats = self._by_size.setdefault(size, {"batches": 0, "items": 0, "run_seconds": 0.0, "latency_seconds": 0.0})
+            stats["batches"] += 1
+            stats["items"] += size
+            stats["run_seconds"] += run_seconds
+            stats["latency_seconds"] += sum(latencies)
+
+    def get_stats(self) -> dict:
+        """Per batch size: how many batches ran, items/s while running, and mean per-item latency including queueing."""
+        with self._stats_lock:
+            return {
+                size: {
+                    "batches": s["batches"],
+                    "items": s["items"],
+                    "items_per_second": round(s["items"] / s["run_seconds"], 2) if s["run_seconds"] else None,
+                    "avg_latency_ms": round(s["latency_seconds"] / s["items"] * 1000, 1),
+                }
+                for size, s in sorted(self._by_size.items())
+            }
+
+
+_batcher: Optional[DynamicBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> DynamicBatcher:
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = DynamicBatcher(run_batch)
+        return _batcher
+
+
+def submit_entities(invoice_text: str) -> Future:
+    """Queues an extraction and returns its future; see extract_entities for the errors it can carry."""
+    if LOCAL_LLM_HOST_ADDRESS:
+        from models import local_llm_host
+        return local_llm_host.get_client().submit(invoice_text)
+    return get_batcher().submit(invoice_text)
+
+
+def extract_entities(invoice_text: str) -> dict:
+    """
+    Extracts invoice fields with the local model.
+
+    Raises:
+        ValueError: If the model output is not valid JSON.
+        ConnectionError: If LOCAL_LLM_HOST_ADDRESS is set and the model host can't be reached.
+    """
+    return submit_entities(invoice_text).result()
+
+
+def local_stats() -> dict:
+    """Stats of the model running in this process."""
+    if _batcher is None:
+        return {}
+    with _stats_lock:
+        return {**_stats, "batch_sizes": _batcher.get_stats()}
+
+
+def get_local_llm_stats() -> dict:
+    if LOCAL_LLM_HOST_ADDRESS:
+        from models import local_llm_host
+        return local_llm_host.get_client_stats()
+    return local_stats()
@@ -1,17 +1,48 @@
 import pytesseract
-from cryptography.fernet import Fernet
-from pdf2image import convert_from_bytes
 from PIL import Image
+from collections import deque
+from dataclasses import dataclass
 import io
 import os
+import subprocess
+import time
+
+import numpy as np
 
 from auth.encryption import get_user_fernet_key
+from auth.file_encryption import decrypt_file_bytes
+from config import PDF_MAX_PAGES, PDF_PAGE_WINDOW, PDF_RENDER_DPI
+from models import ocr_engine
+from storage import get_storage
+from models.invoice_extraction_model import preprocess_image_array
+
+
+@dataclass
+class PageResult:
+    page: int
+    text: str
+    render_ms: float
+    ocr_ms: float
+
+
+@dataclass
+class PdfOcrResult:
+    pages: list[PageResult]
+    page_count: int
+
+    @property
+    def truncated(self) -> bool:
+        return len(self.pages) < self.page_count
+
+    @property
+    def text(self) -> str:
+        return "".join(page.text + "\n" for page in self.pages)
 
 
 def decrypt_file(path: str, fernet_key: bytes) -> bytes:
-    with open(path, "rb") as f:
-        encrypted_data = f.read()
-    return Fernet(fernet_key).decrypt(encrypted_data)
+    """``path`` is the storage key from files.path."""
+    with get_storage().open_read(path) as blob:
+        return decrypt_file_bytes(blob, fernet_key)
 
 
 def extract_text_from_image_bytes(image_bytes: bytes) -> str:
@@ -19,12 +50,75 @@ def extract_text_from_image_bytes(image_bytes: bytes) -> str:
     return pytesseract.image_to_string(image)
 
 
+def _poppler(args: list, pdf_bytes: bytes) -> bytes:
+    """
+    Runs a poppler tool on a PDF piped through stdin and returns its stdout.
+
+    The decrypted PDF never touches the disk, so a worker killed mid-document
+    leaves no plaintext invoice behind in a temp directory.
+    """
+    try:
+        completed = subprocess.run(args, input=pdf_bytes, capture_output=True, check=True)
+    except FileNotFoundError:
+        raise RuntimeError(f"{args[0]} not found; install poppler-utils.")
+    except subprocess.CalledProcessError as e:
+        raise ValueError(f"Could not read PDF: {e.stderr.decode(errors='replace').strip()}")
+    return completed.stdout
+
+
+def pdf_page_count(pdf_bytes: bytes) -> int:
+    for line in _poppler(["pdfinfo", "-"], pdf_bytes).decode(errors="replace").splitlines():
+        key, _, value = line.partition(":")
+        if key == "Pages":
+            return int(value)
+    raise ValueError("Could not read PDF: no page count.")
+
+
+def render_pdf_page(pdf_bytes: bytes, page: int, dpi: int = PDF_RENDER_DPI) -> Image.Image:
+    """One page as a grayscale image; pdftoppm writes it to stdout as a PGM."""
+    pgm = _poppler(
+        ["pdftoppm", "-f", str(page), "-l", str(page), "-r", str(dpi), "-gray", "-singlefile", "-"],
+        pdf_bytes,
+    )
+    return Image.open(io.BytesIO(pgm))
+
+
+def ocr_pdf_pages(pdf_bytes: bytes, max_pages: int = PDF_MAX_PAGES, window: int = PDF_PAGE_WINDOW) -> PdfOcrResult:
+    """
+    OCRs a PDF page by page, in parallel, without rendering the whole document up front.
+
+    Pages are rendered one at a time, from memory, and handed to the OCR pool;
+    at most ``window`` rendered pages are held in memory at once. Results are
+    collected oldest first, so they come back in page order.
+    """
+    page_count = pdf_page_count(pdf_bytes)
+    in_flight = deque()
+    pages = []
+
+    def collect_oldest():
+        page, render_ms, submitted_at, job = in_flight.popleft()
+        text = ocr_engine.collect(job)
+        pages.append(PageResult(page, text, render_ms, (time.perf_counter() - submitted_at) * 1000))
+
+    for page in range(1, min(page_count, max_pages) + 1):
+        started_at = time.perf_counter()
+        rendered = render_pdf_page(pdf_bytes, page)
+        image = preprocess_image_array(np.asarray(rendered), dpi=PDF_RENDER_DPI)
+        submitted_at = time.perf_counter()
+        in_flight.append((page, (submitted_at - started_at) * 1000, submitted_at, ocr_engine.submit(image)))
+        if len(in_flight) >= window:
+            collect_oldest()
+
+    while in_flight:
+        collect_oldest()
+
+    for result in pages:
+        print(f"PDF page {result.page}/{page_count}: render {result.render_ms:.0f} ms, ocr {result.ocr_ms:.0f} ms")
+    return PdfOcrResult(pages=pages, page_count=page_count)
+
+
 def extract_text_from_pdf_bytes(pdf_bytes: bytes) -> str:
-    images = convert_from_bytes(pdf_bytes)
-    text = ""
-    for img in images:
-        text += pytesseract.image_to_string(img) + "\n"
-    return text
+    return ocr_pdf_pages(pdf_bytes).text
 
 
 def extract_text(path: str, filename: str, username: str) -> str:
@@ -0,0 +1,220 @@
+"""Adaptive page normalization before OCR.
+
+Scans and phone photos arrive at whatever resolution, skew and lighting the
+device produced. Tesseract does best on roughly 300 dpi text, and its run
+time grows with the pixel count. normalize() therefore:
+
+1. rescales the page to OCR_TARGET_DPI, using the known render DPI for PDF
+   pages and the median glyph height for images, whose DPI metadata is
+   unreliable;
+2. deskews it, picking the rotation whose row profile has the sharpest
+   text lines;
+3. crops it to the bounding box of the text, ignoring specks and
+   scanner-edge shadows that touch the border;
+4. binarizes it with Otsu, or with a local adaptive threshold when the
+   background brightness varies across the page (shadows, uneven lighting).
+
+Page analysis runs on a downscaled copy (at most ANALYSIS_MAX_SIDE pixels
+on the long side) and only the final resize, rotation, crop and threshold
+touch the full image, so the pipeline costs a few OpenCV passes. Each step
+can be turned off in config.py. See benchmarks/bench_preprocessing.py.
+"""
+import threading
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from config import (
+    OCR_PREPROCESS_ADAPTIVE_THRESHOLD,
+    OCR_PREPROCESS_CROP,
+    OCR_PREPROCESS_DESKEW,
+    OCR_PREPROCESS_RESCALE,
+    OCR_TARGET_DPI,
+    OCR_UNEVEN_LIGHTING_DELTA,
+)
+
+ANALYSIS_MAX_SIDE = 1600
+# The angle search rotates the mask 40 times, so it works on an even smaller copy.
+SKEW_ANALYSIS_MAX_SIDE = 800
+# Median connected-component height of body text (10-11 pt) scanned at 300 dpi.
+REFERENCE_GLYPH_HEIGHT_AT_300_DPI = 24
+MAX_DESKEW_DEGREES = 10.0
+MAX_UPSCALE = 2.0
+# Scale factors within this tolerance of the target count as on target, and
+# downscales are snapped to 1/n, which OpenCV's INTER_AREA resizes several times faster.
+SCALE_TOLERANCE = 0.15
+
+_stats_lock = threading.Lock()
+_stats = {"pages": 0, "rescaled": 0, "deskewed": 0, "cropped": 0, "adaptive_threshold": 0, "pixels_in": 0, "pixels_out": 0}
+
+
+def _to_gray(img: np.ndarray) -> np.ndarray:
+    if img.ndim == 2:
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+
+
+def _ink_mask(gray: np.ndarray) -> np.ndarray:
+    """Text pixels as 255 on 0. Local mean thresholding, so shadows don't come out as ink."""
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 15)
+
+
+def _glyph_height(mask: np.ndarray) -> Optional[float]:
+    """Median height of glyph-sized connected components, or None when the page has too few."""
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    glyphs = heights[(heights >= 4) & (heights <= mask.shape[0] // 10) & (widths <= 3 * heights) & (stats[1:, cv2.CC_STAT_AREA] >= 8)]
+    return float(np.median(glyphs)) if len(glyphs) >= 20 else None
+
+
+def _rotate_mask(mask: np.ndarray, angle: float) -> np.ndarray:
+    height, width = mask.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(mask, matrix, (width, height), flags=cv2.INTER_NEAREST, borderValue=0)
+
+
+def _line_sharpness(mask: np.ndarray, angle: float) -> float:
+    # Aligned text lines give alternating full and empty rows, i.e. a high-variance row profile.
+    return float(np.var(_rotate_mask(mask, angle).sum(axis=1, dtype=np.float64)))
+
+
+def _skew_angle(mask: np.ndarray) -> float:
+    """Rotation in degrees (counter-clockwise) that levels the text lines: a 1 degree sweep, then 0.1 degree refinement."""
+    factor = SKEW_ANALYSIS_MAX_SIDE / max(mask.shape)
+    if factor < 1:
+        mask = cv2.resize(mask, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    best = max(np.arange(-MAX_DESKEW_DEGREES, MAX_DESKEW_DEGREES + 0.5, 1.0), key=lambda a: _line_sharpness(mask, a))
+    return float(max(np.arange(best - 0.9, best + 0.95, 0.1), key=lambda a: _line_sharpness(mask, a)))
+
+
+def _text_box(mask: np.ndarray, pad: int) -> Optional[tuple]:
+    """(x0, y0, x1, y1) around components that don't touch the border, padded; None when there are none."""
+    height, width = mask.shape
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    x, y = stats[1:, cv2.CC_STAT_LEFT], stats[1:, cv2.CC_STAT_TOP]
+    x1, y1 = x + stats[1:, cv2.CC_STAT_WIDTH], y + stats[1:, cv2.CC_STAT_HEIGHT]
+    keep = (x > 0) & (y > 0) & (x1 < width) & (y1 < height) & (stats[1:, cv2.CC_STAT_AREA] >= 4)
+    if not keep.any():
+        return None
+    return (
+        max(int(x[keep].min()) - pad, 0),
+        max(int(y[keep].min()) - pad, 0),
+        min(int(x1[keep].max()) + pad, width),
+        min(int(y1[keep].max()) + pad, height),
+    )
+
+
+def _snap_scale(scale: float) -> float:
+    if scale < 1:
+        snapped = 1 / round(1 / scale)
+        if abs(snapped - scale) <= SCALE_TOLERANCE * scale:
+            return snapped
+    return scale
+
+
+def _lighting_is_uneven(gray: np.ndarray) -> bool:
+    # Closing with a kernel larger than the glyphs wipes out the text and leaves the background.
+    small = cv2.resize(gray, (max(gray.shape[1] // 8, 1), max(gray.shape[0] // 8, 1)), interpolation=cv2.INTER_AREA)
+    background = cv2.morphologyEx(small, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15)))
+    low, high = np.percentile(background, (5, 95))
+    return high - low > OCR_UNEVEN_LIGHTING_DELTA
+
+
+def normalize(
+    img: np.ndarray,
+    dpi: Optional[float] = None,
+    rescale: bool = OCR_PREPROCESS_RESCALE,
+    deskew: bool = OCR_PREPROCESS_DESKEW,
+    crop: bool = OCR_PREPROCESS_CROP,
+    adaptive_threshold: bool = OCR_PREPROCESS_ADAPTIVE_THRESHOLD,
+) -> np.ndarray:
+    """
+    Turns a BGR or grayscale page into the binarized image handed to Tesseract.
+
+    Args:
+        img: The decoded page.
+        dpi: Resolution the page was rendered at, when known (PDF pages);
+            otherwise it is estimated from the glyph height.
+
+    Returns:
+        A uint8 image, text black on white.
+    """
+    gray = _to_gray(img)
+    pixels_in = gray.size
+
+    # Page analysis runs on a small copy; ``ratio`` maps its coordinates back to ``gray``.
+    ratio = 1 / -(-max(gray.shape) // ANALYSIS_MAX_SIDE)
+    small = gray if ratio == 1.0 else cv2.resize(gray, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA)
+    mask = _ink_mask(small) if rescale or deskew or crop else None
+    glyph_height = _glyph_height(mask) if mask is not None else None
+    if glyph_height is not None:
+        glyph_height /= ratio
+    counts = {}
+
+    if rescale:
+        if dpi is None and glyph_height is not None:
+            dpi = 300 * glyph_height / REFERENCE_GLYPH_HEIGHT_AT_300_DPI
+        scale = _snap_scale(min(OCR_TARGET_DPI / dpi, MAX_UPSCALE)) if dpi else 1.0
+        if abs(scale - 1.0) > SCALE_TOLERANCE:
+            gray = cv2.resize(
+                gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+            )
+            ratio /= scale
+            glyph_height = glyph_height * scale if glyph_height else None
+            counts["rescaled"] = 1
+
+    # Without enough glyphs there are no text lines to level or box, only noise.
+    has_text = glyph_height is not None
+    angle = _skew_angle(mask) if deskew and has_text else 0.0
+    if abs(angle) >= 0.2:
+        mask = _rotate_mask(mask, angle)
+        counts["deskewed"] = 1
+    else:
+        angle = 0.0
+
+    # The crop box is found on the (rotated) mask, in the coordinates of the deskewed page.
+    height, width = gray.shape
+    x0, y0, x1, y1 = 0, 0, width, height
+    if crop and has_text:
+        box = _text_box(mask, pad=max(int((glyph_height or 20) * ratio), 2))
+        if box is not None:
+            bx0, by0, bx1, by1 = (int(round(v / ratio)) for v in box)
+            bx1, by1 = min(bx1, width), min(by1, height)
+            if (bx1 - bx0) * (by1 - by0) < 0.95 * gray.size:
+                x0, y0, x1, y1 = bx0, by0, bx1, by1
+                counts["cropped"] = 1
+
+    if angle:
+        # One warp yields the deskewed page already cropped, so no pixel outside the box is interpolated.
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        matrix[:, 2] -= (x0, y0)
+        gray = cv2.warpAffine(gray, matrix, (x1 - x0, y1 - y0), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    else:
+        gray = gray[y0:y1, x0:x1]
+
+    if adaptive_threshold and _lighting_is_uneven(gray):
+        # Block size ~ two glyph heights: local enough to follow shadows, wide enough to span a stroke.
+        block = max(int(2 * (glyph_height or 24)) | 1, 15)
+        binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block, 10)
+        counts["adaptive_threshold"] = 1
+    else:
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    with _stats_lock:
+        _stats["pages"] += 1
+        _stats["pixels_in"] += pixels_in
+        _stats["pixels_out"] += binary.size
+        for name, amount in counts.items():
+            _stats[name] += amount
+    return binary
+
+
+def get_preprocessing_stats() -> dict:
+    with _stats_lock:
+        return {
+            **_stats,
+            "pixel_ratio": round(_stats["pixels_out"] / _stats["pixels_in"], 4) if _stats["pixels_in"] else 0.0,
+            "target_dpi": OCR_TARGET_DPI,
+        }
@@ -18,7 +18,7 @@ IMPORTAINT LIBRARY DOWNLOAD
 """**Note:** The `!sudo apt install tesseract-ocr` command installs the Tesseract OCR engine, which `pytesseract` uses. This is necessary for the text extraction part of the code."""
 
 # import pandas as pd
-# import numpy as np
+import numpy as np
 import re
 import json
 # import joblib
@@ -31,12 +31,12 @@ from PIL import Image#, ImageDraw
 # from sklearn.metrics import classification_report, accuracy_score
 # from Crypto.Cipher import AES
 # from Crypto.Random import get_random_bytes
-import google.generativeai as genai
 # import os
 import warnings
 # import glob # For listing files in a directory
 
-from config import GOOGLE_API_KEY, TESSERACT_CMD
+from config import GOOGLE_API_KEY, LLM_PROVIDER, TESSERACT_CMD
+from models import image_preprocessing, ocr_engine, regex_rules
 
 # Suppress specific warnings for cleaner output in a notebook environment
 warnings.filterwarnings('ignore', category=FutureWarning)
@@ -66,8 +66,10 @@ The workflow covers data loading, preprocessing, extraction, and data handling/s
 # else:
     # genai.configure(api_key=GOOGLE_API_KEY)
     # print("Gemini API configured.")
-genai.configure(api_key=GOOGLE_API_KEY)
-print("Gemini API configured.")
+# Gemini is reached through the provider layer in models/llm_providers.py.
+
+# Part of the LLM cache key (see db/llm_cache.py): bump when build_llm_prompt changes
+LLM_PROMPT_VERSION = "1"
 
 
 # Define paths for data and models
@@ -91,6 +93,41 @@ print("Gemini API configured.")
 These functions provide core capabilities for the invoice extraction process, including OCR, image preprocessing, LLM interaction, regex extraction, and file encryption/decryption.
 """
 
+def decode_image_bytes(image_bytes: bytes) -> np.ndarray | None:
+    """
+    Decodes an encoded image (PNG, JPG, ...) held in memory into a grayscale array.
+
+    OCR never needs color, and decoding straight to one channel skips a
+    full-page color conversion, which is costly on 600 dpi photos.
+
+    Args:
+        image_bytes: The raw file contents.
+
+    Returns:
+        The decoded image, or None if the bytes are not a readable image.
+    """
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    return cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+
+def extract_text_from_array(image: np.ndarray) -> str:
+    """
+    Performs OCR on an in-memory image through the OCR worker pool (see models/ocr_engine.py).
+
+    Args:
+        image: Grayscale or BGR image array, e.g. the output of preprocess_image_array.
+
+    Returns:
+        Extracted text as a string. Returns an empty string on error.
+    """
+    try:
+        return ocr_engine.image_to_string(image)
+    except pytesseract.TesseractNotFoundError:
+        print(f"Error: Tesseract OCR engine not found. Please ensure it is installed and in your PATH, or set 'pytesseract.pytesseract.tesseract_cmd'.")
+        return ""
+    except Exception as e:
+        print(f"Error during OCR extraction from in-memory image: {e}")
+        return ""
+
 def extract_text_from_image(image_path: str) -> str:
     """
     Performs OCR on an image file to extract text.
@@ -113,9 +150,22 @@ def extract_text_from_image(image_path: str) -> str:
         print(f"Error during OCR extraction from {image_path}: {e}")
         return ""
 
+def preprocess_image_array(img: np.ndarray, dpi: float | None = None) -> np.ndarray:
+    """
+    Normalizes an in-memory page for OCR: target DPI, deskew, crop to text, then Otsu or adaptive thresholding.
+
+    Args:
+        img: BGR or grayscale image array.
+        dpi: Resolution the page was rendered at, if known (see models/image_preprocessing.py).
+
+    Returns:
+        The binarized image array.
+    """
+    return image_preprocessing.normalize(img, dpi)
+
 def preprocess_image_for_ocr(input_image_path: str, output_image_path: str):
     """
-    Applies image preprocessing steps (grayscale, thresholding) to enhance OCR accuracy.
+    Applies preprocess_image_array to an image file to enhance OCR accuracy.
 
     Args:
         input_image_path: Path to the original input image file.
@@ -127,29 +177,22 @@ def preprocess_image_for_ocr(input_image_path: str, output_image_path: str):
             print(f"Error: Could not read image at {input_image_path}. Skipping preprocessing.")
             return
 
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        # Apply Otsu's thresholding for automatic threshold calculation
-        _, bin_img = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        cv2.imwrite(output_image_path, bin_img)
+        cv2.imwrite(output_image_path, preprocess_image_array(img))
         # print(f"Image preprocessed and saved to {output_image_path}") # Suppress for batch processing
     except Exception as e:
         print(f"Error during image preprocessing of {input_image_path}: {e}")
 
-def extract_fields_with_llm(ocr_text: str) -> dict:
+def build_llm_prompt(ocr_text: str) -> str:
     """
-    Uses a Large Language Model (Gemini) to extract structured fields from OCR text.
+    Builds the Gemini extraction prompt. Bump LLM_PROMPT_VERSION whenever the wording changes.
 
     Args:
         ocr_text: The raw text extracted by OCR.
 
     Returns:
-        A dictionary containing extracted fields, or an error message if LLM call fails.
+        The full prompt string.
     """
-    if GOOGLE_API_KEY == "YOUR_NEW_VALID_API_KEY_HERE" or not GOOGLE_API_KEY or GOOGLE_API_KEY == "dummy_key_for_no_op":
-        print("Skipping LLM extraction: Google API Key is not configured correctly.") # Re-enabled for individual cell execution
-        return {"error": "LLM not configured (API key missing).", "original_text": ocr_text}
-
-    prompt = f"""
+    return f"""
     You are an expert invoice data extractor. Extract the following fields from the invoice text:
     'invoice_number', 'invoice_date' (formatYYYY-MM-DD), 'due_date' (formatYYYY-MM-DD),
     'vendor_name', 'vendor_address', 'gstin', 'total_amount', 'tax_amount', 'currency', 'purchase_order_number',
@@ -190,23 +233,77 @@ def extract_fields_with_llm(ocr_text: str) -> dict:
       ]
     }}
     """
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest') # Updated model name
-        response = model.generate_content(prompt)
 
-        json_string = response.text
-        # Basic cleanup of potential markdown formatting around JSON
-        json_string = json_string.strip()
-        if json_string.startswith("```json"):
-            json_string = json_string[7:]
-        if json_string.endswith("```"):
-            json_string = json_string[:-3]
-        json_string = json_string.strip()
+def build_llm_batch_prompt(ocr_texts: list) -> str:
+    """
+    Builds one prompt that asks for several invoices at once (see models/llm_dispatcher.py).
 
-        return json.loads(json_string)
+    Args:
+        ocr_texts: OCR texts of the invoices, in order.
 
-    except Exception as e:
-        print(f"Error calling Gemini API or parsing response: {e}")
+    Returns:
+        The full prompt string. The answer is expected to be a JSON array with one object per invoice.
+    """
+    invoices = "\n".join(f"### INVOICE {index} ###\n{text}\n" for index, text in enumerate(ocr_texts))
+    return f"""
+    You are an expert invoice data extractor. Below are {len(ocr_texts)} separate invoices, each starting with a
+    line "### INVOICE <index> ###". For every invoice extract the following fields:
+    'invoice_number', 'invoice_date' (formatYYYY-MM-DD), 'due_date' (formatYYYY-MM-DD),
+    'vendor_name', 'vendor_address', 'gstin', 'total_amount', 'tax_amount', 'currency', 'purchase_order_number',
+    'line_items' (as a list of objects, each with 'description', 'quantity', 'unit_price', 'line_total').
+    If a field is not found, use null. For amounts, extract only the numerical value without currency symbols or commas.
+    For dates, use YYYY-MM-DD format. Never mix up data between invoices.
+
+    {invoices}
+    Provide the output strictly as a JSON array with exactly {len(ocr_texts)} objects, one per invoice and in the
+    same order, each with an extra "index" field holding the invoice's index. Example element:
+    {{"index": 0, "invoice_number": "INV-123", "invoice_date": "2024-01-15", "due_date": null, "vendor_name": "ABC Corp",
+      "vendor_address": null, "gstin": null, "total_amount": 1000.50, "tax_amount": 180.00, "currency": "INR",
+      "purchase_order_number": null, "line_items": []}}
+    """
+
+def llm_configured() -> bool:
+    return not (GOOGLE_API_KEY == "YOUR_NEW_VALID_API_KEY_HERE" or not GOOGLE_API_KEY or GOOGLE_API_KEY == "dummy_key_for_no_op")
+
+def parse_llm_json(json_string: str):
+    """
+    Parses the model's answer, tolerating markdown code fences around the JSON.
+
+    Raises:
+        json.JSONDecodeError: If the answer is not valid JSON.
+    """
+    # Basic cleanup of potential markdown formatting around JSON
+    json_string = json_string.strip()
+    if json_string.startswith("```json"):
+        json_string = json_string[7:]
+    if json_string.endswith("```"):
+        json_string = json_string[:-3]
+    json_string = json_string.strip()
+
+    return json.loads(json_string)
+
+def extract_fields_with_llm(ocr_text: str, user_id=None) -> dict:
+    """
+    Uses a Large Language Model (the configured LLM_PROVIDER, Gemini by default) to extract structured fields from OCR text.
+
+    Args:
+        ocr_text: The raw text extracted by OCR.
+        user_id: Owner of the invoice; packed prompts never mix owners.
+
+    Returns:
+        A dictionary containing extracted fields, or an error message if LLM call fails.
+    """
+    if LLM_PROVIDER == "gemini" and not llm_configured():
+        print("Skipping LLM extraction: Google API Key is not configured correctly.") # Re-enabled for individual cell execution
+        return {"error": "LLM not configured (API key missing).", "original_text": ocr_text}
+
+    # Deadline, retries and circuit breaker live in the provider layer. Any
+    # failure comes back as {"error": ...} so the caller falls back to regex.
+    from models.llm_providers import ProviderError, extract_fields
+    try:
+        return extract_fields(ocr_text, user_id=user_id)
+    except ProviderError as e:
+        print(f"Error calling LLM provider or parsing response: {e}")
         return {"error": str(e), "original_text": ocr_text}
 
 
@@ -214,39 +311,22 @@ def extract_fields_with_regex(text: str) -> dict:
     """
     Extracts common invoice fields using regular expressions.
 
+    Runs the rule pack in models/regex_rules.py. Each rule is compiled once; rules
+    with keywords are only tried where a keyword starts a word, found with a
+    substring scan, and the rest use one re.search each. There is no combined
+    pattern and no single pass: a combined alternation was measured and was slower.
+
+    vendor_name no longer runs past the end of its line. It used to swallow the
+    following lines up to the next punctuation ("Acme Ltd\\nInvoice No"), and it
+    now also requires "Vendor Details" to start a word.
+
     Args:
         text: The input text to extract fields from.
 
     Returns:
-        A dictionary containing extracted fields.
+        A dictionary containing extracted fields, keyed "<field>_regex".
     """
-    extracted_data = {}
-
-    # Invoice Number: Flexible for "Invoice No:", "INV-", "Invoice #", etc.
-    invoice_number_match = re.search(r'(?:Invoice No|Invoice|Inv|Bill No|Receipt #|Ref|Bill Ref)\s*[:#]*\s*([a-zA-Z0-9\-/]+)', text, re.IGNORECASE)
-    extracted_data['invoice_number_regex'] = invoice_number_match.group(1).strip() if invoice_number_match else None
-
-    # Date: YYYY-MM-DD, DD/MM/YYYY, DD-MM-YYYY
-    date_match = re.search(r'\d{4}-\d{2}-\d{2}|\d{2}[-/]\d{2}[-/]\d{4}', text)
-    extracted_data['date_regex'] = date_match.group(0) if date_match else None
-
-    # Total Amount: Robust for different currency symbols and comma separators
-    total_match = re.search(r'(?:Total|Amount Due|Sum)\s*[:\s]*[₹$€£]?\s*([\d,\.]+)', text, re.IGNORECASE)
-    if total_match:
-        total_str = total_match.group(1).replace(",", "")
-        try:
-            extracted_data['total_amount_regex'] = float(total_str)
-        except ValueError:
-            extracted_data['total_amount_regex'] = None
-    else:
-        extracted_data['total_amount_regex'] = None
-
-    # Vendor Name (simple heuristic, might need improvement for real data)
-    # This is a very basic regex and might not capture complex vendor names well.
-    vendor_name_match = re.search(r'(?:Vendor Details\s*Name:)\s*([a-zA-Z\s\.]+)', text, re.IGNORECASE)
-    extracted_data['vendor_name_regex'] = vendor_name_match.group(1).strip() if vendor_name_match else None
-
-    return extracted_data
+    return {f"{name}_regex": value for name, value in regex_rules.default_engine.extract(text).items()}
 
 # def encrypt_data_file(input_path: str, output_path: str, key: bytes):
 #     """Encrypts a file using AES in EAX mode."""
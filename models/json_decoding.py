@@ -0,0 +1,147 @@
+"""Keeps the local model's output to a single invoice JSON object.
+
+Two layers, both applied inside generate():
+
+- A prefix_allowed_tokens_fn from lm-format-enforcer masks every token
+  that would take the output outside INVOICE_JSON_SCHEMA, so the output
+  always parses. It is required while LOCAL_LLM_CONSTRAINED_DECODING is on.
+- JsonObjectClosed, a StoppingCriteria, ends each sequence as soon as its
+  top-level object closes, instead of running on to max_new_tokens.
+
+json_object_span() applies the same brace tracking after decoding, so any
+preamble or trailing text around the object is dropped before json.loads.
+"""
+from typing import Optional
+
+_NULLABLE_STRING = {"type": ["string", "null"]}
+_NULLABLE_NUMBER = {"type": ["number", "null"]}
+
+INVOICE_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "invoice_number": _NULLABLE_STRING,
+        "invoice_date": _NULLABLE_STRING,
+        "due_date": _NULLABLE_STRING,
+        "vendor_name": _NULLABLE_STRING,
+        "vendor_address": _NULLABLE_STRING,
+        "gstin": _NULLABLE_STRING,
+        "total_amount": _NULLABLE_NUMBER,
+        "tax_amount": _NULLABLE_NUMBER,
+        "currency": _NULLABLE_STRING,
+        "purchase_order_number": _NULLABLE_STRING,
+        "line_items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "description": _NULLABLE_STRING,
+                    "quantity": _NULLABLE_NUMBER,
+                    "unit_price": _NULLABLE_NUMBER,
+                    "line_total": _NULLABLE_NUMBER,
+                },
+            },
+        },
+    },
+    "required": [
+        "invoice_number", "invoice_date", "due_date", "vendor_name", "vendor_address", "gstin",
+        "total_amount", "tax_amount", "currency", "purchase_order_number", "line_items",
+    ],
+}
+
+
+class JsonObjectScanner:
+    """Incrementally tracks braces outside strings; ``end`` is set once the first top-level object closes."""
+
+    def __init__(self):
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._offset = 0
+
+    def feed(self, text: str):
+        for i, ch in enumerate(text, self._offset):
+            if self.end is not None:
+                break
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"' and self._depth:
+                self._in_string = True
+            elif ch == "{":
+                if self.start is None:
+                    self.start = i
+                self._depth += 1
+            elif ch == "}" and self._depth:
+                self._depth -= 1
+                if not self._depth:
+                    self.end = i + 1
+        self._offset += len(text)
+
+
+def json_object_span(text: str) -> Optional[str]:
+    """The first complete top-level JSON object in ``text``, or None."""
+    scanner = JsonObjectScanner()
+    scanner.feed(text)
+    return text[scanner.start:scanner.end] if scanner.end is not None else None
+
+
+def stopping_criteria(tokenizer, prompt_length: int, batch_size: int):
+    """A StoppingCriteriaList that finishes each row once its JSON object has closed."""
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class JsonObjectClosed(StoppingCriteria):
+        def __init__(self):
+            self.scanners = [JsonObjectScanner() for _ in range(batch_size)]
+            self._seen = prompt_length
+
+        def __call__(self, input_ids, scores, **kwargs):
+            new_tokens = input_ids[:, self._seen:].tolist()
+            self._seen = input_ids.shape[1]
+            for scanner, tokens in zip(self.scanners, new_tokens):
+                if scanner.end is None:
+                    scanner.feed(tokenizer.decode(tokens, skip_special_tokens=True))
+            return torch.tensor([scanner.end is not None for scanner in self.scanners], device=input_ids.device)
+
+    return StoppingCriteriaList([JsonObjectClosed()])
+
+
+_enforcer_tokenizer_data = None
+
+
+def prepare_enforcer(tokenizer):
+    """
+    Builds the vocabulary index the schema filter needs; called when the model loads.
+
+    Raises:
+        RuntimeError: If lm-format-enforcer isn't installed. Without it decoding
+            would silently run unconstrained, so this fails at load time instead;
+            set LOCAL_LLM_CONSTRAINED_DECODING=false to run without the filter.
+    """
+    global _enforcer_tokenizer_data
+    try:
+        from lmformatenforcer.integrations.transformers import build_token_enforcer_tokenizer_data
+    except ImportError:
+        raise RuntimeError(
+            "LOCAL_LLM_CONSTRAINED_DECODING needs lm-format-enforcer (pip install -r requirements.txt), "
+            "or set LOCAL_LLM_CONSTRAINED_DECODING=false."
+        )
+    if _enforcer_tokenizer_data is None:
+        # Walks the whole vocabulary; done once per process.
+        _enforcer_tokenizer_data = build_token_enforcer_tokenizer_data(tokenizer)
+
+
+def prefix_allowed_tokens_fn(tokenizer):
+    """Schema-constrained token filter for generate()."""
+    from lmformatenforcer import JsonSchemaParser
+    from lmformatenforcer.integrations.transformers import build_transformers_prefix_allowed_tokens_fn
+
+    prepare_enforcer(tokenizer)
+    # The parser is stateful, so each generate() call gets a fresh one.
+    return build_transformers_prefix_allowed_tokens_fn(_enforcer_tokenizer_data, JsonSchemaParser(INVOICE_JSON_SCHEMA))
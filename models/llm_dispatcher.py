@@ -0,0 +1,245 @@
+"""Asyncio dispatcher for Gemini field extraction.
+
+Many invoices are extracted concurrently under a requests-per-minute and a
+tokens-per-minute budget shared by every caller in the process. Short
+invoices that arrive within LLM_PACK_WINDOW_MS of each other can be packed
+into one prompt that asks for a JSON array, then demultiplexed back to their
+callers. Gemini is called over its REST API (GeminiRestClient in
+models/llm_providers.py), so GEMINI_API_BASE_URL can point
+at benchmarks/fake_gemini_server.py to exercise latency and 429 handling.
+
+Worker threads reach the dispatcher through dispatch(), which runs it on a
+single background event loop. Blocked threads therefore share one budget
+instead of each parking on its own generate_content call.
+"""
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+
+from config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_PACK_MAX_CHARS,
+    LLM_PACK_MAX_ITEMS,
+    LLM_PACK_WINDOW_MS,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+)
+from models.invoice_extraction_model import build_llm_batch_prompt, build_llm_prompt, parse_llm_json
+from models.llm_providers import GeminiRestClient, ProviderError, ProviderTimeout, RateLimitedError
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for Latin text; good enough for budgeting.
+    return len(text) // 4 + 1
+
+
+def _as_index(value) -> Optional[int]:
+    """A pack answer's "index" field as an int; models sometimes write it as a string."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously. Waiters are served in arrival order."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self._tokens = float(per_minute)
+        self._rate = per_minute / 60.0
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self._rate)
+                self._updated_at = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self._rate)
+
+
+class LlmDispatcher:
+    def __init__(
+        self,
+        client: GeminiRestClient,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+        max_retries: int = LLM_MAX_RETRIES,
+        pack_max_items: int = LLM_PACK_MAX_ITEMS,
+        pack_max_chars: int = LLM_PACK_MAX_CHARS,
+        pack_window_ms: int = LLM_PACK_WINDOW_MS,
+    ):
+        self.client = client
+        self.max_retries = max_retries
+        self.pack_max_items = pack_max_items
+        self.pack_max_chars = pack_max_chars
+        self.pack_window = pack_window_ms / 1000
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._request_budget = TokenBucket(requests_per_minute)
+        self._token_budget = TokenBucket(tokens_per_minute)
+        # Open packs by owner: one prompt never mixes different users' invoices.
+        self._pending: dict = {}
+        self._pending_chars: dict = {}
+        self._flush_handles: dict = {}
+        self.stats = {
+            "invoices": 0,
+            "calls": 0,
+            "packed_calls": 0,
+            "packed_invoices": 0,
+            "unpack_failures": 0,
+            "rate_limited": 0,
+            "retries": 0,
+            "failures": 0,
+        }
+
+    async def extract(self, ocr_text: str, user_id=None) -> dict:
+        """
+        Extracts fields for one invoice. Never raises: failures come back as {"error": ...}.
+
+        Only invoices with the same ``user_id`` are packed into one prompt.
+        """
+        self.stats["invoices"] += 1
+        if self.pack_max_items <= 1 or len(ocr_text) > self.pack_max_chars:
+            return await self._extract_single(ocr_text)
+
+        key = str(user_id) if user_id is not None else None
+        future = asyncio.get_running_loop().create_future()
+        if key in self._pending and self._pending_chars[key] + len(ocr_text) > self.pack_max_chars:
+            self._flush(key)
+        self._pending.setdefault(key, []).append((ocr_text, future))
+        self._pending_chars[key] = self._pending_chars.get(key, 0) + len(ocr_text)
+        if len(self._pending[key]) >= self.pack_max_items:
+            self._flush(key)
+        elif key not in self._flush_handles:
+            self._flush_handles[key] = asyncio.get_running_loop().call_later(self.pack_window, self._flush, key)
+        return await future
+
+    async def extract_many(self, ocr_texts: list, user_id=None) -> list:
+        return await asyncio.gather(*(self.extract(text, user_id) for text in ocr_texts))
+
+    def _flush(self, key):
+        handle = self._flush_handles.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        group = self._pending.pop(key, [])
+        self._pending_chars.pop(key, None)
+        if group:
+            asyncio.ensure_future(self._run_pack(group))
+
+    async def _run_pack(self, group: list):
+        if len(group) == 1:
+            text, future = group[0]
+            result = await self._extract_single(text)
+            if not future.done():
+                future.set_result(result)
+            return
+
+        texts = [text for text, _ in group]
+        results = None
+        try:
+            answer = parse_llm_json(await self._call(build_llm_batch_prompt(texts)))
+            by_index = {}
+            if isinstance(answer, list):
+                by_index = {item.get("index"): item for item in answer if isinstance(item, dict)}
+            if len(by_index) == len(texts) and set(map(_as_index, by_index)) == set(range(len(texts))):
+                by_index = {_as_index(index): item for index, item in by_index.items()}
+                results = [{k: v for k, v in by_index[i].items() if k != "index"} for i in range(len(texts))]
+                self.stats["packed_calls"] += 1
+                self.stats["packed_invoices"] += len(texts)
+        except Exception as e:
+            print(f"Packed LLM request failed, retrying invoices one by one: {e}")
+
+        if results is None:
+            # The model lost track of the invoices; don't guess, ask again individually.
+            self.stats["unpack_failures"] += 1
+            results = await asyncio.gather(*(self._extract_single(text) for text in texts))
+
+        for (_, future), result in zip(group, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _extract_single(self, ocr_text: str) -> dict:
+        try:
+            return parse_llm_json(await self._call(build_llm_prompt(ocr_text)))
+        except Exception as e:
+            print(f"Error calling Gemini API or parsing response: {e}")
+            return {"error": str(e), "original_text": ocr_text}
+
+    async def _call(self, prompt: str) -> str:
+        attempt = 0
+        while True:
+            await self._request_budget.acquire(1)
+            await self._token_budget.acquire(estimate_tokens(prompt))
+            async with self._semaphore:
+                self.stats["calls"] += 1
+                try:
+                    return await self.client.agenerate(prompt)
+                except RateLimitedError as e:
+                    self.stats["rate_limited"] += 1
+                    error, delay = e, e.retry_after
+                except ProviderError as e:
+                    if not e.retryable:
+                        self.stats["failures"] += 1
+                        raise
+                    error, delay = e, None
+
+            if attempt >= self.max_retries:
+                self.stats["failures"] += 1
+                raise error
+            # Full jitter keeps many callers that were throttled together from retrying in lockstep.
+            delay = delay if delay is not None else random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+            self.stats["retries"] += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_dispatcher: Optional[LlmDispatcher] = None
+_start_lock = threading.Lock()
+
+
+def _get_dispatcher() -> tuple:
+    global _loop, _dispatcher
+    with _start_lock:
+        if _dispatcher is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-dispatcher", daemon=True).start()
+
+            async def create():
+                return LlmDispatcher(GeminiRestClient())
+
+            _dispatcher = asyncio.run_coroutine_threadsafe(create(), loop).result()
+            _loop = loop
+        return _loop, _dispatcher
+
+
+def dispatch(ocr_text: str, timeout: Optional[float] = None, user_id=None) -> dict:
+    """
+    Blocking entry point for worker threads; runs the extraction on the shared dispatcher loop.
+
+    Raises:
+        ProviderTimeout: If no answer arrives within ``timeout`` seconds. The
+            extraction is cancelled; a pack it joined still completes for the others.
+    """
+    loop, dispatcher = _get_dispatcher()
+    future = asyncio.run_coroutine_threadsafe(dispatcher.extract(ocr_text, user_id), loop)
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise ProviderTimeout(f"LLM dispatcher did not answer within {timeout:.1f}s.")
+
+
+def get_dispatcher_stats() -> dict:
+    return dict(_dispatcher.stats) if _dispatcher is not None else {}
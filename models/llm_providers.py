@@ -0,0 +1,342 @@
+"""Pluggable LLM backends for invoice field extraction.
+
+LLM_PROVIDER picks the backend:
+
+    gemini  Gemini over its REST API with pooled, reused HTTP clients
+    local   the SmolLM model in models/extract_entities.py
+    stub    deterministic answers derived from the regex extractor (tests, load runs)
+
+extract_fields() wraps whichever provider is active with a per-extraction
+deadline, jittered retries for transient failures and a circuit breaker.
+When the breaker is open, calls fail immediately, and the caller falls back
+to extract_fields_with_regex instead of tying up a worker.
+"""
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+
+import httpx
+
+from config import (
+    GEMINI_API_BASE_URL,
+    GEMINI_MODEL_NAME,
+    GOOGLE_API_KEY,
+    LLM_BREAKER_FAILURE_THRESHOLD,
+    LLM_BREAKER_RESET_SECONDS,
+    LLM_DEADLINE_SECONDS,
+    LLM_DISPATCHER_ENABLED,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_PROVIDER,
+    LLM_REQUEST_TIMEOUT_SECONDS,
+)
+
+
+class ProviderError(Exception):
+    """A provider call failed. ``retryable`` errors are transient; ``degraded`` ones count against the breaker."""
+
+    retryable = False
+    degraded = True
+
+
+class RateLimitedError(ProviderError):
+    retryable = True
+
+    def __init__(self, retry_after: Optional[float] = None):
+        super().__init__("Rate limited by the LLM provider (HTTP 429).")
+        self.retry_after = retry_after
+
+
+class LlmHttpError(ProviderError):
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"LLM provider returned HTTP {status_code}: {body[:200]}")
+        self.status_code = status_code
+        self.retryable = status_code >= 500
+
+
+class ProviderTimeout(ProviderError):
+    retryable = True
+
+
+class InvalidResponseError(ProviderError):
+    """The provider answered, but not with usable JSON. Not a sign of degradation."""
+
+    degraded = False
+
+
+class CircuitOpenError(ProviderError):
+    degraded = False
+
+
+class GeminiRestClient:
+    """generateContent over REST. One pooled sync client and one pooled async client, reused for every call."""
+
+    def __init__(
+        self,
+        base_url: str = GEMINI_API_BASE_URL,
+        api_key: str = GOOGLE_API_KEY,
+        model_name: str = GEMINI_MODEL_NAME,
+        timeout: float = LLM_REQUEST_TIMEOUT_SECONDS,
+        max_connections: int = LLM_MAX_CONCURRENCY,
+    ):
+        self.model_name = model_name
+        self._api_key = api_key
+        self._base_url = base_url
+        self._timeout = timeout
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client = httpx.Client(base_url=base_url, timeout=timeout, limits=self._limits)
+        self._async_client: Optional[httpx.AsyncClient] = None
+
+    def _request(self, prompt: str) -> dict:
+        return {
+            "url": f"/v1beta/models/{self.model_name}:generateContent",
+            "params": {"key": self._api_key},
+            "json": {"contents": [{"parts": [{"text": prompt}]}]},
+        }
+
+    @staticmethod
+    def _parse(response: httpx.Response) -> str:
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            raise RateLimitedError(float(retry_after) if retry_after else None)
+        if response.status_code >= 400:
+            raise LlmHttpError(response.status_code, response.text)
+
+        try:
+            body = response.json()
+        except ValueError:
+            raise InvalidResponseError("LLM response is not JSON.")
+        candidates = (body.get("candidates") if isinstance(body, dict) else None) or []
+        if not candidates:
+            raise InvalidResponseError("LLM response has no candidates.")
+        # A candidate blocked by a safety filter comes back without content.
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        if not parts:
+            raise InvalidResponseError(f"LLM response has no content (finishReason {candidates[0].get('finishReason')}).")
+        return "".join(part.get("text", "") for part in parts)
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        try:
+            response = self._client.post(**self._request(prompt), timeout=timeout or self._timeout)
+        except httpx.TimeoutException as e:
+            raise ProviderTimeout(f"LLM request timed out: {e}")
+        except httpx.TransportError as e:
+            raise LlmHttpError(503, str(e))
+        return self._parse(response)
+
+    async def agenerate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(base_url=self._base_url, timeout=self._timeout, limits=self._limits)
+        try:
+            response = await self._async_client.post(**self._request(prompt), timeout=timeout or self._timeout)
+        except httpx.TimeoutException as e:
+            raise ProviderTimeout(f"LLM request timed out: {e}")
+        except httpx.TransportError as e:
+            raise LlmHttpError(503, str(e))
+        return self._parse(response)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+
+
+class LlmProvider(ABC):
+    name = "base"
+    model_name = "base"
+
+    @abstractmethod
+    def extract(self, ocr_text: str, timeout: float, user_id=None) -> dict:
+        """Returns the extracted fields, or raises ProviderError. ``user_id`` owns the invoice."""
+
+
+class GeminiProvider(LlmProvider):
+    name = "gemini"
+
+    def __init__(self):
+        self.client = GeminiRestClient()
+        self.model_name = self.client.model_name
+
+    def extract(self, ocr_text: str, timeout: float, user_id=None) -> dict:
+        from models.invoice_extraction_model import build_llm_prompt, parse_llm_json
+
+        if LLM_DISPATCHER_ENABLED:
+            # The dispatcher does its own throttling and retries; only report the outcome.
+            from models import llm_dispatcher
+            result = llm_dispatcher.dispatch(ocr_text, timeout=timeout, user_id=user_id)
+            if "error" in result:
+                raise ProviderError(result["error"])
+            return result
+
+        answer = self.client.generate(build_llm_prompt(ocr_text), timeout=timeout)
+        try:
+            return parse_llm_json(answer)
+        except ValueError as e:
+            raise InvalidResponseError(f"LLM answer is not valid JSON: {e}")
+
+
+class LocalModelProvider(LlmProvider):
+    name = "local"
+    model_name = "local-smollm"
+
+    def extract(self, ocr_text: str, timeout: float, user_id=None) -> dict:
+        from models.extract_entities import submit_entities
+
+        # generate() can't be interrupted, so deadlines are enforced by abandoning the future;
+        # the batch it belongs to still completes for the other callers.
+        try:
+            return submit_entities(ocr_text).result(timeout=timeout)
+        except FutureTimeoutError:
+            raise ProviderTimeout(f"Local model did not answer within {timeout:.1f}s.")
+        except ConnectionError as e:
+            error = ProviderError(str(e))
+            error.retryable = True
+            raise error
+        except ValueError as e:
+            raise InvalidResponseError(str(e))
+
+
+class StubProvider(LlmProvider):
+    name = "stub"
+    model_name = "stub"
+
+    def extract(self, ocr_text: str, timeout: float, user_id=None) -> dict:
+        from models.invoice_extraction_model import extract_fields_with_regex
+
+        fields = extract_fields_with_regex(ocr_text)
+        return {key.removesuffix("_regex"): value for key, value in fields.items()}
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker.
+
+    closed: calls pass. After ``failure_threshold`` degraded failures in a row
+    it opens and rejects calls for ``reset_seconds``, then lets a single trial
+    call through (half-open). Success closes it; failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+PROVIDERS = {
+    "gemini": GeminiProvider,
+    "local": LocalModelProvider,
+    "stub": StubProvider,
+}
+
+_provider: Optional[LlmProvider] = None
+_provider_lock = threading.Lock()
+breaker = CircuitBreaker()
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "rejected_by_breaker": 0}
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_llm_provider() -> LlmProvider:
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            if LLM_PROVIDER not in PROVIDERS:
+                raise ValueError(f"Unknown LLM_PROVIDER '{LLM_PROVIDER}', expected one of {sorted(PROVIDERS)}")
+            _provider = PROVIDERS[LLM_PROVIDER]()
+        return _provider
+
+
+def extract_fields(
+    ocr_text: str,
+    deadline_seconds: float = LLM_DEADLINE_SECONDS,
+    max_retries: int = LLM_MAX_RETRIES,
+    user_id=None,
+) -> dict:
+    """
+    Extracts fields with the configured provider. ``user_id`` keeps packed prompts per user.
+
+    Raises:
+        ProviderError: On failure, after retries, or immediately while the circuit breaker is open.
+    """
+    provider = get_llm_provider()
+    deadline = time.monotonic() + deadline_seconds
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            _count("rejected_by_breaker")
+            raise CircuitOpenError(f"LLM provider '{provider.name}' is degraded (circuit open).")
+
+        remaining = deadline - time.monotonic()
+        _count("calls")
+        try:
+            if remaining <= 0:
+                raise ProviderTimeout(f"LLM deadline of {deadline_seconds:.0f}s exceeded.")
+            result = provider.extract(ocr_text, timeout=min(remaining, LLM_REQUEST_TIMEOUT_SECONDS), user_id=user_id)
+        except ProviderError as e:
+            if e.degraded:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            delay = getattr(e, "retry_after", None) or random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+            if not e.retryable or attempt >= max_retries or time.monotonic() + delay >= deadline:
+                _count("failures")
+                raise
+            _count("retries")
+            attempt += 1
+            time.sleep(delay)
+            continue
+        except Exception as e:
+            # Anything else is a provider bug or an unexpected answer. It still has to
+            # settle the breaker (or a half-open trial would stay in flight forever)
+            # and reach the caller as a ProviderError, which falls back to regex.
+            breaker.record_failure()
+            _count("failures")
+            raise ProviderError(f"LLM provider '{provider.name}' failed: {e!r}") from e
+
+        breaker.record_success()
+        _count("successes")
+        return result
+
+
+def get_llm_provider_stats() -> dict:
+    with _stats_lock:
+        return {
+            "provider": LLM_PROVIDER,
+            "breaker_state": breaker.state,
+            **_stats,
+        }
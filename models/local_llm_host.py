@@ -0,0 +1,187 @@
+"""Shared model-host process for the local SmolLM extractor.
+
+One host process loads the model (models/extract_entities.py) and serves
+every gunicorn worker over a multiprocessing.connection socket. Requests
+from all workers feed the host's single DynamicBatcher, so concurrent
+uploads across workers share batches and only one copy of the weights is
+resident.
+
+multiprocessing.connection exchanges pickles, so whoever can talk to the
+socket can run code in the host. Host and clients therefore refuse to start
+without an explicit LOCAL_LLM_HOST_AUTHKEY, and the address must be a unix
+socket path or a loopback host:port. Run the host next to the API and point
+the workers at it:
+
+    LOCAL_LLM_HOST_ADDRESS=/run/invoices/llm.sock LOCAL_LLM_HOST_AUTHKEY=... python -m models.local_llm_host
+
+Messages are tuples. Requests are ("extract", request_id, text) and
+("stats", request_id). Replies are (request_id, ok, payload), where the
+payload is the result, or the error message when ok is False.
+"""
+import ipaddress
+import itertools
+import threading
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Optional
+
+from config import LOCAL_LLM_HOST_ADDRESS, LOCAL_LLM_HOST_AUTHKEY
+
+
+MIN_AUTHKEY_LENGTH = 16
+
+
+def _parse_address(address: str):
+    """A unix socket path, or a (host, port) pair on the loopback interface."""
+    if address.startswith("/"):
+        return address
+    host, _, port = address.rpartition(":")
+    host = host or "127.0.0.1"
+    if host != "localhost" and not ipaddress.ip_address(host.strip("[]")).is_loopback:
+        raise RuntimeError(f"LOCAL_LLM_HOST_ADDRESS must be a unix socket path or a loopback address, not {address}.")
+    return host, int(port)
+
+
+def _authkey(authkey: str) -> bytes:
+    if len(authkey) < MIN_AUTHKEY_LENGTH:
+        raise RuntimeError(
+            f"The local LLM host needs LOCAL_LLM_HOST_AUTHKEY set to a secret of at least {MIN_AUTHKEY_LENGTH} characters."
+        )
+    return authkey.encode()
+
+
+def _serve_connection(conn: Connection, batcher, stats, send_lock: threading.Lock):
+    def reply(request_id: int, future: Future):
+        try:
+            message = (request_id, True, future.result())
+        except Exception as e:
+            message = (request_id, False, str(e))
+        with send_lock:
+            try:
+                conn.send(message)
+            except OSError:
+                pass  # Worker went away; its request is simply dropped.
+
+    try:
+        while True:
+            kind, request_id, *args = conn.recv()
+            if kind == "extract":
+                batcher.submit(args[0]).add_done_callback(lambda future, request_id=request_id: reply(request_id, future))
+            elif kind == "stats":
+                with send_lock:
+                    conn.send((request_id, True, stats()))
+    except (EOFError, OSError):
+        conn.close()
+
+
+def serve(address: str = LOCAL_LLM_HOST_ADDRESS, authkey: str = LOCAL_LLM_HOST_AUTHKEY):
+    from models.extract_entities import get_batcher, load_model, local_stats
+
+    # Checked before the slow model load.
+    listen_address, key = _parse_address(address), _authkey(authkey)
+    load_model()
+    batcher = get_batcher()
+    with Listener(listen_address, authkey=key) as listener:
+        print(f"Local LLM host listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # A failed handshake (wrong authkey) must not stop the host.
+                print(f"Local LLM host rejected a connection: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, batcher, local_stats, threading.Lock()), daemon=True).start()
+
+
+class HostClient:
+    """
+    One connection per worker process, shared by all its threads.
+
+    Requests are tagged with an id and answered out of order by a reader thread,
+    so threads waiting on the same host don't serialize on the socket.
+    """
+
+    def __init__(self, address: str = LOCAL_LLM_HOST_ADDRESS, authkey: str = LOCAL_LLM_HOST_AUTHKEY):
+        self.address = address
+        self._address = _parse_address(address)
+        self.authkey = _authkey(authkey)
+        self._conn: Optional[Connection] = None
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _connect(self) -> Connection:
+        if self._conn is None:
+            try:
+                self._conn = Client(self._address, authkey=self.authkey)
+            except (OSError, AuthenticationError) as e:
+                raise ConnectionError(f"Local LLM host at {self.address} is unreachable: {e}")
+            threading.Thread(target=self._read, args=(self._conn,), name="local-llm-client", daemon=True).start()
+        return self._conn
+
+    def _read(self, conn: Connection):
+        try:
+            while True:
+                request_id, ok, payload = conn.recv()
+                with self._lock:
+                    future = self._pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if ok:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(ValueError(payload))
+        except (EOFError, OSError):
+            with self._lock:
+                if self._conn is conn:
+                    self._conn = None
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(ConnectionError(f"Lost connection to the local LLM host at {self.address}."))
+
+    def _request(self, kind: str, *args) -> Future:
+        future = Future()
+        with self._lock:
+            conn = self._connect()
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            try:
+                conn.send((kind, request_id, *args))
+            except OSError as e:
+                self._pending.pop(request_id, None)
+                self._conn = None
+                raise ConnectionError(f"Lost connection to the local LLM host at {self.address}: {e}")
+        return future
+
+    def submit(self, invoice_text: str) -> Future:
+        return self._request("extract", invoice_text)
+
+    def stats(self) -> dict:
+        return self._request("stats").result(timeout=5)
+
+
+_client: Optional[HostClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HostClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HostClient()
+        return _client
+
+
+def get_client_stats() -> dict:
+    """Host batch stats, once this worker has talked to the host; never raises."""
+    if _client is None:
+        return {}
+    try:
+        return _client.stats()
+    except Exception as e:
+        return {"error": str(e)}
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,256 @@
+"""OCR engine backed by a fixed pool of long-lived worker processes.
+
+Each worker loads Tesseract once through tesserocr (a binding to the
+Tesseract C API) and keeps the traineddata in memory for every job it
+serves. Images go to the workers as numpy arrays, so there is no per-call
+``tesseract`` fork and no temp file. When tesserocr is not installed, or
+OCR_ENGINE=pytesseract, calls go through the previous pytesseract path.
+
+This module is also imported by the spawned workers, so it must stay light:
+no model, database or LLM imports at module level.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from multiprocessing.pool import Pool
+from typing import Optional
+
+import numpy as np
+
+from config import (
+    OCR_ENGINE,
+    OCR_JOB_TIMEOUT_SECONDS,
+    OCR_LANG,
+    OCR_POOL_SIZE,
+    OCR_TESSDATA_PATH,
+    TESSERACT_CMD,
+)
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+_worker_api = None
+
+
+def _init_worker(lang: str, tessdata_path: str):
+    global _worker_api
+    if tessdata_path:
+        _worker_api = tesserocr.PyTessBaseAPI(path=tessdata_path, lang=lang)
+    else:
+        _worker_api = tesserocr.PyTessBaseAPI(lang=lang)
+
+
+def _ocr_in_worker(image: np.ndarray) -> str:
+    from PIL import Image
+
+    _worker_api.SetImage(Image.fromarray(image))
+    return _worker_api.GetUTF8Text()
+
+
+def _pytesseract_image_to_string(image: np.ndarray, lang: str) -> str:
+    import pytesseract
+
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    return pytesseract.image_to_string(image, lang=lang)
+
+
+class PoolRestarted(Exception):
+    """The pool was torn down while the job was queued or running; the job itself didn't fail."""
+
+
+class OcrJob:
+    def __init__(self, image: np.ndarray, pool: Optional[Pool] = None, pool_future: Optional[Future] = None, future: Optional[Future] = None):
+        self.image = image
+        self.pool = pool
+        # Settled by the pool's result callbacks, or failed with PoolRestarted.
+        self.pool_future = pool_future
+        self.future = future
+
+
+def _settle(future: Future, result=None, error: Optional[BaseException] = None):
+    # A restart may already have failed the future.
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class OcrPool:
+    """
+    Fixed-size pool of OCR worker processes.
+
+    A job that exceeds its timeout usually means a wedged or dead worker
+    (multiprocessing replaces dead workers but never completes their job),
+    so the pool is torn down and rebuilt before the error is raised. The
+    other unfinished jobs of the old pool are resubmitted to the new one at
+    once, rather than each waiting out its own timeout on a pool that no
+    longer exists. A job lost to a second restart fails with PoolRestarted.
+    """
+
+    def __init__(self, size: int = OCR_POOL_SIZE, lang: str = OCR_LANG, timeout: float = OCR_JOB_TIMEOUT_SECONDS):
+        self.size = size
+        self.lang = lang
+        self.timeout = timeout
+        self._pool: Optional[Pool] = None
+        # pool -> {future of an unfinished job: (image, times resubmitted)}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.stats = {"jobs": 0, "timeouts": 0, "errors": 0, "restarts": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _get_pool(self) -> Pool:
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: gunicorn/uvicorn workers are multi-threaded.
+                context = multiprocessing.get_context("spawn")
+                self._pool = context.Pool(self.size, initializer=_init_worker, initargs=(self.lang, OCR_TESSDATA_PATH))
+            return self._pool
+
+    def _restart(self, pool: Pool, culprit: Optional[Future] = None):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                self.stats["restarts"] += 1
+            pending = self._pending.pop(pool, {})
+        pool.terminate()
+        for future, (image, resubmitted) in pending.items():
+            if future is culprit or future.done():
+                continue
+            if resubmitted:
+                _settle(future, error=PoolRestarted("OCR pool restarted twice while the job was in flight"))
+                continue
+            try:
+                self._enqueue(image, future, resubmitted + 1)
+            except Exception as e:
+                _settle(future, error=e)
+
+    def _owner(self, job: OcrJob) -> Pool:
+        """The pool the job currently runs in; resubmission after a restart moves it."""
+        with self._lock:
+            for pool, pending in self._pending.items():
+                if job.pool_future in pending:
+                    return pool
+        return job.pool
+
+    def _finish(self, pool: Pool, future: Future, result=None, error: Optional[BaseException] = None):
+        with self._lock:
+            self._pending.get(pool, {}).pop(future, None)
+        _settle(future, result, error)
+
+    def _enqueue(self, image: np.ndarray, future: Future, resubmitted: int = 0) -> Pool:
+        pool = self._get_pool()
+        with self._lock:
+            self._pending.setdefault(pool, {})[future] = (image, resubmitted)
+        pool.apply_async(
+            _ocr_in_worker,
+            (image,),
+            callback=lambda text: self._finish(pool, future, result=text),
+            error_callback=lambda e: self._finish(pool, future, error=e),
+        )
+        return pool
+
+    def submit(self, image: np.ndarray) -> OcrJob:
+        self._count("jobs")
+        future = Future()
+        pool = self._enqueue(image, future)
+        return OcrJob(image, pool, pool_future=future)
+
+    def result(self, job: OcrJob, timeout: Optional[float] = None) -> str:
+        try:
+            return job.pool_future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            self._count("timeouts")
+            self._restart(self._owner(job), culprit=job.pool_future)
+            raise TimeoutError(f"OCR job exceeded {self.timeout}s")
+        except Exception:
+            self._count("errors")
+            raise
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+_pool: Optional[OcrPool] = None
+_pool_lock = threading.Lock()
+_fallbacks = 0
+
+# pytesseract spends its time in the tesseract subprocess, so threads are
+# enough to keep OCR_POOL_SIZE images in flight on the fallback path too.
+_fallback_executor = ThreadPoolExecutor(max_workers=OCR_POOL_SIZE, thread_name_prefix="ocr-fallback")
+
+
+_pool_usable: Optional[bool] = None
+
+
+def pool_enabled() -> bool:
+    global _pool_usable
+    if _pool_usable is None:
+        _pool_usable = False
+        if OCR_ENGINE == "tesserocr" and tesserocr is not None:
+            # Check the traineddata up front: a worker whose initializer fails is
+            # respawned forever by multiprocessing and its jobs never complete.
+            args = (OCR_TESSDATA_PATH,) if OCR_TESSDATA_PATH else ()
+            path, languages = tesserocr.get_languages(*args)
+            _pool_usable = all(lang in languages for lang in OCR_LANG.split("+"))
+            if not _pool_usable:
+                print(f"OCR pool disabled: language '{OCR_LANG}' not found in {path}, using pytesseract.")
+    return _pool_usable
+
+
+def get_ocr_pool() -> OcrPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OcrPool()
+        return _pool
+
+
+def submit(image: np.ndarray) -> OcrJob:
+    """Starts OCR of ``image`` without waiting, so callers can keep several images in flight."""
+    if pool_enabled():
+        try:
+            return get_ocr_pool().submit(image)
+        except Exception as e:
+            print(f"OCR pool unavailable ({e}), falling back to pytesseract.")
+    return OcrJob(image, future=_fallback_executor.submit(_pytesseract_image_to_string, image, OCR_LANG))
+
+
+def collect(job: OcrJob) -> str:
+    """Waits for a job from submit(). Crashed, failed or timed-out pool jobs are retried with pytesseract."""
+    global _fallbacks
+    if job.future is not None:
+        return job.future.result()
+    if job.pool is not None:
+        try:
+            return get_ocr_pool().result(job)
+        except Exception as e:
+            print(f"OCR pool job failed ({e}), falling back to pytesseract.")
+            _fallbacks += 1
+    return _pytesseract_image_to_string(job.image, OCR_LANG)
+
+
+def image_to_string(image: np.ndarray) -> str:
+    """Runs OCR on a grayscale or BGR image array using the configured engine."""
+    return collect(submit(image))
+
+
+def get_ocr_stats() -> dict:
+    return {
+        "engine": "tesserocr" if pool_enabled() else "pytesseract",
+        "pool_size": OCR_POOL_SIZE,
+        "fallbacks": _fallbacks,
+        **(_pool.stats if _pool is not None else {}),
+    }
@@ -0,0 +1,160 @@
+"""Precompiled regex rule pack for invoice field extraction.
+
+Every rule is compiled once, at import. Rules with ``keywords`` are anchored:
+the OCR text is lowercased once, each keyword is located with find (a C
+substring scan, far cheaper than a case-insensitive regex search), and the
+rule's pattern is only tried with ``match`` at keyword hits that start a
+word. Rules without keywords (dates, GSTIN) fall back to one ``search``;
+their patterns start with a digit class, which re scans quickly on its own.
+The earliest match of each rule wins, which mirrors one re.search per field.
+
+A combined ``(?=(?P<r0>...)|(?P<r1>...)|...)`` alternation was measured
+first and was several times slower than the per-field searches it replaced:
+CPython's re tries every branch at every position and cannot skip ahead
+under IGNORECASE. See benchmarks/bench_regex_rules.py.
+
+Rules are plain dicts so the pack can be extended or overridden from a JSON
+file (REGEX_RULES_PATH), matched by name:
+
+    {"name": "po_number", "keywords": ["po"], "pattern": "PO\\\\s*(?P<value>\\\\d+)", "ignore_case": true, "type": "text"}
+
+Each pattern must capture the field with a ``(?P<value>...)`` group and, when
+``keywords`` is given, must start with one of them. ``type`` is "text",
+"amount" or "currency".
+"""
+import json
+import re
+from typing import Optional
+
+from config import REGEX_RULES_PATH
+
+_DATE = r"\d{4}-\d{2}-\d{2}|\d{2}[-/.]\d{2}[-/.]\d{4}|\d{1,2}\s+[A-Za-z]{3,9},?\s+\d{4}"
+_AMOUNT = r"[₹$€£]?\s*(?:Rs\.?|INR|USD|EUR|GBP)?\s*(?P<value>[\d,]+(?:\.\d+)?)"
+
+BUILTIN_RULES = [
+    {
+        "name": "invoice_number",
+        "keywords": ["inv", "bill", "receipt #", "ref"],
+        "pattern": r"(?:Invoice No|Invoice|Inv|Bill No|Receipt #|Ref|Bill Ref)\s*[:#]*\s*(?P<value>[a-zA-Z0-9\-/]+)",
+        "ignore_case": True,
+    },
+    {
+        "name": "due_date",
+        "keywords": ["due", "payment"],
+        "pattern": r"(?:Due\s*Date|Payment\s*Due|Due\s*By)\s*[:\-]?\s*(?P<value>" + _DATE + ")",
+        "ignore_case": True,
+    },
+    {
+        "name": "date",
+        "pattern": r"(?P<value>\d{4}-\d{2}-\d{2}|\d{2}[-/]\d{2}[-/]\d{4})",
+    },
+    {
+        "name": "total_amount",
+        "keywords": ["total", "amount due", "sum"],
+        "pattern": r"(?:Total|Amount Due|Sum)\s*[:\s]*[₹$€£]?\s*(?P<value>[\d,\.]+)",
+        "ignore_case": True,
+        "type": "amount",
+    },
+    {
+        "name": "tax_amount",
+        "keywords": ["total", "tax", "gst", "igst", "cgst", "sgst", "vat"],
+        "pattern": r"(?:Total\s+Tax|Tax\s+Amount|GST\s+Amount|IGST|CGST|SGST|VAT|GST|Tax)"
+                   r"\s*(?:\(?\s*@?\s*\d+(?:\.\d+)?\s*%\s*\)?)?\s*[:\-]?\s*" + _AMOUNT,
+        "ignore_case": True,
+        "type": "amount",
+    },
+    {
+        "name": "gstin",
+        "pattern": r"(?P<value>\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z])(?![0-9A-Z])",
+    },
+    {
+        "name": "purchase_order_number",
+        "keywords": ["p.o", "po", "purchase"],
+        "pattern": r"(?:P\.?O\.?(?![a-z])|Purchase\s+Order)\s*(?:No\.?|Number|#)?\s*[:#]?\s*(?P<value>[A-Z0-9][A-Z0-9\-/]{2,})",
+        "ignore_case": True,
+    },
+    {
+        "name": "currency",
+        "keywords": ["₹", "$", "€", "£", "rs", "inr", "usd", "eur", "gbp", "aud", "cad", "sgd", "aed", "jpy"],
+        "pattern": r"(?P<value>INR|USD|EUR|GBP|AUD|CAD|SGD|AED|JPY|Rs\.?|[₹$€£])(?![A-Za-z])",
+        "type": "currency",
+    },
+    {
+        "name": "vendor_name",
+        "keywords": ["vendor details"],
+        "pattern": r"(?:Vendor Details\s*Name:)\s*(?P<value>[a-zA-Z \t\.]+)",
+        "ignore_case": True,
+    },
+]
+
+CURRENCY_SYMBOLS = {"₹": "INR", "Rs": "INR", "Rs.": "INR", "$": "USD", "€": "EUR", "£": "GBP"}
+
+
+def _convert(value: str, value_type: str):
+    if value_type == "amount":
+        try:
+            return float(value.replace(",", ""))
+        except ValueError:
+            return None
+    if value_type == "currency":
+        return CURRENCY_SYMBOLS.get(value, value.upper())
+    return value.strip()
+
+
+class RegexRuleEngine:
+    def __init__(self, rules: list):
+        self.rules = rules
+        self._compiled = []
+        for rule in rules:
+            if "(?P<value>" not in rule["pattern"]:
+                raise ValueError(f"Regex rule '{rule['name']}' has no (?P<value>...) group")
+            pattern = re.compile(rule["pattern"], re.IGNORECASE if rule.get("ignore_case") else 0)
+            # ASCII keywords are looked up in a lowercased ASCII copy of the text; the
+            # rest (currency symbols) in the text itself, case-sensitively.
+            keywords = [
+                (True, keyword.lower().encode("ascii")) if keyword.isascii() else (False, keyword)
+                for keyword in rule.get("keywords") or []
+            ]
+            self._compiled.append((rule["name"], keywords, pattern, rule.get("type", "text")))
+
+    @staticmethod
+    def _first_anchored(text: str, lowered: bytes, keywords: list, pattern: re.Pattern) -> Optional[re.Match]:
+        best, end = None, len(text)
+        for in_lowered, keyword in keywords:
+            haystack = lowered if in_lowered else text
+            # Only look before the best hit so far; a later keyword hit can't win.
+            pos = haystack.find(keyword, 0, end)
+            while pos != -1:
+                if not (pos and lowered[pos - 1:pos].isalnum()):
+                    match = pattern.match(text, pos)
+                    if match:
+                        best, end = match, pos
+                        break
+                pos = haystack.find(keyword, pos + 1, end)
+        return best
+
+    def extract(self, text: str) -> dict:
+        """Returns {rule name: first converted match or None} for every rule."""
+        # One byte per character (non-ASCII becomes "?"), so offsets line up with ``text``.
+        lowered = text.encode("ascii", "replace").lower()
+        found = {}
+        for name, keywords, pattern, value_type in self._compiled:
+            if keywords:
+                match = self._first_anchored(text, lowered, keywords, pattern)
+            else:
+                match = pattern.search(text)
+            found[name] = _convert(match.group("value"), value_type) if match else None
+        return found
+
+
+def load_rules(path: Optional[str] = REGEX_RULES_PATH) -> list:
+    """Built-in rules, with same-named rules replaced and new ones appended from the JSON file at ``path``."""
+    rules = {rule["name"]: rule for rule in BUILTIN_RULES}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for rule in json.load(f):
+                rules[rule["name"]] = rule
+    return list(rules.values())
+
+
+default_engine = RegexRuleEngine(load_rules())
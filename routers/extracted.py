@@ -1,18 +1,103 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+import json
+import uuid
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
-from db.database import get_db
-from db import extracted
+from db.database import get_async_db, get_db
+from db import extracted, batches, progress
+from db.batches import BatchCreateRequest, BatchCreatedResponse, BatchStatusResponse
 from db.extracted import ExtractedFileResponse
 from db.table_models import ExtractedFileDB, FileDB, ExtractionStatus
 from auth.dependencies import get_current_user
+from routers.http_cache import CACHE_CONTROL, etag_matches, not_modified
 
 router = APIRouter(prefix="/extract", tags=["Extraction"])
 
+@router.post("/batch", response_model=BatchCreatedResponse, status_code=status.HTTP_202_ACCEPTED)
+def extract_batch(
+    request: BatchCreateRequest,
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user)
+):
+    """Queues extraction for the given file ids, or for all of the user's pending files."""
+    result = batches.create(db, user, request)
+    if not result:
+        raise HTTPException(status_code=404, detail="No matching files to extract.")
+    return result
+
+@router.get("/batch/{batch_id}", response_model=BatchStatusResponse)
+async def get_batch_status(
+    batch_id: uuid.UUID,
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_current_user)
+):
+    result = await batches.get_status(db, user, batch_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Batch not found.")
+    return result
+
+@router.get("/events")
+async def stream_progress(
+    file_ids: Optional[List[uuid.UUID]] = Query(None),
+    user=Depends(get_current_user)
+):
+    """
+    Server-Sent Events replacing status polling: a "progress" event for every
+    status or stage change of the user's extractions (only ``file_ids``, if given).
+
+    The stream opens with the current state of ``file_ids``, or of every
+    pending and processing extraction. A "resync" event means events may have
+    been lost; re-read the state with GET. Browsers need a fetch-based
+    EventSource, since the stream requires the Authorization header.
+    """
+    async def body():
+        async for kind, data in progress.events(user, file_ids):
+            # Comment lines keep idle connections open through proxies.
+            yield ": keepalive\n\n" if kind is None else f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/{file_id}", response_model=ExtractedFileResponse)
+async def get_extraction(
+    file_id: uuid.UUID,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None),
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_current_user)
+):
+    """
+    The extraction result as it stands, whatever its status. Never starts an extraction.
+
+    Pollers should send the last ETag back in If-None-Match: while the row is
+    unchanged the answer is a 304, found without reading extracted_text or json_data.
+    """
+    etag = await extracted.get_etag(db, user, file_id)
+    if not etag:
+        raise HTTPException(status_code=404, detail="Extraction not found.")
+    if etag_matches(if_none_match, etag):
+        return not_modified({"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+    result = await extracted.get_result(db, user, file_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Extraction not found.")
+    # The row may have changed since the ETag query; describe the version being sent.
+    response.headers["ETag"] = extracted.etag_for(result.id, result.updated_at)
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return result
+
 @router.post("/{file_id}", response_model=ExtractedFileResponse)
 def extract_file(
     file_id: str,
+    response: Response,
     force: bool = Query(default=False, description="Force re-extraction even if already done."),
+    bypass_llm_cache: bool = Query(default=False, description="Call the LLM even if a cached answer exists for this OCR text."),
     db: Session = Depends(get_db),
     user=Depends(get_current_user)
 ):
@@ -27,10 +112,15 @@ def extract_file(
     )
     if existing and existing.status == ExtractionStatus.done and not force:
         print("Returning Existing")
+        response.headers["ETag"] = extracted.etag_for(existing.id, existing.updated_at)
         return existing
 
     # Run fresh extraction
-    result = extracted.run_extraction(db, user, file_id)
+    result = extracted.run_extraction(
+        db, user, file_id, reuse_duplicates=not force, bypass_llm_cache=bypass_llm_cache
+    )
     if not result:
         raise HTTPException(status_code=404, detail="File not found or not authorized.")
+    # Lets the caller poll GET /extract/{file_id} with If-None-Match from here on.
+    response.headers["ETag"] = extracted.etag_for(result.id, result.updated_at)
     return result
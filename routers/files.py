@@ -1,18 +1,38 @@
+import unicodedata
 import uuid
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from email.utils import format_datetime
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, UploadFile, status
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from urllib.parse import quote
 
-from db.database import get_db
+from db.database import get_async_db, get_db
 from auth.dependencies import get_current_user
+from auth.file_encryption import DecryptionError
+from routers.http_cache import CACHE_CONTROL, etag_matches, not_modified, not_modified_since
+from storage import StorageUnavailable
+from config import BULK_UPLOAD_MAX_FILES, FILES_PAGE_SIZE_DEFAULT, FILES_PAGE_SIZE_MAX
+from db.extracted import ExtractionStatus
 from db.files import (
+    UPLOAD_CONTENT_TYPES,
+    BulkUploadResponse,
     FileResponse,
     DecryptedFileResponse,
+    InvalidCursor,
+    fileType,
+    content_type_for,
     get,
+    get_owned,
+    open_plaintext,
+    page_etag,
     save,
+    save_many,
     list,
     delete,
-    # delete_all,
+    delete_where,
 )
 
 router = APIRouter(prefix="/files", tags=["files"])
@@ -23,19 +43,64 @@ def upload_file(
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user),
 ):  
-    if file.content_type not in ["image/png", "image/jpg"]:
+    if file.content_type not in UPLOAD_CONTENT_TYPES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Unsupported file type. Only PDF, PNG, and JPG are allowed.",
         )
     return save(db, current_user, file)
 
-@router.get("/", response_model=List[FileResponse])
-def get_files(
+@router.post("/upload/bulk", response_model=BulkUploadResponse)
+def upload_files(
+    files: List[UploadFile] = File(...),
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user),
 ):
-    return list(db, current_user)
+    """Many files in one multipart request. Each item reports its own success or error."""
+    if len(files) > BULK_UPLOAD_MAX_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {BULK_UPLOAD_MAX_FILES} files per bulk upload.",
+        )
+    return save_many(db, current_user, files)
+
+@router.get("/", response_model=List[FileResponse])
+async def get_files(
+    response: Response,
+    limit: int = Query(FILES_PAGE_SIZE_DEFAULT, ge=1, le=FILES_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    status: Optional[ExtractionStatus] = None,
+    filetype: Optional[fileType] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    if_none_match: Optional[str] = Header(default=None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_user),
+):
+    """
+    Newest first, at most ``limit`` files (FILES_PAGE_SIZE_DEFAULT unless given). When more
+    files remain, X-Next-Cursor holds the cursor for the next page.
+
+    This endpoint used to return every file at once. Clients that need them all must follow
+    X-Next-Cursor until it is absent.
+
+    Pollers should send the last ETag back in If-None-Match: an unchanged page is a 304.
+    """
+    try:
+        files, next_cursor = await list(
+            db, current_user, limit, cursor,
+            status=status, filetype=filetype, created_from=created_from, created_to=created_to,
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {"ETag": page_etag(files, next_cursor), "Cache-Control": CACHE_CONTROL}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if etag_matches(if_none_match, headers["ETag"]):
+        return not_modified(headers)
+    response.headers.update(headers)
+    return files
 
 @router.get("/{file_id}", response_model=DecryptedFileResponse)
 def get_file(
@@ -43,11 +108,119 @@ def get_file(
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user),
 ):
+    """Compatibility mode: whole file as base64 in JSON. Prefer GET /files/{file_id}/content."""
     result = get(db, current_user, file_id)
     if not result:
         raise HTTPException(status_code=404, detail="File not found or decryption failed")
     return result
 
+
+def _content_disposition(filename: str) -> str:
+    """
+    ``inline`` with the name in both forms (RFC 6266): ``filename*`` in UTF-8 for
+    clients that read it, and an ASCII ``filename`` fallback for those that don't.
+    """
+    fallback = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+    fallback = "".join(c if c.isprintable() and c not in '"\\' else "_" for c in fallback).strip() or "file"
+    return f"inline; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def _parse_range(range_header: Optional[str], size: int):
+    """
+    Parses a single-range ``Range`` header into ``(start, stop)``.
+
+    Returns None when the whole body should be sent (no header, unsupported
+    unit, multiple ranges or bad syntax) and raises 416 when the range cannot
+    be satisfied.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    first, _, last = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            stop = int(last) + 1 if last else size
+        elif last:
+            start = max(size - int(last), 0)
+            stop = size
+        else:
+            return None
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    if stop <= start:
+        return None
+    return start, min(stop, size)
+
+@router.get("/{file_id}/content")
+def get_file_content(
+    file_id: uuid.UUID,
+    range_header: Optional[str] = Header(default=None, alias="Range"),
+    if_range: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+    if_modified_since: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """Streams the decrypted file chunk by chunk. Supports single byte ranges and conditional GETs."""
+    file = get_owned(db, current_user, file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Stored blobs are immutable, so the file id identifies the representation.
+    etag = f'"{file.id}"'
+    last_modified = file.created_at.replace(tzinfo=timezone.utc)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": CACHE_CONTROL,
+    }
+
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            return not_modified(headers)
+    elif not_modified_since(if_modified_since, last_modified):
+        return not_modified(headers)
+
+    try:
+        blob, view = open_plaintext(current_user, file)
+    except StorageUnavailable:
+        raise
+    except (DecryptionError, OSError):
+        raise HTTPException(status_code=404, detail="File not found or decryption failed")
+
+    try:
+        byte_range = None
+        if if_range is None or if_range.strip() == etag:
+            byte_range = _parse_range(range_header, view.size)
+    except HTTPException:
+        blob.close()
+        raise
+
+    start, stop = byte_range or (0, view.size)
+    headers["Content-Length"] = str(stop - start)
+    headers["Content-Disposition"] = _content_disposition(file.filename)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{view.size}"
+
+    def body():
+        with blob:
+            yield from view.iter_range(start, stop)
+
+    return StreamingResponse(
+        body(),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type=content_type_for(file.filename),
+        headers=headers,
+    )
+
 @router.delete("/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_file(
     file_id: uuid.UUID,
@@ -58,10 +231,22 @@ def delete_file(
         raise HTTPException(status_code=404, detail="File not found")
     return
 
-# @router.delete("/everything", response_model=dict)
-# def delete_all_files(
-#     db: Session = Depends(get_db),
-#     current_user=Depends(get_current_user),
-# ):
-#     count = delete_all(db, current_user)
-#     return {"deleted": count}
+@router.delete("/", response_model=dict)
+def delete_files(
+    file_ids: Optional[List[uuid.UUID]] = Query(None),
+    status: Optional[ExtractionStatus] = None,
+    filetype: Optional[fileType] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    all: bool = Query(False, description="Required to delete every file when no filter is given."),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """Deletes the files matching every given filter. Blobs are unlinked in the background."""
+    if not (file_ids or status or filetype or created_from or created_to or all):
+        raise HTTPException(status_code=400, detail="Give at least one filter, or all=true to delete every file.")
+    count = delete_where(
+        db, current_user,
+        file_ids=file_ids, status=status, filetype=filetype, created_from=created_from, created_to=created_to,
+    )
+    return {"deleted": count}
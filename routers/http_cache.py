@@ -0,0 +1,36 @@
+"""Conditional GET helpers shared by the routers.
+
+Responses carry a strong ETag and ``Cache-Control: private, max-age=0,
+must-revalidate``: the browser may keep a copy but has to ask before every
+reuse, and a matching ``If-None-Match`` is answered with an empty 304.
+"""
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from fastapi import status
+from fastapi.responses import Response
+
+# Per-user data: never in shared caches, always revalidated.
+CACHE_CONTROL = "private, max-age=0, must-revalidate"
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires."""
+    if not header:
+        return False
+    candidates = [c.strip().removeprefix("W/") for c in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def not_modified_since(header: Optional[str], last_modified) -> bool:
+    if not header:
+        return False
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return last_modified.replace(microsecond=0) <= since
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
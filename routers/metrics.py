@@ -0,0 +1,35 @@
+from fastapi import APIRouter
+
+from auth.dependencies import get_principal_cache_stats
+from auth.encryption import get_key_cache_stats
+from auth.passwords import get_password_hashing_stats
+from db.blob_reclaim import get_reclaim_stats
+from db.database import get_pool_stats
+from db.dedup import get_dedup_stats
+from db.llm_cache import get_llm_cache_stats
+from db.progress import get_progress_stats
+from models.extract_entities import get_local_llm_stats
+from models.image_preprocessing import get_preprocessing_stats
+from models.llm_dispatcher import get_dispatcher_stats
+from models.llm_providers import get_llm_provider_stats
+from models.ocr_engine import get_ocr_stats
+
+router = APIRouter(prefix="/metrics", tags=["health"])
+
+@router.get("/")
+def get_metrics():
+    return {
+        "db_pool": get_pool_stats(),
+        "principal_cache": get_principal_cache_stats(),
+        "fernet_key_cache": get_key_cache_stats(),
+        "password_hashing": get_password_hashing_stats(),
+        "ocr": get_ocr_stats(),
+        "ocr_preprocessing": get_preprocessing_stats(),
+        "upload_dedup": get_dedup_stats(),
+        "blob_reclaim": get_reclaim_stats(),
+        "progress_events": get_progress_stats(),
+        "llm_cache": get_llm_cache_stats(),
+        "llm_provider": get_llm_provider_stats(),
+        "llm_dispatcher": get_dispatcher_stats(),
+        "local_llm": get_local_llm_stats(),
+    }
@@ -2,11 +2,17 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from db.database import get_db
+from auth.dependencies import get_current_user, invalidate_principal
+from auth.encryption import invalidate_user_fernet_key
+from auth.passwords import PasswordHasherBusy
 from auth.jwt_handler import create_access_token
 from db.users import (
+    PasswordChangeRequest,
     UserResponse,
     TokenResponse,
+    change_password,
     create,
+    delete,
     get_by_username,
     verify,
 )
@@ -17,21 +23,29 @@ router = APIRouter(
     tags=["users"],
 )
 
+def _busy() -> HTTPException:
+    # The bcrypt executor (auth/passwords.py) is saturated; shed instead of queueing.
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many password checks in progress, retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
 @router.post("/login", response_model=TokenResponse)
 def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
-    user = get_by_username(db, form_data.username)
-    if user is None:
-        raise HTTPException(status_code=400, detail="Invalid credentials")
-
     print(f"Attempting login for user: {form_data.username}")
-    user = verify(db, form_data.username, form_data.password)
+    try:
+        user = verify(db, form_data.username, form_data.password)
+    except PasswordHasherBusy:
+        raise _busy()
     if not user:
         raise HTTPException(status_code=400, detail="Invalid credentials")
 
-    token_data = {"sub": user.username}
+    # "uid" lets get_current_user resolve the principal by primary key.
+    token_data = {"sub": user.username, "uid": str(user.id)}
     token = create_access_token(token_data, expires_delta=timedelta(minutes=30))
 
     return TokenResponse(
@@ -46,6 +60,31 @@ def register(user_name: str, password: str, db: Session = Depends(get_db)):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already exists",
         )
-    new_user = create(db, user_name, password)
+    try:
+        new_user = create(db, user_name, password)
+    except PasswordHasherBusy:
+        raise _busy()
     return new_user
 
+@router.post("/me/password", status_code=status.HTTP_204_NO_CONTENT)
+def update_password(
+    request: PasswordChangeRequest,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    try:
+        changed = change_password(db, current_user.id, request.current_password, request.new_password)
+    except PasswordHasherBusy:
+        raise _busy()
+    if not changed:
+        raise HTTPException(status_code=400, detail="Invalid credentials")
+    invalidate_principal(current_user.id)
+
+@router.delete("/me", status_code=status.HTTP_204_NO_CONTENT)
+def delete_me(
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    delete(db, current_user)
+    invalidate_principal(current_user.id)
+    invalidate_user_fernet_key(current_user.username)
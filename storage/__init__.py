@@ -0,0 +1,44 @@
+"""Blob storage backends for the encrypted invoice files (see storage/base.py)."""
+import threading
+from typing import Optional
+
+from config import (
+    LOCAL_STORAGE_DIR,
+    LOCAL_STORAGE_FSYNC,
+    S3_BUCKET,
+    S3_ENDPOINT_URL,
+    S3_PREFIX,
+    S3_READ_BUFFER_SIZE,
+    S3_REGION,
+    STORAGE_BACKEND,
+)
+from storage.base import BlobNotFound, BlobStorage, StorageUnavailable
+from storage.local import LocalStorage
+
+_storage: Optional[BlobStorage] = None
+_storage_lock = threading.Lock()
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> BlobStorage:
+    if backend == "local":
+        return LocalStorage(LOCAL_STORAGE_DIR, fsync=LOCAL_STORAGE_FSYNC)
+    if backend == "s3":
+        from storage.s3 import S3Storage
+
+        return S3Storage(
+            S3_BUCKET,
+            prefix=S3_PREFIX,
+            endpoint_url=S3_ENDPOINT_URL,
+            region=S3_REGION,
+            read_buffer_size=S3_READ_BUFFER_SIZE,
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected 'local' or 's3'.")
+
+
+def get_storage() -> BlobStorage:
+    """The configured backend, created on first use and shared by the process."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = create_storage()
+        return _storage
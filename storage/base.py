@@ -0,0 +1,45 @@
+import hashlib
+import uuid
+from abc import ABC, abstractmethod
+from typing import BinaryIO, ContextManager
+
+
+class BlobNotFound(FileNotFoundError):
+    pass
+
+
+class StorageUnavailable(OSError):
+    """The backend failed or could not be reached; the blob may well exist. Worth retrying later."""
+
+
+class BlobStorage(ABC):
+    """
+    Where encrypted invoice blobs live. files.path holds the key a backend returned from ``key_for``.
+
+    Keys fan out over two levels of hash-derived directories ("3f/a2/<id>"),
+    256 x 256 prefixes in all, so no directory or listing prefix ever holds
+    more than a small fraction of the blobs.
+    """
+
+    def key_for(self, file_id: uuid.UUID) -> str:
+        digest = hashlib.sha256(str(file_id).encode()).hexdigest()
+        return f"{digest[:2]}/{digest[2:4]}/{file_id}"
+
+    @abstractmethod
+    def open_write(self, key: str) -> ContextManager[BinaryIO]:
+        """
+        A writable file for ``key``. The blob only becomes visible, complete,
+        when the block exits without an exception; otherwise nothing is left behind.
+        """
+
+    @abstractmethod
+    def open_read(self, key: str) -> BinaryIO:
+        """A seekable, readable file over the blob. Raises BlobNotFound. The caller must close it."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Removes the blob; a missing blob is not an error."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether the blob is there. Raises StorageUnavailable when that can't be told."""
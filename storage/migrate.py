@@ -0,0 +1,111 @@
+"""One-shot move of blobs from the old flat LOCAL_STORAGE_DIR layout into the configured backend.
+
+Rows whose files.path is still "<LOCAL_STORAGE_DIR>/<id>_<name>" are copied to
+their sharded key in the STORAGE_BACKEND storage (local or S3), repointed, and
+committed a batch at a time. Only then are the flat files removed, so the tool
+can be stopped and rerun at any point, with the API serving throughout:
+
+    python -m storage.migrate --dry-run
+    python -m storage.migrate --batch-size 500
+
+A row deleted while its blob is being copied keeps its old path in the
+reclaim queue, and the copy is removed again. Blob paths of the old layout
+still waiting in blob_reclaim are unlinked here too, since a non-local
+backend can't resolve them.
+"""
+import argparse
+import shutil
+
+from sqlalchemy import delete, select, update
+
+from config import LOCAL_STORAGE_DIR
+from db.database import SessionLocal
+from db.table_models import BlobReclaimDB, FileDB
+from storage import get_storage
+from storage.local import LocalStorage
+
+
+def _copy(source: LocalStorage, target, key: str, new_key: str):
+    with source.open_read(key) as src, target.open_write(new_key) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def migrate_files(batch_size: int, dry_run: bool, keep_source: bool) -> dict:
+    source = LocalStorage(LOCAL_STORAGE_DIR, fsync=False)
+    target = get_storage()
+    counts = {"moved": 0, "missing": 0, "gone": 0}
+    last_id = None
+    db = SessionLocal()
+    try:
+        while True:
+            query = select(FileDB.id, FileDB.path).order_by(FileDB.id).limit(batch_size)
+            if last_id is not None:
+                query = query.where(FileDB.id > last_id)
+            rows = db.execute(query).all()
+            if not rows:
+                return counts
+            last_id = rows[-1].id
+
+            moved = []
+            for row in rows:
+                if not source.is_legacy_key(row.path):
+                    continue
+                if not source.exists(row.path):
+                    print(f"Missing blob for file {row.id}: {row.path}")
+                    counts["missing"] += 1
+                    continue
+                if dry_run:
+                    counts["moved"] += 1
+                    continue
+
+                new_key = target.key_for(row.id)
+                _copy(source, target, row.path, new_key)
+                repointed = db.execute(
+                    update(FileDB).where(FileDB.id == row.id, FileDB.path == row.path).values(path=new_key)
+                ).rowcount
+                if repointed:
+                    moved.append(row.path)
+                else:
+                    target.delete(new_key)
+                    counts["gone"] += 1
+            db.commit()
+
+            counts["moved"] += len(moved)
+            if not keep_source:
+                for path in moved:
+                    source.delete(path)
+            if moved:
+                print(f"Migrated {counts['moved']} blobs so far")
+    finally:
+        db.close()
+
+
+def reclaim_legacy(dry_run: bool) -> int:
+    source = LocalStorage(LOCAL_STORAGE_DIR, fsync=False)
+    db = SessionLocal()
+    try:
+        entries = [entry for entry in db.execute(select(BlobReclaimDB.id, BlobReclaimDB.path)) if source.is_legacy_key(entry.path)]
+        if not dry_run:
+            for entry in entries:
+                source.delete(entry.path)
+            db.execute(delete(BlobReclaimDB).where(BlobReclaimDB.id.in_([entry.id for entry in entries])))
+            db.commit()
+        return len(entries)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be moved.")
+    parser.add_argument("--keep-source", action="store_true", help="Leave the flat files in place after copying.")
+    args = parser.parse_args()
+
+    counts = migrate_files(args.batch_size, args.dry_run, args.keep_source)
+    counts["reclaimed"] = reclaim_legacy(args.dry_run)
+    print(("Would migrate: " if args.dry_run else "Done: ") + ", ".join(f"{k}={v}" for k, v in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Blobs in an S3-compatible bucket.
+
+Reads are ranged GETs behind a read buffer, so PlaintextView only fetches
+the encrypted records a byte range overlaps instead of the whole object.
+Writes are spooled locally and uploaded with a single PUT (multipart for
+large files) when the block exits, which S3 makes visible atomically.
+
+Credentials come from the usual boto3 chain (AWS_ACCESS_KEY_ID, instance
+role, ...). S3_ENDPOINT_URL points it at any S3-compatible server, e.g. a
+local stand-in for development:
+
+    python -m moto.server -p 9000
+    STORAGE_BACKEND=s3 S3_BUCKET=invoices S3_ENDPOINT_URL=http://127.0.0.1:9000 \
+        AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test uvicorn main:app
+"""
+import contextlib
+import io
+import tempfile
+
+from storage.base import BlobNotFound, BlobStorage, StorageUnavailable
+
+
+def _is_not_found(error) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+@contextlib.contextmanager
+def _translate_errors(key: str):
+    """
+    Turns botocore's exceptions into OSErrors, which is what callers of a
+    BlobStorage catch: BlobNotFound for a missing object, StorageUnavailable
+    for everything else (throttling, 5xx, bad credentials, no connection).
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    try:
+        yield
+    except ClientError as e:
+        if _is_not_found(e):
+            raise BlobNotFound(key) from e
+        raise StorageUnavailable(f"S3 request for {key} failed: {e}") from e
+    except BotoCoreError as e:
+        raise StorageUnavailable(f"S3 request for {key} failed: {e}") from e
+
+
+class _RangeReader(io.RawIOBase):
+    def __init__(self, client, bucket: str, key: str, size: int):
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._size = size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = self._size + offset
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self._size or not len(buffer):
+            return 0
+        end = min(self._pos + len(buffer), self._size) - 1
+        with _translate_errors(self._key):
+            body = self._client.get_object(Bucket=self._bucket, Key=self._key, Range=f"bytes={self._pos}-{end}")["Body"]
+            data = body.read()
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class S3Storage(BlobStorage):
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: str = "",
+        region: str = "",
+        read_buffer_size: int = 1024 * 1024,
+        spool_size: int = 8 * 1024 * 1024,
+    ):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs boto3 (pip install boto3).")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs S3_BUCKET.")
+
+        self._client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region or None)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.read_buffer_size = read_buffer_size
+        self.spool_size = spool_size
+
+    def _object_key(self, key: str) -> str:
+        return self.prefix + key
+
+    @contextlib.contextmanager
+    def open_write(self, key: str):
+        with tempfile.SpooledTemporaryFile(max_size=self.spool_size) as spool:
+            yield spool
+            spool.seek(0)
+            with _translate_errors(key):
+                self._client.upload_fileobj(spool, self.bucket, self._object_key(key))
+
+    def _head(self, key: str) -> dict:
+        with _translate_errors(key):
+            return self._client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def open_read(self, key: str):
+        size = self._head(key)["ContentLength"]
+        raw = _RangeReader(self._client, self.bucket, self._object_key(key), size)
+        return io.BufferedReader(raw, buffer_size=self.read_buffer_size)
+
+    def delete(self, key: str) -> None:
+        # DeleteObject succeeds for missing keys too.
+        with _translate_errors(key):
+            self._client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._head(key)
+            return True
+        except BlobNotFound:
+            return False
@@ -0,0 +1,50 @@
+import inspect
+import ssl
+
+import asyncpg
+import certifi
+import pytest
+from sqlalchemy.dialects.postgresql.asyncpg import dialect
+
+from db.database import async_connect_options
+
+
+def test_plain_url_only_swaps_the_driver():
+    url, connect_args = async_connect_options("postgresql://u:p@db.example.com:5432/invoices")
+    assert url.render_as_string(hide_password=False) == "postgresql+asyncpg://u:p@db.example.com:5432/invoices"
+    assert connect_args == {}
+
+
+def test_unix_socket_host_is_kept():
+    url, connect_args = async_connect_options("postgresql://postgres:@/postgres?host=/var/run/postgresql")
+    assert dict(url.query) == {"host": "/var/run/postgresql"}
+    assert connect_args == {}
+
+
+@pytest.mark.parametrize("mode", ["disable", "prefer", "require", "verify-full"])
+def test_sslmode_becomes_ssl(mode):
+    url, connect_args = async_connect_options(f"postgresql://u:p@host/db?sslmode={mode}")
+    assert dict(url.query) == {}
+    assert connect_args == {"ssl": mode}
+
+
+def test_libpq_parameters_are_translated_or_dropped():
+    url, connect_args = async_connect_options(
+        "postgresql://u:p@host/db?sslmode=require&connect_timeout=10&application_name=api"
+        "&keepalives=1&gssencmode=disable&target_session_attrs=read-write"
+    )
+    assert dict(url.query) == {"target_session_attrs": "read-write"}
+    assert connect_args == {"ssl": "require", "timeout": 10.0, "server_settings": {"application_name": "api"}}
+
+
+def test_verify_ca_with_root_certificate():
+    _, connect_args = async_connect_options(f"postgresql://u:p@host/db?sslmode=verify-ca&sslrootcert={certifi.where()}")
+    context = connect_args["ssl"]
+    assert isinstance(context, ssl.SSLContext)
+    assert context.verify_mode == ssl.CERT_REQUIRED and not context.check_hostname
+
+
+def test_asyncpg_accepts_the_translated_arguments():
+    url, connect_args = async_connect_options("postgresql://u:p@host/db?sslmode=require&connect_timeout=5&keepalives=1")
+    _, kwargs = dialect().create_connect_args(url)
+    assert set(kwargs) | set(connect_args) <= set(inspect.signature(asyncpg.connect).parameters)
@@ -0,0 +1,18 @@
+from urllib.parse import unquote
+
+import pytest
+
+from routers.files import _content_disposition
+
+
+@pytest.mark.parametrize("filename", ["invoice.pdf", "fäktura ü.pdf", "请求.png", 'a"b\\c.pdf', "a\r\nb.pdf"])
+def test_header_is_latin1_and_round_trips(filename):
+    header = _content_disposition(filename)
+    header.encode("latin-1")
+    assert "\r" not in header and "\n" not in header
+    assert unquote(header.split("filename*=UTF-8''")[1]) == filename
+
+
+def test_ascii_fallback_escapes_quotes():
+    assert _content_disposition('a"b.pdf').startswith('inline; filename="a_b.pdf";')
+    assert _content_disposition("fäktura.pdf").startswith('inline; filename="faktura.pdf";')
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import re
+
+import pytest
+
+from models.llm_dispatcher import LlmDispatcher
+
+INVOICE = re.compile(r"### INVOICE (\d+) ###\nInvoice No: (\S+)")
+
+
+class FakeClient:
+    """Answers packed prompts with one object per invoice, echoing its invoice number."""
+
+    def __init__(self, index_as_str: bool = False, drop_last: bool = False):
+        self.index_as_str = index_as_str
+        self.drop_last = drop_last
+        self.prompts = []
+
+    async def agenerate(self, prompt: str, timeout=None) -> str:
+        self.prompts.append(prompt)
+        invoices = INVOICE.findall(prompt)
+        if not invoices:
+            number = re.search(r"Invoice No: (\S+)", prompt).group(1)
+            return json.dumps({"invoice_number": number})
+        if self.drop_last:
+            invoices = invoices[:-1]
+        return json.dumps([
+            {"index": index if self.index_as_str else int(index), "invoice_number": number}
+            for index, number in reversed(invoices)
+        ])
+
+
+def _texts(count: int, user: str = "a") -> list:
+    return [f"Invoice No: {user}-{i}\nTotal: {i}.00" for i in range(count)]
+
+
+def _run(client: FakeClient, texts: list, pack_max_items: int, user_ids=None) -> tuple:
+    async def run():
+        dispatcher = LlmDispatcher(client, requests_per_minute=6000, pack_max_items=pack_max_items, pack_max_chars=100000)
+        users = user_ids or [None] * len(texts)
+        results = await asyncio.gather(*(dispatcher.extract(text, user) for text, user in zip(texts, users)))
+        return results, dispatcher.stats
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("count", [2, 9, 10, 11, 12, 25])
+def test_pack_is_demultiplexed_in_order(count):
+    texts = _texts(count)
+    client = FakeClient()
+    results, stats = _run(client, texts, pack_max_items=count)
+
+    assert [r["invoice_number"] for r in results] == [f"a-{i}" for i in range(count)]
+    assert all("index" not in r for r in results)
+    assert stats["packed_calls"] == 1 and stats["unpack_failures"] == 0
+    assert len(client.prompts) == 1
+
+
+def test_string_indexes_are_accepted():
+    results, stats = _run(FakeClient(index_as_str=True), _texts(12), pack_max_items=12)
+    assert [r["invoice_number"] for r in results] == [f"a-{i}" for i in range(12)]
+    assert stats["unpack_failures"] == 0
+
+
+def test_incomplete_pack_answer_falls_back_to_single_calls():
+    client = FakeClient(drop_last=True)
+    results, stats = _run(client, _texts(11), pack_max_items=11)
+    assert [r["invoice_number"] for r in results] == [f"a-{i}" for i in range(11)]
+    assert stats["unpack_failures"] == 1
+    assert len(client.prompts) == 1 + 11
+
+
+def test_packs_never_mix_users():
+    texts = _texts(3, "a") + _texts(3, "b")
+    client = FakeClient()
+    results, stats = _run(client, texts, pack_max_items=6, user_ids=["a"] * 3 + ["b"] * 3)
+
+    assert [r["invoice_number"] for r in results] == [f"a-{i}" for i in range(3)] + [f"b-{i}" for i in range(3)]
+    assert stats["packed_calls"] == 2
+    for prompt in client.prompts:
+        owners = {number.split("-")[0] for _, number in INVOICE.findall(prompt)}
+        assert len(owners) == 1
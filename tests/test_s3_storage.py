@@ -0,0 +1,78 @@
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from storage.base import BlobNotFound, StorageUnavailable
+from storage.s3 import S3Storage
+
+BUCKET = "invoices"
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield S3Storage(BUCKET, prefix="blobs/", region="us-east-1", read_buffer_size=16, spool_size=64)
+
+
+def test_write_then_read(storage):
+    data = bytes(range(256)) * 10
+    with storage.open_write("ab/cd/file") as f:
+        f.write(data)
+
+    assert storage.exists("ab/cd/file")
+    with storage.open_read("ab/cd/file") as blob:
+        assert blob.read() == data
+
+
+def test_ranged_read(storage):
+    data = bytes(range(256)) * 10
+    with storage.open_write("key") as f:
+        f.write(data)
+
+    with storage.open_read("key") as blob:
+        blob.seek(1000)
+        assert blob.read(100) == data[1000:1100]
+        blob.seek(-10, 2)
+        assert blob.read() == data[-10:]
+
+
+def test_failed_write_leaves_nothing(storage):
+    with pytest.raises(ValueError):
+        with storage.open_write("key") as f:
+            f.write(b"partial")
+            raise ValueError
+    assert not storage.exists("key")
+
+
+def test_missing_blob(storage):
+    with pytest.raises(BlobNotFound):
+        storage.open_read("missing")
+    assert not storage.exists("missing")
+    storage.delete("missing")
+
+
+def test_delete(storage):
+    with storage.open_write("key") as f:
+        f.write(b"x")
+    storage.delete("key")
+    assert not storage.exists("key")
+
+
+def test_missing_bucket_is_unavailable_not_missing_blob(storage):
+    storage.bucket = "no-such-bucket"
+    with pytest.raises(StorageUnavailable):
+        storage.open_read("key")
+
+
+def test_client_errors_are_oserrors(storage, monkeypatch):
+    def throttled(**kwargs):
+        raise ClientError({"Error": {"Code": "SlowDown", "Message": "Please reduce your request rate."}}, "HeadObject")
+
+    monkeypatch.setattr(storage._client, "head_object", throttled)
+    with pytest.raises(OSError) as raised:
+        storage.open_read("key")
+    assert isinstance(raised.value, StorageUnavailable)